@@ -16,9 +16,11 @@ from common import LoggerFactory
 from fastapi import APIRouter
 from fastapi import Depends
 from fastapi_utils.cbv import cbv
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.sql import select
 
+from dependencies import get_executor_manager
 from models.api_archive import ArchiveDELETERequest
 from models.api_archive import ArchiveGETRequest
 from models.api_archive import ArchiveGETResponse
@@ -51,27 +53,31 @@ class ArchiveList:
             api_response.code = EAPIResponseCode.not_found
             api_response.result = 'Archive preview not found'
             return api_response.json_response()
-        api_response.result = json.loads(archive_model.archive_preview)
+        api_response.result = await get_executor_manager.run_sync(json.loads, archive_model.archive_preview)
         return api_response.json_response()
 
     @router.post('/archive', response_model=ArchivePOSTResponse, summary='Create a zip preview')
     async def post(self, data: ArchivePOSTRequest, db: AsyncSession = Depends(get_db_session)):
         """Create a ZIP preview given a file_id and preview as a dict."""
         file_id = data.file_id
-        archive_preview = json.dumps(data.archive_preview)
+        archive_preview = await get_executor_manager.run_sync(json.dumps, data.archive_preview)
         self._logger.info('POST zip preview for: ' + str(file_id))
         api_response = ArchivePOSTResponse()
         try:
-            query = await db.execute(select(ArchivePreviewModel).filter_by(file_id=file_id))
-            query_result = query.scalars().first()
-            if query_result:
+            # ON CONFLICT (file_id) relies on the unique index added by migration 527245fb639e
+            query = await db.execute(
+                insert(ArchivePreviewModel)
+                .values(file_id=file_id, archive_preview=archive_preview)
+                .on_conflict_do_nothing(index_elements=[ArchivePreviewModel.file_id])
+                .returning(ArchivePreviewModel.id)
+            )
+            inserted = query.scalar()
+            await db.commit()
+            if inserted is None:
                 self._logger.info(f'Duplicate entry for file_id: {file_id}')
                 api_response.code = EAPIResponseCode.conflict
                 api_response.result = 'Duplicate entry for preview'
                 return api_response.json_response()
-            archive_model = ArchivePreviewModel(file_id=file_id, archive_preview=archive_preview)
-            db.add(archive_model)
-            await db.commit()
         except Exception as e:
             self._logger.error('Psql error: ' + str(e))
             api_response.error_msg = 'Psql error: ' + str(e)
@@ -10,6 +10,7 @@
 # You should have received a copy of the GNU Affero General Public License along with this program. If not, see
 # http://www.gnu.org/licenses/.
 
+from typing import Dict
 from typing import Optional
 
 from common import LoggerFactory
@@ -19,13 +20,21 @@ from fastapi_utils.cbv import cbv
 
 from api.api_file_operations.copy_dispatcher import CopyDispatcher
 from api.api_file_operations.delete_dispatcher import DeleteDispatcher
+from config import ConfigClass
 from models import file_ops_models as models
 from models.base_models import APIResponse
 from models.base_models import EAPIResponseCode
 from resources.error_handler import catch_internal
+from resources.helpers import gather_bounded
+from resources.metadata_cache import metadata_cache
 
 router = APIRouter()
 
+JOB_DISPATCHERS = {
+    'copy': CopyDispatcher,
+    'delete': DeleteDispatcher,
+}
+
 
 @cbv(router)
 class FileOperations:
@@ -51,10 +60,7 @@ class FileOperations:
 
         self._logger.info(f'Request tokens: {token}.')
 
-        job_dispatcher = {
-            'copy': CopyDispatcher,
-            'delete': DeleteDispatcher,
-        }.get(data.operation, None)
+        job_dispatcher = JOB_DISPATCHERS.get(data.operation, None)
         api_response = APIResponse()
         if not job_dispatcher:
             api_response.code = EAPIResponseCode.bad_request
@@ -67,3 +73,56 @@ class FileOperations:
         api_response.result = result
 
         return api_response.json_response()
+
+    @router.post(
+        '/batch',
+        response_model=models.FileOperationsBatchResponse,
+        summary='File operations api, invoke async file operation jobs of several operations',
+    )
+    @catch_internal('api_file_operations')
+    async def post_batch(
+        self,
+        data: models.FileOperationsBatchPOST,
+        authorization: Optional[str] = Header(None),
+        refresh_token: Optional[str] = Header(None),
+    ):
+        """Dispatch the operations concurrently and report the jobs or the error of each of them."""
+
+        token = {
+            'at': authorization,
+            'rt': refresh_token,
+        }
+
+        api_response = APIResponse()
+        api_response.result = await gather_bounded(
+            [self.execute_batch_item(item, token) for item in data.items], ConfigClass.FILE_OPERATION_CONCURRENCY
+        )
+        return api_response.json_response()
+
+    async def execute_batch_item(
+        self, data: models.FileOperationsPOST, token: Dict[str, Optional[str]]
+    ) -> models.FileOperationsBatchResult:
+        job_dispatcher = JOB_DISPATCHERS.get(data.operation, None)
+        if not job_dispatcher:
+            return models.FileOperationsBatchResult(
+                code=EAPIResponseCode.bad_request.value, error_msg='Invalid operation'
+            )
+        try:
+            code, result = await job_dispatcher().execute(self._logger, data, token)
+        except Exception as e:
+            self._logger.error(f'Failed to dispatch {data.operation} operation: {e}')
+            return models.FileOperationsBatchResult(code=EAPIResponseCode.internal_error.value, error_msg=str(e))
+        if code != EAPIResponseCode.accepted:
+            return models.FileOperationsBatchResult(code=code.value, error_msg=result)
+        return models.FileOperationsBatchResult(code=code.value, result=result)
+
+    @router.get(
+        '/metadata-cache',
+        response_model=models.MetadataCacheGETResponse,
+        summary='Hit and miss counters of the metadata item cache used to validate file operations',
+    )
+    @catch_internal('api_file_operations')
+    async def get_metadata_cache_stats(self):
+        api_response = APIResponse()
+        api_response.result = metadata_cache.get_stats()
+        return api_response.json_response()
@@ -18,13 +18,12 @@ from typing import List
 from typing import Tuple
 from typing import Union
 
-import httpx
-
 from api.api_file_operations.dispatcher import BaseDispatcher
-from config import ConfigClass
+from api.api_file_operations.dispatcher import ItemList
 from models import file_ops_models as models
 from models.base_models import EAPIResponseCode
 from resources.helpers import fetch_geid
+from resources.queue_outbox import notify_queue_outbox
 from resources.redis_project_session_job import SessionJob
 
 
@@ -36,10 +35,11 @@ class CopyDispatcher(BaseDispatcher):
     ) -> Tuple[EAPIResponseCode, Union[str, List[Dict[str, Any]]]]:
         """Execute copy logic."""
 
-        if not await self.is_valid_folder(data.payload.source):
+        valid_source, valid_destination = await self.validate_folders(data.payload.source, data.payload.destination)
+        if not valid_source:
             return EAPIResponseCode.bad_request, f'Invalid source: {data.payload.source}'
 
-        if not await self.is_valid_folder(data.payload.destination):
+        if not valid_destination:
             return EAPIResponseCode.bad_request, f'Invalid destination: {data.payload.destination}'
 
         try:
@@ -47,13 +47,21 @@ class CopyDispatcher(BaseDispatcher):
         except ValueError as e:
             return EAPIResponseCode.bad_request, str(e)
 
+        jobs = await self.create_jobs(_logger, data, auth_token, targets)
+        return EAPIResponseCode.accepted, jobs
+
+    async def create_job(
+        self, _logger, data: models.FileOperationsPOST, auth_token: Dict[str, str], targets: ItemList
+    ) -> Dict[str, Any]:
+        """Create the copy job of the targets and add its message to the queue outbox."""
+
         job_geid = fetch_geid()
         session_job = SessionJob(
             data.session_id, data.project_code, 'data_transfer', data.operator, task_id=data.task_id
         )
 
         try:
-            await session_job.set_job_id(job_geid)
+            session_job.set_job_id(job_geid)
             session_job.set_progress(0)
             session_job.set_source(', '.join(targets.names))
             session_job.set_status(models.EActionState.RUNNING.name)
@@ -76,15 +84,16 @@ class CopyDispatcher(BaseDispatcher):
                 },
                 'create_timestamp': time.time(),
             }
-            _logger.info('Sending Message To Queue: ' + str(payload))
-            async with httpx.AsyncClient() as client:
-                response = await client.post(url=f'{ConfigClass.QUEUE_SERVICE}send_message', json=payload)
-            _logger.info(f'Message To Queue has been sent: {response.text}')
-            await session_job.save()
+            _logger.info(
+                f'Adding {payload["event_type"]} message of job {job_geid} with {len(targets)} targets to queue outbox'
+            )
+            session_job.set_message(payload)
+            await session_job.create()
+            notify_queue_outbox()
         except Exception as e:
             exception_message = str(e)
             session_job.set_status(models.EActionState.TERMINATED.name)
             session_job.add_payload('error', exception_message)
             await session_job.save()
 
-        return EAPIResponseCode.accepted, [session_job.to_dict()]
+        return session_job.to_dict()
@@ -18,13 +18,13 @@ from typing import List
 from typing import Tuple
 from typing import Union
 
-import httpx
-
 from api.api_file_operations.dispatcher import BaseDispatcher
+from api.api_file_operations.dispatcher import ItemList
 from config import ConfigClass
 from models import file_ops_models as models
 from models.base_models import EAPIResponseCode
 from resources.helpers import fetch_geid
+from resources.queue_outbox import notify_queue_outbox
 from resources.redis_project_session_job import SessionJob
 
 
@@ -44,11 +44,19 @@ class DeleteDispatcher(BaseDispatcher):
         except ValueError as e:
             return EAPIResponseCode.bad_request, str(e)
 
+        jobs = await self.create_jobs(_logger, data, auth_token, targets)
+        return EAPIResponseCode.accepted, jobs
+
+    async def create_job(
+        self, _logger, data: models.FileOperationsPOST, auth_token: Dict[str, str], targets: ItemList
+    ) -> Dict[str, Any]:
+        """Create the delete job of the targets and add its message to the queue outbox."""
+
         job_geid = fetch_geid()
         session_job = SessionJob(data.session_id, data.project_code, 'data_delete', data.operator, task_id=data.task_id)
 
         try:
-            await session_job.set_job_id(job_geid)
+            session_job.set_job_id(job_geid)
             session_job.set_progress(0)
             session_job.set_source(', '.join(targets.names))
             session_job.set_status(models.EActionState.RUNNING.name)
@@ -73,15 +81,16 @@ class DeleteDispatcher(BaseDispatcher):
                 },
                 'create_timestamp': time.time(),
             }
-            _logger.info('Sending Message To Queue: ' + str(payload))
-            async with httpx.AsyncClient() as client:
-                response = await client.post(url=f'{ConfigClass.QUEUE_SERVICE}send_message', json=payload)
-            _logger.info(f'Message To Queue has been sent: {response.text}')
-            await session_job.save()
+            _logger.info(
+                f'Adding {payload["event_type"]} message of job {job_geid} with {len(targets)} targets to queue outbox'
+            )
+            session_job.set_message(payload)
+            await session_job.create()
+            notify_queue_outbox()
         except Exception as e:
             exception_message = str(e)
             session_job.set_status(models.EActionState.TERMINATED.name)
             session_job.add_payload('error', exception_message)
             await session_job.save()
 
-        return EAPIResponseCode.accepted, [session_job.to_dict()]
+        return session_job.to_dict()
@@ -18,9 +18,12 @@ from typing import Dict
 from typing import List
 from typing import Set
 
+from config import ConfigClass
+from models.file_ops_models import FileOperationsPOST
 from models.file_ops_models import FileOperationTarget
-from resources.helpers import get_resource_by_id
+from resources.helpers import gather_bounded
 from resources.helpers import get_resource_type
+from resources.metadata_client import MetadataClient
 
 
 @unique
@@ -72,27 +75,62 @@ class ItemList(list):
 class BaseDispatcher:
     """Base class for all dispatcher implementations."""
 
-    async def is_valid_folder(self, item_id: str) -> bool:
-        resource = await get_resource_by_id(item_id)
+    def __init__(self) -> None:
+        self.metadata_client = MetadataClient()
+
+    def is_folder(self, resource: Dict[str, Any]) -> bool:
         resource_type = get_resource_type([resource['type']])
         if resource_type in [ResourceType.NAME_FOLDER, ResourceType.FOLDER, ResourceType.CONTAINER]:
             return True
 
         return False
 
+    async def is_valid_folder(self, item_id: str) -> bool:
+        resource = await self.metadata_client.get_by_id(item_id)
+        return self.is_folder(resource)
+
+    async def validate_folders(self, *item_ids: str) -> List[bool]:
+        """Check whether each of the items is a folder, fetching them in batches."""
+
+        resources = await self.metadata_client.get_by_ids(list(item_ids))
+        return [self.is_folder(resource) for resource in resources]
+
+    def validate_target(self, target: FileOperationTarget, source: Dict[str, Any]) -> None:
+        if not source:
+            raise ValueError(f'Not found resource: {target.id}')
+        if source['archived'] is True:
+            raise ValueError(f'Archived files should not perform further file actions: {target.id}')
+        resource_type = get_resource_type([source['type']])
+        if resource_type not in [ResourceType.FILE, ResourceType.FOLDER]:
+            raise ValueError(f'Invalid target type (only support File or Folder): {source}')
+
     async def validate_targets(self, targets: List[FileOperationTarget]) -> ItemList:
-        fetched = []
-        for target in targets:
-            source = await get_resource_by_id(target.id)
-            if not source:
-                raise ValueError(f'Not found resource: {target.id}')
-            if source['archived'] is True:
-                raise ValueError(f'Archived files should not perform further file actions: {target.id}')
-            resource_type = get_resource_type([source['type']])
-            if resource_type not in [ResourceType.FILE, ResourceType.FOLDER]:
-                raise ValueError(f'Invalid target type (only support File or Folder): {source}')
-            fetched.append(source)
+        """Fetch the targets in batches and validate them, stopping at the first missing target."""
+
+        fetched = await self.metadata_client.get_by_ids([target.id for target in targets])
+        for target, source in zip(targets, fetched):
+            self.validate_target(target, source)
         return ItemList(fetched)
 
+    async def create_jobs(
+        self, _logger, data: FileOperationsPOST, auth_token: Dict[str, str], targets: ItemList
+    ) -> List[Dict[str, Any]]:
+        """Create one job for each chunk of at most FILE_OPERATION_MAX_TARGETS_PER_JOB targets concurrently."""
+
+        chunk_size = ConfigClass.FILE_OPERATION_MAX_TARGETS_PER_JOB
+        chunks = []
+        for start in range(0, len(targets), chunk_size):
+            end = start + chunk_size
+            chunks.append(ItemList(targets[start:end]))
+        return await gather_bounded(
+            [self.create_job(_logger, data, auth_token, chunk) for chunk in chunks or [targets]],
+            ConfigClass.FILE_OPERATION_CONCURRENCY,
+        )
+
+    async def create_job(
+        self, _logger, data: FileOperationsPOST, auth_token: Dict[str, str], targets: ItemList
+    ) -> Dict[str, Any]:
+        raise NotImplementedError
+
     def execute(self, *args, **kwds):
         raise NotImplementedError
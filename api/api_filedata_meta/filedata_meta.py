@@ -13,12 +13,14 @@
 
 import uuid
 
-import httpx
 from common import LoggerFactory
 from fastapi import APIRouter
+from fastapi import Depends
 from fastapi_utils.cbv import cbv
 
 from config import ConfigClass
+from dependencies import HTTPClientManager
+from dependencies import get_http_client_manager
 from models import filemeta_models as models
 from resources.cataloguing_manager import CataLoguingManager
 from resources.error_handler import catch_internal
@@ -28,6 +30,8 @@ router = APIRouter()
 
 @cbv(router)
 class FiledataMeta:
+    http_client_manager: HTTPClientManager = Depends(get_http_client_manager)
+
     def __init__(self):
         self._logger = LoggerFactory('api_file_meta').get_logger()
 
@@ -67,10 +71,10 @@ class FiledataMeta:
             'tags': data.labels,
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(ConfigClass.METADATA_SERVICE + 'item/', json=data, timeout=10)
-            if response.status_code != 200:
-                raise Exception('Fail to create metadata in postgres: %s' % (response.__dict__))
-            api_response.result = response.json().get('result', {})
+        client = self.http_client_manager.get_client('metadata')
+        response = await client.post(ConfigClass.METADATA_SERVICE + 'item/', json=data, timeout=10)
+        if response.status_code != 200:
+            raise Exception('Fail to create metadata in postgres: %s' % (response.__dict__))
+        api_response.result = response.json().get('result', {})
 
         return api_response.json_response()
@@ -11,26 +11,38 @@
 # You should have received a copy of the GNU Affero General Public License along with this program. If not,
 # see http://www.gnu.org/licenses/.
 
+import math
 from typing import List
+from typing import Optional
 from typing import Tuple
+from uuid import uuid4
 
 from common import LoggerFactory
 from fastapi import APIRouter
 from fastapi import Depends
+from fastapi import Query
 from fastapi.responses import JSONResponse
 from fastapi_utils.cbv import cbv
 from pydantic import BaseModel
 
+from api.api_resource_lock.lock_engine import LockEngine
+from config import Settings
+from config import get_settings
 from dependencies import Cache
 
 # from dependencies import get_cache
 from dependencies.cache import CacheInstance
 from models.base_models import EAPIResponseCode
+from models.resource_lock_reqres import ResourceLockBulkCheckRequestBody
+from models.resource_lock_reqres import ResourceLockBulkRenewRequestBody
 from models.resource_lock_reqres import ResourceLockBulkRequestBody
 from models.resource_lock_reqres import ResourceLockBulkResponse
+from models.resource_lock_reqres import ResourceLockListResponse
+from models.resource_lock_reqres import ResourceLockRenewRequestBody
 from models.resource_lock_reqres import ResourceLockRequestBody
 from models.resource_lock_reqres import ResourceLockResponse
 from models.resource_lock_reqres import ResourceLockResponseResult
+from models.resource_lock_reqres import ResourceLockState
 from resources.error_handler import catch_internal
 
 logger = LoggerFactory('api_resource_lock').get_logger()
@@ -41,6 +53,7 @@ cache_conn = CacheInstance
 
 class BulkLockResult(BaseModel):
     status: List[Tuple[str, bool]]
+    fencing_token: Optional[int]
 
     def is_successful(self) -> bool:
         """Return true if all statuses are true."""
@@ -49,51 +62,114 @@ class BulkLockResult(BaseModel):
 
 
 class ResourceLocker:
-    def __init__(self, cache: Cache = Depends(cache_conn.get_cache)) -> None:
-        self._cache = cache
+    def __init__(
+        self, cache: Cache = Depends(cache_conn.get_cache), settings: Settings = Depends(get_settings)
+    ) -> None:
+        self._engine = LockEngine(
+            cache.redis,
+            hierarchical=settings.RESOURCE_LOCK_HIERARCHICAL,
+            namespace=settings.RESOURCE_LOCK_NAMESPACE,
+            layout=settings.RESOURCE_LOCK_LAYOUT,
+            fencing=settings.RESOURCE_LOCK_REQUIRE_FENCING_TOKEN,
+        )
+        self._default_ttl = settings.RESOURCE_LOCK_DEFAULT_TTL
+        self._max_wait_timeout = settings.RESOURCE_LOCK_MAX_WAIT_TIMEOUT
+        self._require_fencing_token = settings.RESOURCE_LOCK_REQUIRE_FENCING_TOKEN
 
-    def str_to_int_list(self, input_: bytes) -> List[int]:
-        return [int(x) for x in input_.decode('utf-8').split(',')]
+    def get_lease(self, lease_id: Optional[str], ttl: Optional[int]) -> Tuple[Optional[str], Optional[int]]:
+        """Return lease id and ttl for a new lock.
 
-    def int_list_to_str(self, input_: List[int]) -> str:
-        return ','.join([str(x) for x in input_])
+        The default ttl is used when the ttl is not provided and the lease id is generated when it is not provided.
+        Both values are None for locks without lease.
+        """
 
-    async def perform_bulk_lock(self, keys: List[str], operation: str) -> BulkLockResult:
-        """Perform bulk lock for multiple keys.
+        ttl = ttl or self._default_ttl
+        if not ttl:
+            return None, None
 
-        If one of the lock attempts fails, the locking attempts of the following keys are stopped.
-        """
+        return lease_id or uuid4().hex, ttl
 
-        keys = sorted(keys)
-        status = []
-        have_failed_lock = False
+    def is_fencing_token_missing(self, fencing_token: Optional[int]) -> bool:
+        """Return true if the fencing token is required to unlock or renew but it is not provided."""
+
+        return self._require_fencing_token and fencing_token is None
+
+    async def get_status(self, key: str) -> Optional[str]:
+        """Return "<read_count>,<write_count>" for the key or None if the key is not locked."""
+
+        return await self._engine.get_status(key)
 
-        for key in keys:
-            if have_failed_lock:
-                status.append((key, False))
-                continue
+    async def get_states(self, keys: List[str]) -> List[ResourceLockState]:
+        """Return the lock state for each key in one round trip."""
 
-            is_successful = await self.perform_rw_lock(key, operation)
-            status.append((key, is_successful))
+        return await self._engine.inspect(keys)
 
-            if not is_successful:
-                have_failed_lock = True
+    async def list_locks(
+        self, prefix: str, owner: Optional[str], older_than: Optional[int], page: int, page_size: int
+    ) -> Tuple[int, List[ResourceLockState]]:
+        """Return the total number of locks and the page of locks matching the filter."""
 
-        return BulkLockResult(status=status)
+        return await self._engine.list_locks(prefix, owner, older_than, page * page_size, page_size)
 
-    async def perform_bulk_unlock(self, keys: List[str], operation: str) -> BulkLockResult:
+    async def perform_bulk_lock(
+        self,
+        keys: List[str],
+        operation: str,
+        lease_id: Optional[str] = None,
+        ttl: Optional[int] = None,
+        owner: Optional[str] = None,
+    ) -> BulkLockResult:
+        """Perform bulk lock for multiple keys.
+
+        Keys are locked in sorted order within one atomic operation. If one of the lock attempts fails, the locking
+        attempts of the following keys are stopped and the locks acquired for the preceding keys are rolled back.
+        """
+
+        keys = sorted(keys)
+        fencing_token, status = await self._engine.bulk_acquire(keys, operation, lease_id, ttl, owner)
+        if fencing_token:
+            logger.info(f'Add {operation} lock to {len(keys)} keys with fencing token {fencing_token}')
+
+        return BulkLockResult(status=list(zip(keys, status)), fencing_token=fencing_token)
+
+    async def perform_bulk_unlock(
+        self,
+        keys: List[str],
+        operation: str,
+        lease_id: Optional[str] = None,
+        owner: Optional[str] = None,
+        fencing_token: Optional[int] = None,
+    ) -> BulkLockResult:
         """Perform bulk unlock for multiple keys."""
 
         keys = sorted(keys)
-        status = []
+        status = await self._engine.bulk_unlock(keys, operation, lease_id, owner, fencing_token)
+        logger.info(f'Remove {operation} lock to {sum(status)} of {len(keys)} keys')
+
+        return BulkLockResult(status=list(zip(keys, status)))
 
-        for key in keys:
-            is_successful = await self.perform_rw_unlock(key, operation)
-            status.append((key, is_successful))
+    async def perform_bulk_renew(
+        self, keys: List[str], lease_id: str, ttl: int, fencing_token: Optional[int] = None
+    ) -> BulkLockResult:
+        """Renew the lease for multiple keys.
 
-        return BulkLockResult(status=status)
+        Renewal of one key doesn't depend on the others, keys with expired lease are reported as false.
+        """
 
-    async def perform_rw_lock(self, key: str, operation: str) -> bool:
+        keys = sorted(keys)
+        status = await self._engine.bulk_renew(keys, lease_id, ttl, fencing_token)
+
+        return BulkLockResult(status=list(zip(keys, status)))
+
+    async def perform_rw_lock(
+        self,
+        key: str,
+        operation: str,
+        lease_id: Optional[str] = None,
+        ttl: Optional[int] = None,
+        wait_timeout: Optional[float] = None,
+        owner: Optional[str] = None,
+    ) -> Optional[int]:
         """
         Description:
             An async function will do the read/write lock on the key.
@@ -108,47 +184,48 @@ class ResourceLocker:
             The write will increase one, if there a write operation(eg.delete). And
             any other operation will be blocked.
             ---
-            Therefore, the value pairs will be (N, 0), (0, 1). Also to avoid the racing
-            condition, the await keyword will be used for the function.
+            Therefore, the value pairs will be (N, 0), (0, 1). To avoid the racing
+            condition between workers, the check and the update are done by one
+            Lua script executed atomically on the Redis side.
+            ---
+            When the lease is provided, the holder is released automatically
+            after ttl seconds unless the lease is renewed.
+            ---
+            With the wait_timeout the request waits in the FIFO queue of the
+            key until the lock is released, instead of failing right away.
+            While requests are waiting, the new ones can't skip the queue.
+            ---
+            Every successful lock gets a new fencing token, which is greater
+            than all tokens issued before. The token identifies the holder for
+            unlock and renew, and downstream writes can reject stale tokens.
         Parameters:
             - key: the object path in minio (eg. <bucket>/file.py)
             - operation: either read or write
+            - lease_id: the identifier of the lease or None for lock without expiration
+            - ttl: the lease duration in seconds
+            - wait_timeout: seconds to wait for the lock, limited by the settings
+            - owner: the label of the holder to find the lock in the registry
         Return:
-            - True: the lock operation is success
-            - False: the other operation blocks the current one
+            - fencing token: the lock operation is success
+            - None: the other operation blocks the current one
         """
-        if await self._cache.is_exist(key):
-            rw_str = await self._cache.get(key)
-            # index 0 is read_count, index 1 is write_count
-            read_count, write_count = tuple(self.str_to_int_list(rw_str))
-            logger.info(f'Found key:{key}, with r/w {read_count}/{write_count}')
-
-            # read_count > 0 -> block write
-            if read_count > 0 and operation == 'write':
-                return False
-            # write_count > 0 -> block all
-            elif write_count > 0:
-                return False
-
-        # TODO might refactor here later
-        if operation == 'read':
-            # check if the key exist, if not exist then create pair with (1,0)
-            # else increase the read count(index 0) by one
-            if await self._cache.is_exist(key):
-                rw_str = await self._cache.get(key)
-                read_count, write_count = tuple(self.str_to_int_list(rw_str))
-                await self._cache.set(key, self.int_list_to_str([read_count + 1, write_count]))
-            else:
-                await self._cache.set(key, '1,0')
-
-        else:
-            await self._cache.set(key, '0,1')
-
-        logger.info(f'Add {operation} lock to {key}')
-
-        return True
-
-    async def perform_rw_unlock(self, key: str, operation: str) -> bool:
+        if wait_timeout:
+            wait_timeout = min(wait_timeout, self._max_wait_timeout)
+
+        fencing_token = await self._engine.acquire(key, operation, lease_id, ttl, wait_timeout, owner)
+        if fencing_token:
+            logger.info(f'Add {operation} lock to {key} with fencing token {fencing_token}')
+
+        return fencing_token
+
+    async def perform_rw_unlock(
+        self,
+        key: str,
+        operation: str,
+        lease_id: Optional[str] = None,
+        owner: Optional[str] = None,
+        fencing_token: Optional[int] = None,
+    ) -> bool:
         """
         Description:
             An async function to reduce the read_write count based on key.
@@ -160,42 +237,25 @@ class ResourceLocker:
             to check the validation, the pair must be "0,1". Otherwise, we might
             remove the read count by accident.
             ---
-            Also to avoid the racing issue, we use the awwait
+            Same as the lock, the whole operation is one atomic Lua script.
+            ---
+            The fencing token or the lease_id releases that particular holder.
+            Without them the holder without lease is released first.
         Parameters:
             - key: the object path in minio (eg. <bucket>/file.py)
             - operation: either read or write
+            - lease_id: the identifier of the lease to release
+            - owner: the label of the holder without lease to release
+            - fencing_token: the token of the holder to release
         Return:
             - True: the lock operation is success
             - False: the other operation blocks the current one
         """
-        # we cannot unlock the IDLE file
-        if not await self._cache.is_exist(key):
-            return False
-
-        # TODO: might need some check here
-        # delete cannot just remove the entry
-        rw_str = await self._cache.get(key)
-        read_count, write_count = tuple(self.str_to_int_list(rw_str))
-        logger.info(f'Found key:{key}, with r/w {read_count}/{write_count}')
-        if operation == 'read':
-            # if the current read operation is the last one
-            # then we just remove the entry for cleanup
-            if read_count > 1:
-                await self._cache.set(key, self.int_list_to_str([read_count - 1, write_count]))
-            else:
-                await self._cache.delete(key)
-
-        else:
-            # corner case if there are some read operation ongoing(readcount>0)
-            # we should block the delete on the key
-            if read_count > 0:
-                return False
-            else:
-                await self._cache.delete(key)
-
-        logger.info(f'Remove {operation} lock to {key}')
-
-        return True
+        is_successful = await self._engine.unlock(key, operation, lease_id, owner, fencing_token)
+        if is_successful:
+            logger.info(f'Remove {operation} lock to {key}')
+
+        return is_successful
 
 
 @cbv(router)
@@ -203,11 +263,20 @@ class RLock:
     @router.post('/', response_model=ResourceLockResponse, summary='Create a new lock')
     @catch_internal('api_resource_lock')
     async def lock(self, data: ResourceLockRequestBody, resource_locker: ResourceLocker = Depends()) -> JSONResponse:
-        unlocked = await resource_locker.perform_rw_lock(data.resource_key, data.operation)
+        lease_id, ttl = resource_locker.get_lease(data.lease_id, data.ttl)
+        fencing_token = await resource_locker.perform_rw_lock(
+            data.resource_key, data.operation, lease_id, ttl, data.wait_timeout, data.owner
+        )
+
+        result = ResourceLockResponseResult(key=data.resource_key)
+        if fencing_token:
+            result = ResourceLockResponseResult(
+                key=data.resource_key, lease_id=lease_id, owner=data.owner, fencing_token=fencing_token
+            )
 
         api_response = ResourceLockResponse(
-            code=EAPIResponseCode.success if unlocked else EAPIResponseCode.conflict,
-            result=ResourceLockResponseResult(key=data.resource_key),
+            code=EAPIResponseCode.success if fencing_token else EAPIResponseCode.conflict,
+            result=result,
         )
 
         return api_response.json_response()
@@ -217,11 +286,17 @@ class RLock:
     async def bulk_lock(
         self, body: ResourceLockBulkRequestBody, resource_locker: ResourceLocker = Depends()
     ) -> JSONResponse:
-        lock_result = await resource_locker.perform_bulk_lock(body.resource_keys, body.operation)
+        lease_id, ttl = resource_locker.get_lease(body.lease_id, body.ttl)
+        lock_result = await resource_locker.perform_bulk_lock(
+            body.resource_keys, body.operation, lease_id, ttl, body.owner
+        )
 
         api_response = ResourceLockBulkResponse(
             code=EAPIResponseCode.success if lock_result.is_successful() else EAPIResponseCode.conflict,
             result=lock_result.status,
+            lease_id=lease_id if lock_result.is_successful() else None,
+            owner=body.owner if lock_result.is_successful() else None,
+            fencing_token=lock_result.fencing_token,
         )
 
         return api_response.json_response()
@@ -229,7 +304,17 @@ class RLock:
     @router.delete('/', response_model=ResourceLockResponse, summary='Remove a lock')
     @catch_internal('api_resource_lock')
     async def unlock(self, data: ResourceLockRequestBody, resource_locker: ResourceLocker = Depends()) -> JSONResponse:
-        flag = await resource_locker.perform_rw_unlock(data.resource_key, data.operation)
+        if resource_locker.is_fencing_token_missing(data.fencing_token):
+            api_response = ResourceLockResponse(
+                code=EAPIResponseCode.bad_request,
+                error_msg='Fencing token is required',
+                result=ResourceLockResponseResult(key=data.resource_key),
+            )
+            return api_response.json_response()
+
+        flag = await resource_locker.perform_rw_unlock(
+            data.resource_key, data.operation, data.lease_id, data.owner, data.fencing_token
+        )
 
         api_response = ResourceLockResponse(
             code=EAPIResponseCode.success if flag else EAPIResponseCode.bad_request,
@@ -243,7 +328,15 @@ class RLock:
     async def bulk_unlock(
         self, body: ResourceLockBulkRequestBody, resource_locker: ResourceLocker = Depends()
     ) -> JSONResponse:
-        lock_result = await resource_locker.perform_bulk_unlock(body.resource_keys, body.operation)
+        if resource_locker.is_fencing_token_missing(body.fencing_token):
+            api_response = ResourceLockBulkResponse(
+                code=EAPIResponseCode.bad_request, error_msg='Fencing token is required', result=[]
+            )
+            return api_response.json_response()
+
+        lock_result = await resource_locker.perform_bulk_unlock(
+            body.resource_keys, body.operation, body.lease_id, body.owner, body.fencing_token
+        )
 
         api_response = ResourceLockBulkResponse(
             code=EAPIResponseCode.success if lock_result.is_successful() else EAPIResponseCode.bad_request,
@@ -252,12 +345,59 @@ class RLock:
 
         return api_response.json_response()
 
+    @router.post('/renew', response_model=ResourceLockResponse, summary='Renew a lock lease')
+    @catch_internal('api_resource_lock')
+    async def renew(
+        self, data: ResourceLockRenewRequestBody, resource_locker: ResourceLocker = Depends()
+    ) -> JSONResponse:
+        if resource_locker.is_fencing_token_missing(data.fencing_token):
+            api_response = ResourceLockResponse(
+                code=EAPIResponseCode.bad_request,
+                error_msg='Fencing token is required',
+                result=ResourceLockResponseResult(key=data.resource_key),
+            )
+            return api_response.json_response()
+
+        lock_result = await resource_locker.perform_bulk_renew(
+            [data.resource_key], data.lease_id, data.ttl, data.fencing_token
+        )
+
+        api_response = ResourceLockResponse(
+            code=EAPIResponseCode.success if lock_result.is_successful() else EAPIResponseCode.not_found,
+            result=ResourceLockResponseResult(
+                key=data.resource_key, lease_id=data.lease_id, fencing_token=data.fencing_token
+            ),
+        )
+
+        return api_response.json_response()
+
+    @router.post('/bulk/renew', response_model=ResourceLockBulkResponse, summary='Renew multiple lock leases')
+    @catch_internal('api_resource_lock')
+    async def bulk_renew(
+        self, body: ResourceLockBulkRenewRequestBody, resource_locker: ResourceLocker = Depends()
+    ) -> JSONResponse:
+        if resource_locker.is_fencing_token_missing(body.fencing_token):
+            api_response = ResourceLockBulkResponse(
+                code=EAPIResponseCode.bad_request, error_msg='Fencing token is required', result=[]
+            )
+            return api_response.json_response()
+
+        lock_result = await resource_locker.perform_bulk_renew(
+            body.resource_keys, body.lease_id, body.ttl, body.fencing_token
+        )
+
+        api_response = ResourceLockBulkResponse(
+            code=EAPIResponseCode.success if lock_result.is_successful() else EAPIResponseCode.not_found,
+            result=lock_result.status,
+            lease_id=body.lease_id,
+        )
+
+        return api_response.json_response()
+
     @router.get('/', response_model=ResourceLockResponse, summary='Check a lock')
     @catch_internal('api_resource_lock')
-    async def check_lock(self, resource_key: str, cache: Cache = Depends(cache_conn.get_cache)) -> JSONResponse:
-        result = await cache.get(resource_key)
-        if result is not None:
-            result = result.decode()
+    async def check_lock(self, resource_key: str, resource_locker: ResourceLocker = Depends()) -> JSONResponse:
+        result = await resource_locker.get_status(resource_key)
 
         api_response = ResourceLockResponse(
             code=EAPIResponseCode.success,
@@ -265,3 +405,44 @@ class RLock:
         )
 
         return api_response.json_response()
+
+    @router.post('/bulk/check', response_model=ResourceLockListResponse, summary='Check multiple locks')
+    @catch_internal('api_resource_lock')
+    async def bulk_check_lock(
+        self, body: ResourceLockBulkCheckRequestBody, resource_locker: ResourceLocker = Depends()
+    ) -> JSONResponse:
+        states = await resource_locker.get_states(body.resource_keys)
+
+        api_response = ResourceLockListResponse(result=states, total=len(states))
+
+        return api_response.json_response()
+
+    @router.get('/list', response_model=ResourceLockListResponse, summary='List locks by prefix, owner or age')
+    @catch_internal('api_resource_lock')
+    async def list_locks(
+        self,
+        prefix: str = Query('', description='List locks with keys starting with the prefix'),
+        owner: Optional[str] = Query(None, description='List locks held by the owner'),
+        older_than: Optional[int] = Query(None, ge=0, description='List locks acquired more than N seconds ago'),
+        page: int = Query(0, ge=0),
+        page_size: int = Query(25, gt=0, le=1000),
+        resource_locker: ResourceLocker = Depends(),
+    ) -> JSONResponse:
+        if sum([bool(prefix), owner is not None, older_than is not None]) > 1:
+            api_response = ResourceLockListResponse(
+                code=EAPIResponseCode.bad_request,
+                error_msg='Only one of prefix, owner or older_than can be used',
+                result=[],
+            )
+            return api_response.json_response()
+
+        total, states = await resource_locker.list_locks(prefix, owner, older_than, page, page_size)
+
+        api_response = ResourceLockListResponse(
+            result=states,
+            page=page,
+            total=total,
+            num_of_pages=math.ceil(total / page_size),
+        )
+
+        return api_response.json_response()
@@ -0,0 +1,1219 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program. If not, see
+# http://www.gnu.org/licenses/.
+
+import asyncio
+import re
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from typing import Union
+from uuid import uuid4
+from weakref import WeakKeyDictionary
+
+from aioredis.client import PubSub
+from aioredis.client import Redis
+
+from models.resource_lock_reqres import ResourceLockState
+
+# Shared helpers prepended to every script. ARGV[1] of every script enables the hierarchical locking, ARGV[2] is the
+# namespace prefixed to all keys of the resource locks, ARGV[3] is the layout of the lock entries and ARGV[4] enables
+# the fencing of holders without lease and owner.
+# With the string layout the lock entry is stored as key:"<read_count>,<write_count>", the same format the previous
+# implementation used. With the hash layout the entries are packed into "lock-shard:<bucket>" hashes, sharded by the
+# first path segment or the first two characters of keys without "/", as path -> read count, or -1 for write lock.
+# Entries of the string layout found by the hash layout are moved into the hash layout before they are read.
+# Hash fields can't expire, so keys of the hash layout where all holders are leased are indexed by the expiration of
+# the last lease in the "lock-registry:expiring" sorted set and every lock request reaps a few of the expired ones.
+#
+# Every lock request gets a fencing token from the "lock-registry:fencing_token" counter. The holders of one key are
+# recorded together in one value, as token, lease id, lease expiration timestamp (ms) and owner of every holder. The
+# value is stored as the "<key>:holders" string with the string layout and as the "<path>\n" field of the shard with
+# the hash layout, so the hash layout needs no key per lock. Since read and write locks exclude each other, all leases
+# of one key belong to the same operation. Holders without lease and owner are recorded only with fencing enabled,
+# otherwise the string layout keeps one key per such lock. Holders without record, including those acquired before the
+# holder records were introduced, are released without token, lease and owner.
+#
+# With the hierarchical locking, keys ending with "/" are folders and a lock on any key also takes an intent lock on
+# all its ancestor folders. Intents without lease are counted in the "<folder>:intents" hash, leased intents are
+# stored in the "<folder>:intents:<operation>" sorted sets as "<key>\n<lease_id>" with the lease expiration as score.
+#
+# Requests waiting for the lock are queued in the "<key>:waiters" list as "<ticket>:<deadline>" and notified through
+# the channel of the same name. While the queue is not empty, only its head may acquire the lock, so a steady stream
+# of readers can't starve a waiting writer.
+#
+# The registry indexes the locked keys without namespace in the "lock-registry:acquired" sorted set by acquisition time,
+# in the "lock-registry:keys" sorted set for prefix search and in the "lock-registry:owner:<owner>" sorted sets.
+#
+# Auxiliary keys are derived from the lock keys inside the scripts, which is fine for the standalone Redis we use.
+LUA_HELPERS = """
+local HIERARCHICAL = ARGV[1] == '1'
+local NAMESPACE = ARGV[2]
+local HASH_LAYOUT = ARGV[3] == 'hash'
+local FENCING = ARGV[4] == '1'
+local REGISTRY = NAMESPACE .. 'lock-registry:'
+local SWEEP_LIMIT = 10
+
+local function get_now()
+    local time = redis.call('TIME')
+    return tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+end
+
+local function get_path(key)
+    return string.sub(key, #NAMESPACE + 1)
+end
+
+local function get_shard(key)
+    local path = get_path(key)
+    local separator = string.find(path, '/', 1, true)
+    if separator then
+        return NAMESPACE .. 'lock-shard:' .. string.sub(path, 1, separator - 1), path
+    end
+    return NAMESPACE .. 'lock-shard:' .. string.sub(path, 1, 2), path
+end
+
+-- defined below, once the helpers it needs are defined
+local adopt_string_entry
+
+local function get_counts(key)
+    if HASH_LAYOUT then
+        adopt_string_entry(key)
+        local shard, path = get_shard(key)
+        local value = tonumber(redis.call('HGET', shard, path)) or 0
+        if value < 0 then
+            return 0, 1
+        end
+        return value, 0
+    end
+
+    local value = redis.call('GET', key)
+    if not value then
+        return 0, 0
+    end
+    local separator = string.find(value, ',', 1, true)
+    return tonumber(string.sub(value, 1, separator - 1)), tonumber(string.sub(value, separator + 1))
+end
+
+-- Return the lock status as "<read_count>,<write_count>" regardless of the layout or nil when the key is not locked.
+local function get_status(key)
+    local read_count, write_count = get_counts(key)
+    if read_count == 0 and write_count == 0 then
+        return nil
+    end
+    return string.format('%d,%d', read_count, write_count)
+end
+
+local function register(key, now)
+    local path = get_path(key)
+    redis.call('ZADD', REGISTRY .. 'acquired', 'NX', now, path)
+    redis.call('ZADD', REGISTRY .. 'keys', 'NX', 0, path)
+end
+
+local function next_token()
+    return string.format('%d', redis.call('INCR', REGISTRY .. 'fencing_token'))
+end
+
+-- Values are encoded as "<length>:<value>", so lease ids and owners may contain any character.
+local function encode(values)
+    local parts = {}
+    for index, value in ipairs(values) do
+        parts[index] = #value .. ':' .. value
+    end
+    return table.concat(parts)
+end
+
+local function decode(data)
+    local values = {}
+    local position = 1
+    while position <= #data do
+        local separator = string.find(data, ':', position, true)
+        local length = tonumber(string.sub(data, position, separator - 1))
+        table.insert(values, string.sub(data, separator + 1, separator + length))
+        position = separator + length + 1
+    end
+    return values
+end
+
+-- Return the recorded holders of the key as a list of {token, lease_id, expiration, owner}.
+local function get_holders(key)
+    local data
+    if HASH_LAYOUT then
+        adopt_string_entry(key)
+        local shard, path = get_shard(key)
+        data = redis.call('HGET', shard, path .. '\\n')
+    else
+        data = redis.call('GET', key .. ':holders')
+    end
+
+    local holders = {}
+    if not data then
+        return holders
+    end
+    local values = decode(data)
+    for index = 1, #values, 4 do
+        table.insert(holders, {
+            token = values[index],
+            lease_id = values[index + 1],
+            expiration = tonumber(values[index + 2]),
+            owner = values[index + 3],
+        })
+    end
+    return holders
+end
+
+-- Store the holders of the key, the string layout sets the expiration of the record in refresh_expiration.
+local function set_holders(key, holders)
+    local values = {}
+    for _, holder in ipairs(holders) do
+        local expiration = ''
+        if holder.expiration then
+            expiration = string.format('%d', holder.expiration)
+        end
+        for _, value in ipairs({holder.token, holder.lease_id, expiration, holder.owner}) do
+            table.insert(values, value)
+        end
+    end
+
+    if HASH_LAYOUT then
+        local shard, path = get_shard(key)
+        if #holders == 0 then
+            redis.call('HDEL', shard, path .. '\\n')
+        else
+            redis.call('HSET', shard, path .. '\\n', encode(values))
+        end
+    elseif #holders == 0 then
+        redis.call('DEL', key .. ':holders')
+    else
+        redis.call('SET', key .. ':holders', encode(values))
+    end
+end
+
+local function add_holder(key, holder, now)
+    local holders = get_holders(key)
+    table.insert(holders, holder)
+    set_holders(key, holders)
+    if holder.owner ~= '' then
+        redis.call('ZADD', REGISTRY .. 'owner:' .. holder.owner, 'NX', now, get_path(key))
+    end
+end
+
+-- Keep the holders and remove the key from the registry of the owners without any kept holder.
+local function remove_holders(key, kept, removed)
+    set_holders(key, kept)
+    local owners = {}
+    for _, holder in ipairs(kept) do
+        owners[holder.owner] = true
+    end
+    for _, holder in ipairs(removed) do
+        if holder.owner ~= '' and not owners[holder.owner] then
+            redis.call('ZREM', REGISTRY .. 'owner:' .. holder.owner, get_path(key))
+        end
+    end
+end
+
+local function unregister(key)
+    local path = get_path(key)
+    remove_holders(key, {}, get_holders(key))
+    redis.call('ZREM', REGISTRY .. 'acquired', path)
+    redis.call('ZREM', REGISTRY .. 'keys', path)
+    redis.call('ZREM', REGISTRY .. 'expiring', path)
+end
+
+-- Find the holder to release. The holder must match the token, the lease id and the owner which are provided. Without
+-- token and lease id only a holder without lease of the same owner is found, leased holders are released with their
+-- lease id or token only. Return the index of the holder, 0 for a holder without record or nil if there is no matching
+-- holder. Holders without record have no lease and owner, with fencing enabled they are not released by a token.
+local function find_holder(key, holders, lease_id, owner, token)
+    for index, holder in ipairs(holders) do
+        local matches
+        if token ~= '' then
+            matches = holder.token == token and (lease_id == '' or holder.lease_id == lease_id)
+        elseif lease_id ~= '' then
+            matches = holder.lease_id == lease_id
+        else
+            matches = holder.lease_id == ''
+        end
+        if matches and (holder.owner == owner or (owner == '' and (token ~= '' or lease_id ~= ''))) then
+            return index
+        end
+    end
+
+    if lease_id ~= '' or owner ~= '' or (token ~= '' and FENCING) then
+        return nil
+    end
+    local read_count, write_count = get_counts(key)
+    if #holders < read_count + write_count then
+        return 0
+    end
+    return nil
+end
+
+local function set_counts(key, read_count, write_count)
+    if read_count == 0 and write_count == 0 then
+        if HASH_LAYOUT then
+            local shard, path = get_shard(key)
+            redis.call('HDEL', shard, path)
+        else
+            redis.call('DEL', key)
+        end
+        unregister(key)
+    elseif HASH_LAYOUT then
+        local shard, path = get_shard(key)
+        if write_count > 0 then
+            redis.call('HSET', shard, path, -1)
+        else
+            redis.call('HSET', shard, path, read_count)
+        end
+    else
+        redis.call('SET', key, string.format('%d,%d', read_count, write_count))
+    end
+end
+
+local function get_held_operation(key)
+    local _, write_count = get_counts(key)
+    if write_count > 0 then
+        return 'write'
+    end
+    return 'read'
+end
+
+-- Set the expiration of the sorted set to the latest score, persist it when some members never expire.
+local function refresh_set_expiration(key)
+    local last = redis.call('ZRANGE', key, -1, -1, 'WITHSCORES')[2]
+    if last == nil then
+        return
+    end
+    if last == 'inf' then
+        redis.call('PERSIST', key)
+    else
+        redis.call('PEXPIREAT', key, last)
+    end
+end
+
+local function get_head_waiter(key, now)
+    local waiters_key = key .. ':waiters'
+    while true do
+        local head = redis.call('LINDEX', waiters_key, 0)
+        if not head then
+            return nil
+        end
+        local separator = string.find(head, ':', 1, true)
+        if tonumber(string.sub(head, separator + 1)) > now then
+            return string.sub(head, 1, separator - 1)
+        end
+        -- the waiter has timed out without dequeuing itself
+        redis.call('LPOP', waiters_key)
+    end
+end
+
+local function enqueue(key, ticket, deadline, now)
+    local waiters_key = key .. ':waiters'
+    redis.call('RPUSH', waiters_key, ticket .. ':' .. deadline)
+    local ttl = redis.call('PTTL', waiters_key)
+    if ttl < 0 or now + ttl < deadline then
+        redis.call('PEXPIREAT', waiters_key, deadline)
+    end
+end
+
+local function dequeue(key, ticket)
+    local waiters_key = key .. ':waiters'
+    for _, entry in ipairs(redis.call('LRANGE', waiters_key, 0, -1)) do
+        if string.sub(entry, 1, #ticket + 1) == ticket .. ':' then
+            redis.call('LREM', waiters_key, 1, entry)
+            return
+        end
+    end
+end
+
+local function notify_waiters(key)
+    if redis.call('EXISTS', key .. ':waiters') == 1 then
+        redis.call('PUBLISH', key .. ':waiters', key)
+    end
+end
+
+local function get_ancestors(key)
+    local ancestors = {}
+    if not HIERARCHICAL then
+        return ancestors
+    end
+
+    local position = string.find(key, '/', #NAMESPACE + 1, true)
+    while position and position < #key do
+        table.insert(ancestors, string.sub(key, 1, position))
+        position = string.find(key, '/', position + 1, true)
+    end
+    return ancestors
+end
+
+local function count_intents(folder, operation, now)
+    local leased_intents = folder .. ':intents:' .. operation
+    redis.call('ZREMRANGEBYSCORE', leased_intents, '-inf', now)
+    local count = tonumber(redis.call('HGET', folder .. ':intents', operation)) or 0
+    return count + redis.call('ZCARD', leased_intents)
+end
+
+local function add_intents(key, operation, lease_id, expiration)
+    for _, folder in ipairs(get_ancestors(key)) do
+        if lease_id == '' then
+            redis.call('HINCRBY', folder .. ':intents', operation, 1)
+        else
+            local leased_intents = folder .. ':intents:' .. operation
+            redis.call('ZADD', leased_intents, expiration, key .. '\\n' .. lease_id)
+            refresh_set_expiration(leased_intents)
+        end
+    end
+end
+
+local function remove_intents(key, operation, lease_id)
+    for _, folder in ipairs(get_ancestors(key)) do
+        if lease_id == '' then
+            local intents = folder .. ':intents'
+            if redis.call('HINCRBY', intents, operation, -1) <= 0 then
+                redis.call('HDEL', intents, operation)
+            end
+        else
+            redis.call('ZREM', folder .. ':intents:' .. operation, key .. '\\n' .. lease_id)
+        end
+        notify_waiters(folder)
+    end
+end
+
+local function renew_intents(key, operation, lease_id, expiration)
+    for _, folder in ipairs(get_ancestors(key)) do
+        local leased_intents = folder .. ':intents:' .. operation
+        redis.call('ZADD', leased_intents, 'XX', expiration, key .. '\\n' .. lease_id)
+        refresh_set_expiration(leased_intents)
+    end
+end
+
+-- When every holder of the key is leased, all entries expire together with the last lease.
+-- That way a lock of a crashed worker disappears even if the key is never touched again.
+-- Registry entries of such keys are removed when the registry is inspected.
+local function refresh_expiration(key)
+    local read_count, write_count = get_counts(key)
+    local leased, last_expiration = 0, 0
+    for _, holder in ipairs(get_holders(key)) do
+        if holder.lease_id ~= '' then
+            leased = leased + 1
+            last_expiration = math.max(last_expiration, holder.expiration)
+        end
+    end
+
+    local entries = {key, key .. ':holders'}
+    if leased == 0 or leased < read_count + write_count then
+        if HASH_LAYOUT then
+            redis.call('ZREM', REGISTRY .. 'expiring', get_path(key))
+            return
+        end
+        for _, entry in ipairs(entries) do
+            redis.call('PERSIST', entry)
+        end
+        return
+    end
+
+    if HASH_LAYOUT then
+        -- the holders must outlive the expiration, otherwise the counts in the shard couldn't be reaped
+        redis.call('ZADD', REGISTRY .. 'expiring', last_expiration, get_path(key))
+        return
+    end
+    for _, entry in ipairs(entries) do
+        redis.call('PEXPIREAT', entry, last_expiration)
+    end
+end
+
+-- Remove holders with expired leases and decrease the lock counts by the number of expired holders.
+-- Intents of the expired holders expire on their own, since they share the expiration with the lease.
+local function reap(key, now)
+    local kept, expired = {}, {}
+    for _, holder in ipairs(get_holders(key)) do
+        if holder.lease_id ~= '' and holder.expiration <= now then
+            table.insert(expired, holder)
+        else
+            table.insert(kept, holder)
+        end
+    end
+    if #expired == 0 then
+        return
+    end
+
+    remove_holders(key, kept, expired)
+    local read_count, write_count = get_counts(key)
+    if write_count > 0 then
+        set_counts(key, 0, 0)
+    else
+        set_counts(key, math.max(read_count - #expired, 0), 0)
+    end
+    refresh_expiration(key)
+end
+
+-- Move the entry of the key stored in the string layout into the hash layout and return whether there was one. Every
+-- read of the hash layout adopts the entry first, so locks taken by engines on the string layout stay effective after
+-- the switch to the hash layout, before the migration moved them.
+adopt_string_entry = function(key)
+    if not HASH_LAYOUT or redis.call('TYPE', key)['ok'] ~= 'string' then
+        return false
+    end
+    local value = redis.call('GET', key)
+    if not string.match(value, '^%d+,%d+$') then
+        return false
+    end
+
+    local separator = string.find(value, ',', 1, true)
+    local holders = redis.call('GET', key .. ':holders')
+    redis.call('DEL', key, key .. ':holders')
+    if holders then
+        local shard, path = get_shard(key)
+        redis.call('HSET', shard, path .. '\\n', holders)
+    end
+    set_counts(key, tonumber(string.sub(value, 1, separator - 1)), tonumber(string.sub(value, separator + 1)))
+    register(key, get_now())
+    refresh_expiration(key)
+    return true
+end
+
+-- Reap a few keys of the hash layout where all holders are expired, since they are not removed by Redis.
+local function sweep(now)
+    if not HASH_LAYOUT then
+        return
+    end
+    local paths = redis.call('ZRANGEBYSCORE', REGISTRY .. 'expiring', '-inf', now, 'LIMIT', 0, SWEEP_LIMIT)
+    for _, path in ipairs(paths) do
+        local key = NAMESPACE .. path
+        reap(key, now)
+        refresh_expiration(key)
+    end
+end
+
+-- Check locks on the ancestor folders and intents below the folder, the cost grows with the depth of the key only.
+local function is_blocked_by_hierarchy(key, operation, now)
+    for _, folder in ipairs(get_ancestors(key)) do
+        reap(folder, now)
+        local read_count, write_count = get_counts(folder)
+        if write_count > 0 or (operation == 'write' and read_count > 0) then
+            return true
+        end
+        -- new locks below the folder would keep the folder waiters queued forever
+        if get_head_waiter(folder, now) then
+            return true
+        end
+    end
+
+    if HIERARCHICAL and string.sub(key, -1) == '/' then
+        if count_intents(key, 'write', now) > 0 then
+            return true
+        end
+        if operation == 'write' and count_intents(key, 'read', now) > 0 then
+            return true
+        end
+    end
+    return false
+end
+
+-- The ticket identifies a queued request or it is an empty string for requests which are not waiting.
+local function acquire(key, operation, lease_id, ttl, owner, token, ticket, now)
+    reap(key, now)
+
+    local read_count, write_count = get_counts(key)
+    if write_count > 0 or (operation == 'write' and read_count > 0) then
+        return false
+    end
+    if lease_id ~= '' then
+        for _, holder in ipairs(get_holders(key)) do
+            if holder.lease_id == lease_id then
+                return false
+            end
+        end
+    end
+    if is_blocked_by_hierarchy(key, operation, now) then
+        return false
+    end
+    local head_waiter = get_head_waiter(key, now)
+    if head_waiter and head_waiter ~= ticket then
+        return false
+    end
+
+    if operation == 'write' then
+        set_counts(key, 0, 1)
+    else
+        set_counts(key, read_count + 1, 0)
+    end
+    register(key, now)
+    if FENCING or lease_id ~= '' or owner ~= '' then
+        local expiration = nil
+        if lease_id ~= '' then
+            expiration = now + ttl
+        end
+        add_holder(key, {token = token, lease_id = lease_id, expiration = expiration, owner = owner}, now)
+    end
+    add_intents(key, operation, lease_id, now + ttl)
+    refresh_expiration(key)
+    if head_waiter then
+        -- let the next waiter check whether it is compatible with the acquired lock
+        redis.call('LPOP', key .. ':waiters')
+        notify_waiters(key)
+    end
+    return true
+end
+
+-- Release the holder with the token or the leased holder when the lease_id is provided, otherwise the holder without
+-- lease of the owner. The operation must match the mode the key is locked in.
+local function release(key, operation, lease_id, owner, token, now)
+    reap(key, now)
+
+    local read_count, write_count = get_counts(key)
+    if read_count == 0 and write_count == 0 then
+        return false
+    end
+    if operation ~= get_held_operation(key) then
+        return false
+    end
+
+    local holders = get_holders(key)
+    local index = find_holder(key, holders, lease_id, owner, token)
+    if not index then
+        return false
+    end
+    local released_lease_id = ''
+    if index > 0 then
+        local released = table.remove(holders, index)
+        released_lease_id = released.lease_id
+        remove_holders(key, holders, {released})
+    end
+    remove_intents(key, operation, released_lease_id)
+
+    if operation == 'write' or read_count <= 1 then
+        -- the last read operation removes the entry for cleanup
+        set_counts(key, 0, 0)
+    else
+        set_counts(key, read_count - 1, write_count)
+    end
+    refresh_expiration(key)
+    notify_waiters(key)
+    return true
+end
+
+local function renew(key, lease_id, token, ttl, now)
+    reap(key, now)
+
+    local holders = get_holders(key)
+    for _, holder in ipairs(holders) do
+        if holder.lease_id == lease_id and (token == '' or holder.token == token) then
+            holder.expiration = now + ttl
+            set_holders(key, holders)
+            renew_intents(key, get_held_operation(key), lease_id, now + ttl)
+            refresh_expiration(key)
+            return true
+        end
+    end
+    return false
+end
+"""
+
+# KEYS[1] - lock key.
+LOCK_STATUS_SCRIPT = (
+    LUA_HELPERS
+    + """
+reap(KEYS[1], get_now())
+return get_status(KEYS[1])
+"""
+)
+
+# KEYS - lock keys.
+# ARGV[5] - registry index the keys were listed from or empty string.
+# Return [status, acquired_at, owners, fencing tokens] for every key.
+# Keys which are not locked anymore are removed from the registry.
+INSPECT_SCRIPT = (
+    LUA_HELPERS
+    + """
+local now = get_now()
+local states = {}
+sweep(now)
+for index, key in ipairs(KEYS) do
+    reap(key, now)
+    local status = get_status(key)
+    if status then
+        local acquired_at = redis.call('ZSCORE', REGISTRY .. 'acquired', get_path(key))
+        local counts, owners, tokens = {}, {}, {}
+        for _, holder in ipairs(get_holders(key)) do
+            if holder.owner ~= '' then
+                counts[holder.owner] = (counts[holder.owner] or 0) + 1
+            end
+            table.insert(tokens, holder.token)
+        end
+        for owner, count in pairs(counts) do
+            table.insert(owners, owner)
+            table.insert(owners, count)
+        end
+        states[index] = {status, acquired_at, owners, tokens}
+    else
+        unregister(key)
+        if ARGV[5] ~= '' then
+            redis.call('ZREM', ARGV[5], get_path(key))
+        end
+        states[index] = {false, false, {}, {}}
+    end
+end
+return states
+"""
+)
+
+# KEYS[1] - lock key.
+# ARGV[5] - operation (read/write), ARGV[6] - lease id or empty string, ARGV[7] - lease ttl in milliseconds,
+# ARGV[8] - owner or empty string, ARGV[9] - waiter ticket or empty string,
+# ARGV[10] - wait timeout in milliseconds to enqueue the ticket or 0.
+# Return the fencing token of the acquired lock or 0.
+LOCK_SCRIPT = (
+    LUA_HELPERS
+    + """
+local now = get_now()
+local token = next_token()
+sweep(now)
+if acquire(KEYS[1], ARGV[5], ARGV[6], tonumber(ARGV[7]), ARGV[8], token, ARGV[9], now) then
+    return token
+end
+if tonumber(ARGV[10]) > 0 then
+    enqueue(KEYS[1], ARGV[9], now + tonumber(ARGV[10]), now)
+end
+return 0
+"""
+)
+
+# KEYS[1] - lock key.
+# ARGV[5] - waiter ticket.
+DEQUEUE_SCRIPT = (
+    LUA_HELPERS
+    + """
+dequeue(KEYS[1], ARGV[5])
+notify_waiters(KEYS[1])
+"""
+)
+
+# KEYS[1] - lock key.
+# ARGV[5] - operation (read/write), ARGV[6] - lease id or empty string, ARGV[7] - owner or empty string,
+# ARGV[8] - fencing token or empty string.
+UNLOCK_SCRIPT = (
+    LUA_HELPERS
+    + """
+if release(KEYS[1], ARGV[5], ARGV[6], ARGV[7], ARGV[8], get_now()) then
+    return 1
+end
+return 0
+"""
+)
+
+# KEYS - lock keys in the locking order.
+# ARGV[5] - operation (read/write), ARGV[6] - lease id or empty string, ARGV[7] - lease ttl in milliseconds,
+# ARGV[8] - owner or empty string.
+# Keys are acquired one by one, on the first failure all the already acquired keys are released again.
+# Return the fencing token shared by all keys and the statuses of the keys.
+BULK_LOCK_SCRIPT = (
+    LUA_HELPERS
+    + """
+local now = get_now()
+local token = next_token()
+local status = {}
+sweep(now)
+for index, key in ipairs(KEYS) do
+    if not acquire(key, ARGV[5], ARGV[6], tonumber(ARGV[7]), ARGV[8], token, '', now) then
+        for acquired = index - 1, 1, -1 do
+            release(KEYS[acquired], ARGV[5], ARGV[6], ARGV[8], token, now)
+        end
+        for failed = index, #KEYS do
+            status[failed] = 0
+        end
+        return {token, status}
+    end
+    status[index] = 1
+end
+return {token, status}
+"""
+)
+
+# KEYS - lock keys.
+# ARGV[5] - operation (read/write), ARGV[6] - lease id or empty string, ARGV[7] - owner or empty string,
+# ARGV[8] - fencing token or empty string.
+BULK_UNLOCK_SCRIPT = (
+    LUA_HELPERS
+    + """
+local now = get_now()
+local status = {}
+for index, key in ipairs(KEYS) do
+    if release(key, ARGV[5], ARGV[6], ARGV[7], ARGV[8], now) then
+        status[index] = 1
+    else
+        status[index] = 0
+    end
+end
+return status
+"""
+)
+
+# KEYS - lock keys.
+# ARGV[5] - lease id, ARGV[6] - lease ttl in milliseconds, ARGV[7] - fencing token or empty string.
+BULK_RENEW_SCRIPT = (
+    LUA_HELPERS
+    + """
+local now = get_now()
+local status = {}
+for index, key in ipairs(KEYS) do
+    if renew(key, ARGV[5], ARGV[7], tonumber(ARGV[6]), now) then
+        status[index] = 1
+    else
+        status[index] = 0
+    end
+end
+return status
+"""
+)
+
+
+# KEYS[1] - lock key in the string layout.
+# Move the lock entry into the hash layout, return 1 if the key was migrated.
+MIGRATE_SCRIPT = (
+    LUA_HELPERS
+    + """
+if adopt_string_entry(KEYS[1]) then
+    return 1
+end
+return 0
+"""
+)
+
+
+class WaitNotifier:
+    """Share one pub/sub connection between all requests of the process waiting for locks of one Redis client.
+
+    Each waiter registers an event for the channel of its key. The channel is subscribed while it has waiters and the
+    listener task sets the events of the channel for every notification.
+    """
+
+    def __init__(self, redis: Redis) -> None:
+        self._redis = redis
+        self._pubsub: Optional[PubSub] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._commands: Optional[asyncio.Lock] = None
+        self._waiters: Dict[str, Set[asyncio.Event]] = {}
+
+    async def subscribe(self, channel: str) -> asyncio.Event:
+        """Return the event set whenever the channel is notified until the event is unsubscribed."""
+
+        event = asyncio.Event()
+        waiters = self._waiters.setdefault(channel, set())
+        waiters.add(event)
+        if len(waiters) == 1:
+            await self.execute('subscribe', channel)
+        return event
+
+    async def unsubscribe(self, channel: str, event: asyncio.Event) -> None:
+        waiters = self._waiters.get(channel, set())
+        waiters.discard(event)
+        if not waiters and self._waiters.pop(channel, None) is not None:
+            await self.execute('unsubscribe', channel)
+
+    async def execute(self, command: str, channel: str) -> None:
+        """Run the pub/sub command and start the listener if it is not running.
+
+        Commands are serialized, so the subscriptions follow the order of the waiters.
+        """
+
+        if self._commands is None:
+            self._commands = asyncio.Lock()
+        async with self._commands:
+            if self._pubsub is None:
+                self._pubsub = self._redis.pubsub()
+            await getattr(self._pubsub, command)(channel)
+            if command == 'subscribe' and (self._listener is None or self._listener.done()):
+                self._listener = asyncio.create_task(self.listen(self._pubsub))
+
+    async def listen(self, pubsub: PubSub) -> None:
+        """Dispatch the notifications to the waiters of their channels while there are waiters.
+
+        When the connection fails, the waiters keep retrying every poll interval and the next waiter reconnects.
+        """
+
+        try:
+            while self._waiters:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                channel = message['channel']
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                for event in self._waiters.get(channel, ()):
+                    event.set()
+        except Exception:
+            if self._pubsub is pubsub:
+                self._pubsub = None
+                self._waiters = {}
+            await pubsub.close()
+
+
+_wait_notifiers: 'WeakKeyDictionary[Redis, WaitNotifier]' = WeakKeyDictionary()
+
+
+def get_wait_notifier(redis: Redis) -> WaitNotifier:
+    """Return the wait notifier of the Redis client, created on the first call."""
+
+    notifier = _wait_notifiers.get(redis)
+    if notifier is None:
+        notifier = _wait_notifiers[redis] = WaitNotifier(redis)
+    return notifier
+
+
+class LockEngine:
+    """Perform read/write lock operations as atomic Lua scripts on the Redis side.
+
+    Each lock or unlock call is executed as a single EVALSHA round trip, so the check and the update of the lock entry
+    can't be interleaved with requests from other workers.
+
+    Locks acquired with a lease id and ttl expire unless the lease is renewed in time. Expired leases are reaped by
+    every script touching the key and the whole entry expires in Redis once all its holders are expired.
+
+    With hierarchical locking enabled, keys ending with "/" lock the whole folder tree below them. A lock on a key
+    takes intent locks on its ancestor folders, so conflicts are checked in O(depth) instead of locking every
+    descendant key.
+
+    Lock requests with a wait timeout are queued in a per-key FIFO queue and woken up through Redis pub/sub when the
+    lock is released, all waiters of the process share one subscriber connection. Waiters also retry every poll
+    interval to notice expired leases and released ancestor folders.
+
+    All keys are stored under the namespace and the locked keys are indexed in the registry, so they can be listed by
+    prefix, owner or age without scanning the keyspace.
+
+    Every lock request gets a monotonically increasing fencing token. The token identifies the holders of the request,
+    so a delayed unlock or renew retry can't release or extend the lock of somebody else. With fencing disabled, holders
+    without lease and owner are not recorded to keep one Redis key per lock, any unlock without lease and owner may
+    release them.
+
+    The "string" layout stores every lock entry as its own Redis key, the "hash" layout packs the entries into hashes
+    per bucket to save the per-key overhead of Redis.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        hierarchical: bool = False,
+        poll_interval: float = 1.0,
+        namespace: str = '',
+        layout: str = 'string',
+        fencing: bool = True,
+    ) -> None:
+        if layout not in ('string', 'hash'):
+            raise ValueError(f'Unknown lock layout "{layout}"')
+
+        self._redis = redis
+        self._hierarchical = hierarchical
+        self._poll_interval = poll_interval
+        self._namespace = namespace
+        self._layout = layout
+        self._fencing = fencing
+        self._wait_notifier = get_wait_notifier(redis)
+        self._status_script = redis.register_script(LOCK_STATUS_SCRIPT)
+        self._inspect_script = redis.register_script(INSPECT_SCRIPT)
+        self._lock_script = redis.register_script(LOCK_SCRIPT)
+        self._dequeue_script = redis.register_script(DEQUEUE_SCRIPT)
+        self._unlock_script = redis.register_script(UNLOCK_SCRIPT)
+        self._bulk_lock_script = redis.register_script(BULK_LOCK_SCRIPT)
+        self._bulk_unlock_script = redis.register_script(BULK_UNLOCK_SCRIPT)
+        self._bulk_renew_script = redis.register_script(BULK_RENEW_SCRIPT)
+        self._migrate_script = redis.register_script(MIGRATE_SCRIPT)
+
+    def get_script_args(self, *args: Union[str, int]) -> List[Union[str, int]]:
+        """Return script arguments prefixed with the options shared by all scripts."""
+
+        return [int(self._hierarchical), self._namespace, self._layout, int(self._fencing), *args]
+
+    def get_key(self, key: str) -> str:
+        """Return the Redis key of the resource key within the namespace."""
+
+        return f'{self._namespace}{key}'
+
+    def get_registry_key(self, name: str) -> str:
+        return f'{self._namespace}lock-registry:{name}'
+
+    async def get_status(self, key: str) -> Optional[str]:
+        """Return "<read_count>,<write_count>" for the key or None if the key is not locked."""
+
+        status = await self._status_script(keys=[self.get_key(key)], args=self.get_script_args())
+        if status is None:
+            return None
+
+        return status.decode()
+
+    async def inspect(self, keys: List[str], registry_key: str = '') -> List[ResourceLockState]:
+        """Return the state of the lock for each key.
+
+        Keys which are not locked anymore are removed from the registry and from the index they were listed from.
+        """
+
+        if not keys:
+            return []
+
+        args = self.get_script_args(registry_key)
+        states = await self._inspect_script(keys=[self.get_key(key) for key in keys], args=args)
+
+        result = []
+        for key, (status, acquired_at, owners, fencing_tokens) in zip(keys, states):
+            result.append(
+                ResourceLockState(
+                    key=key,
+                    status=status.decode() if status else None,
+                    acquired_at=int(float(acquired_at)) if acquired_at else None,
+                    owners={owner.decode(): int(count) for owner, count in zip(owners[::2], owners[1::2])},
+                    fencing_tokens=sorted(int(token) for token in fencing_tokens),
+                )
+            )
+        return result
+
+    async def list_locks(
+        self,
+        prefix: str = '',
+        owner: Optional[str] = None,
+        older_than: Optional[int] = None,
+        offset: int = 0,
+        limit: int = 25,
+    ) -> Tuple[int, List[ResourceLockState]]:
+        """Return the total number of indexed locks and the page of locked keys with their state.
+
+        Locks are listed from one registry index: by owner in the acquisition order, older than the given number of
+        seconds in the acquisition order or by the key prefix in lexicographical order. The total may include locks
+        which expired since the last inspection, these are left out from the returned page.
+        """
+
+        if owner:
+            registry_key = self.get_registry_key(f'owner:{owner}')
+            total = await self._redis.zcard(registry_key)
+            paths = await self._redis.zrange(registry_key, offset, offset + limit - 1)
+        elif older_than is not None:
+            registry_key = self.get_registry_key('acquired')
+            seconds, microseconds = await self._redis.time()
+            max_acquired_at = seconds * 1000 + microseconds // 1000 - self.to_milliseconds(older_than)
+            total = await self._redis.zcount(registry_key, '-inf', max_acquired_at)
+            paths = await self._redis.zrangebyscore(registry_key, '-inf', max_acquired_at, start=offset, num=limit)
+        else:
+            registry_key = self.get_registry_key('keys')
+            min_path, max_path = '-', '+'
+            if prefix:
+                # no UTF-8 encoded key contains the 0xff byte, so it closes the range of keys with the prefix
+                min_path, max_path = b'[' + prefix.encode(), b'[' + prefix.encode() + b'\xff'
+            total = await self._redis.zlexcount(registry_key, min_path, max_path)
+            paths = await self._redis.zrangebylex(registry_key, min_path, max_path, start=offset, num=limit)
+
+        states = await self.inspect([path.decode() for path in paths], registry_key)
+        return total, [state for state in states if state.status]
+
+    async def lock(
+        self,
+        key: str,
+        operation: str,
+        lease_id: Optional[str] = None,
+        ttl: Optional[int] = None,
+        wait_timeout: Optional[float] = None,
+        owner: Optional[str] = None,
+    ) -> bool:
+        """Acquire read or write lock for the key.
+
+        Return true if the lock is acquired or false if another operation blocks the current one.
+        """
+
+        fencing_token = await self.acquire(key, operation, lease_id, ttl, wait_timeout, owner)
+        return fencing_token is not None
+
+    async def acquire(
+        self,
+        key: str,
+        operation: str,
+        lease_id: Optional[str] = None,
+        ttl: Optional[int] = None,
+        wait_timeout: Optional[float] = None,
+        owner: Optional[str] = None,
+    ) -> Optional[int]:
+        """Acquire read or write lock for the key and return its fencing token.
+
+        When lease_id is provided, the lock expires after ttl seconds unless the lease is renewed.
+        When wait_timeout is provided, wait up to wait_timeout seconds in the queue of the key for the lock.
+        The owner labels the holder in the registry.
+        Return None if another operation blocks the current one.
+        """
+
+        if wait_timeout:
+            return await self.wait_for_lock(key, operation, lease_id, ttl, owner, wait_timeout)
+
+        args = self.get_script_args(operation, lease_id or '', self.to_milliseconds(ttl), owner or '', '', 0)
+        return int(await self._lock_script(keys=[self.get_key(key)], args=args)) or None
+
+    async def wait_for_lock(
+        self,
+        key: str,
+        operation: str,
+        lease_id: Optional[str],
+        ttl: Optional[int],
+        owner: Optional[str],
+        wait_timeout: float,
+    ) -> Optional[int]:
+        """Acquire the lock or join the waiters queue of the key and retry when the waiters are notified.
+
+        The subscription is made before the first attempt and the notification event is cleared before each attempt, so
+        a release between the attempt and the wait is not lost.
+        The ticket is removed from the queue when the lock is not acquired in time.
+        """
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait_timeout
+        ticket = uuid4().hex
+        key = self.get_key(key)
+        channel = f'{key}:waiters'
+        fencing_token = None
+
+        notified = await self._wait_notifier.subscribe(channel)
+        try:
+            ttl_ms = self.to_milliseconds(ttl)
+            enqueue_timeout = self.to_milliseconds(wait_timeout)
+            while True:
+                notified.clear()
+                args = self.get_script_args(operation, lease_id or '', ttl_ms, owner or '', ticket, enqueue_timeout)
+                fencing_token = int(await self._lock_script(keys=[key], args=args)) or None
+                remaining = deadline - loop.time()
+                if fencing_token or remaining <= 0:
+                    return fencing_token
+
+                enqueue_timeout = 0
+                try:
+                    await asyncio.wait_for(notified.wait(), min(remaining, self._poll_interval))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if fencing_token is None:
+                await self._dequeue_script(keys=[key], args=self.get_script_args(ticket))
+            await self._wait_notifier.unsubscribe(channel, notified)
+
+    async def unlock(
+        self,
+        key: str,
+        operation: str,
+        lease_id: Optional[str] = None,
+        owner: Optional[str] = None,
+        fencing_token: Optional[int] = None,
+    ) -> bool:
+        """Release read or write lock for the key.
+
+        Return false if the key is not locked, if the operation doesn't match the mode the key is locked in or if there
+        is no holder matching the provided fencing token, lease and owner. Without fencing token and lease, only a
+        holder without lease of the same owner is released.
+        """
+
+        args = self.get_script_args(operation, lease_id or '', owner or '', fencing_token or '')
+        return bool(await self._unlock_script(keys=[self.get_key(key)], args=args))
+
+    async def bulk_lock(
+        self,
+        keys: List[str],
+        operation: str,
+        lease_id: Optional[str] = None,
+        ttl: Optional[int] = None,
+        owner: Optional[str] = None,
+    ) -> List[bool]:
+        """Acquire read or write locks for all keys in one atomic operation."""
+
+        _, status = await self.bulk_acquire(keys, operation, lease_id, ttl, owner)
+        return status
+
+    async def bulk_acquire(
+        self,
+        keys: List[str],
+        operation: str,
+        lease_id: Optional[str] = None,
+        ttl: Optional[int] = None,
+        owner: Optional[str] = None,
+    ) -> Tuple[Optional[int], List[bool]]:
+        """Acquire read or write locks for all keys in one atomic operation and return the shared fencing token.
+
+        Keys are locked in the given order. If one of the keys can't be locked, the locks acquired for the preceding
+        keys are rolled back, so either all keys are locked or none of them. The returned statuses are true for the
+        keys preceding the failed one and false for the failed key and all following keys. The fencing token is None
+        when the locks are not acquired.
+        """
+
+        if not keys:
+            return None, []
+
+        args = self.get_script_args(operation, lease_id or '', self.to_milliseconds(ttl), owner or '')
+        fencing_token, status = await self._bulk_lock_script(keys=[self.get_key(key) for key in keys], args=args)
+        status = [bool(value) for value in status]
+        if not all(status):
+            return None, status
+
+        return int(fencing_token), status
+
+    async def bulk_unlock(
+        self,
+        keys: List[str],
+        operation: str,
+        lease_id: Optional[str] = None,
+        owner: Optional[str] = None,
+        fencing_token: Optional[int] = None,
+    ) -> List[bool]:
+        """Release read or write locks for all keys in one atomic operation.
+
+        Failure to unlock one key doesn't stop the unlocking of the following keys.
+        """
+
+        if not keys:
+            return []
+
+        args = self.get_script_args(operation, lease_id or '', owner or '', fencing_token or '')
+        status = await self._bulk_unlock_script(keys=[self.get_key(key) for key in keys], args=args)
+        return [bool(value) for value in status]
+
+    async def bulk_renew(
+        self, keys: List[str], lease_id: str, ttl: int, fencing_token: Optional[int] = None
+    ) -> List[bool]:
+        """Extend the lease for all keys to expire ttl seconds from now.
+
+        The status is false for keys where the lease is already expired, was never acquired or where the lease doesn't
+        belong to the holder with the provided fencing token.
+        """
+
+        if not keys:
+            return []
+
+        args = self.get_script_args(lease_id, self.to_milliseconds(ttl), fencing_token or '')
+        status = await self._bulk_renew_script(keys=[self.get_key(key) for key in keys], args=args)
+        return [bool(value) for value in status]
+
+    async def migrate_to_hash_layout(self, prefix: str, scan_count: int = 1000) -> int:
+        """Move the lock entries stored in the string layout with keys starting with the prefix into the hash layout.
+
+        Keys are found with SCAN, so Redis is not blocked while the migration runs. Each key is moved by one atomic
+        script and the locks can be used during the migration. The prefix, within the namespace, must be provided so
+        the migration doesn't walk the string keys of other users of the Redis database. Return the number of
+        migrated keys.
+        """
+
+        if self._layout != 'hash':
+            raise ValueError('Lock engine must use the hash layout to migrate the lock entries')
+        match = self.get_key(prefix)
+        if not match:
+            raise ValueError('Lock key prefix must be provided to migrate the lock entries')
+
+        migrated = 0
+        pattern = re.sub(r'([*?\[\]\\])', r'\\\1', match) + '*'
+        async for key in self._redis.scan_iter(match=pattern, count=scan_count, _type='string'):
+            migrated += await self._migrate_script(keys=[key], args=self.get_script_args())
+        return migrated
+
+    def to_milliseconds(self, seconds: Optional[float]) -> int:
+        if not seconds:
+            return 0
+
+        return int(seconds * 1000)
@@ -0,0 +1,60 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program. If not, see
+# http://www.gnu.org/licenses/.
+
+"""Move resource lock entries from the string layout into the hash layout.
+
+Engines on the hash layout adopt entries of the string layout whenever they read them, but engines on the string layout
+don't see entries of the hash layout. Switch RESOURCE_LOCK_LAYOUT to "hash" on all service instances at once, without
+a rolling update that keeps instances on the string layout running next to the new ones, then move the remaining
+entries with the lock key prefix, eg. the common first segment of the locked paths:
+
+    poetry run python -m api.api_resource_lock.migrate_layout <prefix>
+
+The prefix is required without RESOURCE_LOCK_NAMESPACE, so the migration doesn't walk all string keys of the database.
+"""
+
+import asyncio
+import sys
+
+from aioredis.client import Redis
+from common import LoggerFactory
+
+from api.api_resource_lock.lock_engine import LockEngine
+from config import Settings
+from config import get_settings
+
+logger = LoggerFactory('api_resource_lock').get_logger()
+
+
+async def migrate(settings: Settings, prefix: str) -> int:
+    """Migrate the lock entries with the key prefix and return the number of migrated keys."""
+
+    redis = Redis(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DB,
+        password=settings.REDIS_PASSWORD,
+    )
+    try:
+        engine = LockEngine(redis, namespace=settings.RESOURCE_LOCK_NAMESPACE, layout='hash')
+        return await engine.migrate_to_hash_layout(prefix)
+    finally:
+        await redis.close()
+
+
+if __name__ == '__main__':
+    settings = get_settings()
+    prefix = sys.argv[1] if len(sys.argv) > 1 else ''
+    if not settings.RESOURCE_LOCK_NAMESPACE + prefix:
+        sys.exit('Usage: python -m api.api_resource_lock.migrate_layout <prefix>')
+    migrated = asyncio.run(migrate(settings, prefix))
+    logger.info(f'Migrated {migrated} resource lock entries into the hash layout')
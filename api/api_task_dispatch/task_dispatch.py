@@ -10,17 +10,28 @@
 # You should have received a copy of the GNU Affero General Public License along with this program.
 # If not, see http://www.gnu.org/licenses/.
 
+import json
+import math
+from typing import Optional
+
 from common import LoggerFactory
 from fastapi import APIRouter
+from fastapi import Query
+from fastapi.responses import StreamingResponse
 from fastapi_utils.cbv import cbv
 
+from config import ConfigClass
 from models import task_dispatch as models
 from models.base_models import APIResponse
 from models.base_models import EAPIResponseCode
 from resources.error_handler import catch_internal
 from resources.redis_project_session_job import SessionJob
+from resources.redis_project_session_job import is_glob_pattern
+from resources.redis_project_session_job import session_job_delete_many
 from resources.redis_project_session_job import session_job_delete_status
+from resources.redis_project_session_job import session_job_get_page
 from resources.redis_project_session_job import session_job_get_status
+from resources.redis_project_session_job import session_job_iter_changes
 
 router = APIRouter()
 
@@ -41,34 +52,121 @@ class TaskDispatcher:
         session_job = SessionJob(
             data.session_id, data.code, data.action, data.operator, label=data.label, task_id=data.task_id
         )
-        await session_job.set_job_id(data.job_id)
+        session_job.set_job_id(data.job_id)
         session_job.set_progress(data.progress)
         session_job.set_source(data.source)
         for key in data.payload:
             session_job.add_payload(key, data.payload[key])
         session_job.set_status('INIT')
-        await session_job.save()
+        await session_job.create()
         api_response.code = EAPIResponseCode.success
         api_response.result = 'SUCCEED'
         return api_response.json_response()
 
-    @router.get('/', summary='Asynchronized Task Management API, Get task information')
+    @router.get(
+        '/',
+        response_model=models.TaskDispatchGETResponse,
+        summary='Asynchronized Task Management API, Get task information',
+    )
     @catch_internal('api_task_dispatch')
-    async def get(self, session_id, label='Container', job_id='*', code='*', action='*', operator='*'):
-        api_response = APIResponse()
-        fetched = await session_job_get_status(session_id, label, job_id, code, action, operator)
+    async def get(
+        self,
+        session_id,
+        label='Container',
+        job_id='*',
+        code='*',
+        action='*',
+        operator='*',
+        status='*',
+        updated_after: Optional[int] = None,
+        updated_before: Optional[int] = None,
+        cursor: Optional[str] = None,
+        page_size: Optional[int] = Query(None, ge=1),
+    ):
+        """Return the tasks matching the filters, newest first.
 
-        # here sort the list by timestamp in descending order
-        def get_update_time(x):
-            return x.get('update_timestamp', 0)
+        All of them are returned unless page_size or cursor is given, then one page is returned with the cursor of the
+        next page.
+        """
 
-        fetched.sort(key=get_update_time, reverse=True)
+        api_response = models.TaskDispatchGETResponse()
 
-        api_response.code = EAPIResponseCode.success
-        api_response.result = fetched
+        if page_size is None and cursor is None:
+            fetched = await session_job_get_status(
+                session_id, label, job_id, code, action, operator, status, updated_after, updated_before
+            )
+
+            # here sort the list by timestamp in descending order
+            def get_update_time(x):
+                return x.get('update_timestamp', 0)
 
+            fetched.sort(key=get_update_time, reverse=True)
+
+            api_response.code = EAPIResponseCode.success
+            api_response.result = fetched
+            api_response.total = len(fetched)
+            return api_response.json_response()
+
+        page_size = page_size or 25
+        try:
+            page = await session_job_get_page(
+                session_id,
+                label,
+                job_id,
+                code,
+                action,
+                operator,
+                status,
+                updated_after,
+                updated_before,
+                cursor,
+                page_size,
+            )
+        except ValueError as e:
+            api_response.code = EAPIResponseCode.bad_request
+            api_response.error_msg = str(e)
+            return api_response.json_response()
+
+        api_response.code = EAPIResponseCode.success
+        api_response.result = page.jobs
+        api_response.page = page.page
+        api_response.total = page.total
+        api_response.num_of_pages = math.ceil(page.total / page_size)
+        api_response.next_cursor = page.next_cursor
         return api_response.json_response()
 
+    @router.get('/stream', summary='Asynchronized Task Management API, Stream task changes as server-sent events')
+    @catch_internal('api_task_dispatch')
+    async def stream(self, session_id, label='Container', job_id='*', code='*', action='*', operator='*'):
+        """Send a snapshot event with the tasks matching the filters, then changes events as the tasks change."""
+
+        if is_glob_pattern(session_id):
+            api_response = APIResponse()
+            api_response.code = EAPIResponseCode.bad_request
+            api_response.error_msg = 'Streaming requires an exact session id'
+            return api_response.json_response()
+
+        changes = session_job_iter_changes(
+            session_id,
+            label,
+            job_id,
+            code,
+            action,
+            operator,
+            coalesce_interval=ConfigClass.TASK_STREAM_COALESCE_INTERVAL,
+            heartbeat_interval=ConfigClass.TASK_STREAM_HEARTBEAT_INTERVAL,
+        )
+
+        async def iter_events():
+            async for event, data in changes:
+                yield 'event: {}\ndata: {}\n\n'.format(event, json.dumps(data))
+
+        return StreamingResponse(
+            iter_events(),
+            media_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+        )
+
     @router.delete('/', summary='Asynchronized Task Management API, Delete tasks')
     @catch_internal('api_task_dispatch')
     async def delete(self, data: models.TaskDispatchDELETE):
@@ -82,12 +180,94 @@ class TaskDispatcher:
     @catch_internal('api_task_dispatch')
     async def put(self, data: models.TaskDispatchPUT):
         api_response = APIResponse()
-        my_job = await SessionJob.load(data.session_id, '*', '*', '*', label=data.label, job_id=data.job_id)
+        my_job = SessionJob(data.session_id, '*', '*', '*', label=data.label, job_id=data.job_id)
         for k, v in data.add_payload.items():
             my_job.add_payload(k, v)
         my_job.set_progress(data.progress)
         my_job.set_status(data.status)
-        await my_job.save()
+        await my_job.update()
         api_response.code = EAPIResponseCode.success
         api_response.result = my_job.to_dict()
         return api_response.json_response()
+
+    @router.post(
+        '/bulk',
+        response_model=models.TaskDispatchBulkResponse,
+        summary='Asynchronized Task Management API, Create multiple tasks',
+    )
+    @catch_internal('api_task_dispatch')
+    async def bulk_post(self, data: models.TaskDispatchBulkPOST):
+        """Create the tasks in pipelined redis batches, a task with an already used job id is reported as failed."""
+
+        api_response = APIResponse()
+        session_jobs = []
+        for item in data.items:
+            session_job = SessionJob(
+                item.session_id, item.code, item.action, item.operator, label=item.label, task_id=item.task_id
+            )
+            session_job.set_job_id(item.job_id)
+            session_job.set_progress(item.progress)
+            session_job.set_source(item.source)
+            for key in item.payload:
+                session_job.add_payload(key, item.payload[key])
+            session_job.set_status('INIT')
+            session_jobs.append(session_job)
+
+        created = await SessionJob.save_many(session_jobs)
+
+        api_response.code = EAPIResponseCode.success
+        api_response.result = [
+            models.TaskDispatchBulkResult(job_id=item.job_id, status='SUCCEED')
+            if item_created
+            else models.TaskDispatchBulkResult(job_id=item.job_id, status='FAILED', error_msg='job id already exists')
+            for item, item_created in zip(data.items, created)
+        ]
+        return api_response.json_response()
+
+    @router.put(
+        '/bulk',
+        response_model=models.TaskDispatchBulkResponse,
+        summary='Asynchronized Task Management API, Update multiple tasks',
+    )
+    @catch_internal('api_task_dispatch')
+    async def bulk_put(self, data: models.TaskDispatchBulkPUT):
+        """Update the tasks in pipelined redis batches, a task which is not found is reported as failed."""
+
+        api_response = APIResponse()
+        my_jobs = []
+        for item in data.items:
+            my_job = SessionJob(item.session_id, '*', '*', '*', label=item.label, job_id=item.job_id)
+            for k, v in item.add_payload.items():
+                my_job.add_payload(k, v)
+            my_job.set_progress(item.progress)
+            my_job.set_status(item.status)
+            my_jobs.append(my_job)
+
+        updated = await SessionJob.update_many(my_jobs)
+
+        api_response.code = EAPIResponseCode.success
+        api_response.result = [
+            models.TaskDispatchBulkResult(job_id=my_job.job_id, status='SUCCEED', result=my_job.to_dict())
+            if job_updated
+            else models.TaskDispatchBulkResult(job_id=my_job.job_id, status='FAILED', error_msg='job not found')
+            for my_job, job_updated in zip(my_jobs, updated)
+        ]
+        return api_response.json_response()
+
+    @router.delete(
+        '/bulk',
+        response_model=models.TaskDispatchBulkResponse,
+        summary='Asynchronized Task Management API, Delete tasks matching multiple filters',
+    )
+    @catch_internal('api_task_dispatch')
+    async def bulk_delete(self, data: models.TaskDispatchBulkDELETE):
+        """Delete the tasks matching each of the filters, the number of deleted tasks is returned for each filter."""
+
+        api_response = APIResponse()
+        deleted = await session_job_delete_many([item.dict() for item in data.items])
+        api_response.code = EAPIResponseCode.success
+        api_response.result = [
+            models.TaskDispatchBulkResult(job_id=item.job_id, status='SUCCEED', result=item_deleted)
+            for item, item_deleted in zip(data.items, deleted)
+        ]
+        return api_response.json_response()
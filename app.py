@@ -10,6 +10,7 @@
 # You should have received a copy of the GNU Affero General Public License along with this program. If not,
 # see http://www.gnu.org/licenses/.
 
+import asyncio
 from functools import partial
 
 from fastapi import FastAPI
@@ -31,8 +32,14 @@ from api.routes import api_router
 from api.routes import api_router_v2
 from config import Settings
 from config import get_settings
+from dependencies import get_executor_manager
+from dependencies import get_http_client_manager
 from dependencies import get_redis
 from resources.db import get_db_engine
+from resources.loop_monitor import LoopBlockMonitor
+from resources.queue_outbox import run_queue_outbox_publisher
+from resources.redis import SrvAioRedisSingleton
+from resources.session_job_archive import run_session_job_archiver
 
 
 def create_app() -> FastAPI:
@@ -74,12 +81,48 @@ def setup_dependencies(app: FastAPI, settings: Settings) -> None:
     """Perform dependencies setup/teardown at the application startup/shutdown events."""
 
     app.add_event_handler('startup', partial(startup_event, settings))
+    app.add_event_handler('shutdown', shutdown_event)
 
 
 async def startup_event(settings: Settings) -> None:
     """Initialise dependencies at the application startup event."""
 
     await get_redis(settings=settings)
+    SrvAioRedisSingleton()
+    for service in ['metadata', 'queue', 'lineage']:
+        get_http_client_manager.get_client(service)
+
+
+async def shutdown_event() -> None:
+    """Release dependencies at the application shutdown event."""
+
+    await get_http_client_manager.close()
+    await SrvAioRedisSingleton.close()
+    get_executor_manager.close()
+
+
+def setup_session_job_archiver(app: FastAPI, settings: Settings) -> None:
+    """Remove or archive expired session jobs in the background until the application shutdown event."""
+
+    task = asyncio.create_task(
+        run_session_job_archiver(settings.SESSION_JOB_EXPORT_INTERVAL, settings.SESSION_JOB_EXPORT_ENABLED)
+    )
+    app.add_event_handler('shutdown', task.cancel)
+
+
+def setup_queue_outbox_publisher(app: FastAPI, settings: Settings) -> None:
+    """Send the queue outbox messages in the background until the application shutdown event."""
+
+    task = asyncio.create_task(run_queue_outbox_publisher(settings.QUEUE_OUTBOX_INTERVAL))
+    app.add_event_handler('shutdown', task.cancel)
+
+
+def setup_loop_monitor(app: FastAPI, settings: Settings) -> None:
+    """Report code blocking the event loop until the application shutdown event."""
+
+    monitor = LoopBlockMonitor(settings.LOOP_MONITOR_THRESHOLD, settings.LOOP_MONITOR_INTERVAL)
+    monitor.start()
+    app.add_event_handler('shutdown', monitor.stop)
 
 
 def setup_exception_handlers(app: FastAPI) -> None:
@@ -118,6 +161,11 @@ async def on_startup_event(app: FastAPI, settings: Settings) -> None:
     setup_middlewares(app)
     setup_dependencies(app, settings)
     setup_exception_handlers(app)
+    setup_queue_outbox_publisher(app, settings)
+    setup_session_job_archiver(app, settings)
+
+    if settings.LOOP_MONITOR_ENABLED:
+        setup_loop_monitor(app, settings)
 
     if settings.OPEN_TELEMETRY_ENABLED:
         await _initialize_instrument_app(app, settings)
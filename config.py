@@ -61,11 +61,73 @@ class Settings(BaseSettings):
     LINEAGE_SERVICE: str
     QUEUE_SERVICE: str
     METADATA_SERVICE: str
+    # Maximum number of concurrent metadata service requests made to validate the items of one file operation
+    METADATA_CONCURRENCY: int = 20
+    # Fetch items through the metadata service batch endpoint with at most METADATA_BATCH_SIZE ids per request. Without
+    # the batch endpoint items are fetched one by one for METADATA_BATCH_RETRY_AFTER seconds before it is tried again
+    METADATA_BATCH_ENABLED: bool = True
+    METADATA_BATCH_SIZE: int = 100
+    METADATA_BATCH_RETRY_AFTER: int = 300
+    # Cache items for METADATA_CACHE_TTL seconds and ids not found for METADATA_CACHE_NEGATIVE_TTL seconds, keeping at
+    # most METADATA_CACHE_SIZE items in process. The cache can be shared by the service instances through Redis
+    METADATA_CACHE_ENABLED: bool = True
+    METADATA_CACHE_SIZE: int = 10000
+    METADATA_CACHE_TTL: int = 30
+    METADATA_CACHE_NEGATIVE_TTL: int = 5
+    METADATA_CACHE_REDIS_ENABLED: bool = False
+
+    # Connection pool limits and default timeout in seconds of the HTTP clients shared by the calls to each service.
+    # HTTP/2 is negotiated when the "h2" package is installed
+    HTTP_CLIENT_MAX_CONNECTIONS: int = 100
+    HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_CLIENT_KEEPALIVE_EXPIRY: float = 30
+    HTTP_CLIENT_TIMEOUT: float = 5
+    HTTP_CLIENT_HTTP2: bool = True
+
+    # Threads of the pool running blocking calls outside of the event loop
+    EXECUTOR_MAX_WORKERS: int = 8
+    # Debug mode logging the stack of the code which blocks the event loop for more than LOOP_MONITOR_THRESHOLD
+    # seconds, the event loop is checked every LOOP_MONITOR_INTERVAL seconds
+    LOOP_MONITOR_ENABLED: bool = False
+    LOOP_MONITOR_THRESHOLD: float = 0.1
+    LOOP_MONITOR_INTERVAL: float = 0.05
+
+    # Copy and delete requests are split into jobs of at most FILE_OPERATION_MAX_TARGETS_PER_JOB targets, each sent
+    # to the queue as its own message. At most FILE_OPERATION_CONCURRENCY jobs or operations are created at a time
+    FILE_OPERATION_MAX_TARGETS_PER_JOB: int = 100
+    FILE_OPERATION_CONCURRENCY: int = 10
+    # File operation messages are saved in a Redis outbox with their jobs and sent to the queue in the background,
+    # checking for due messages every interval seconds. A message not acknowledged within the lease is sent again,
+    # failed messages are retried with exponential backoff and their jobs terminated after the maximum attempts
+    QUEUE_OUTBOX_INTERVAL: float = 1
+    QUEUE_OUTBOX_BATCH_SIZE: int = 100
+    QUEUE_OUTBOX_LEASE: int = 60
+    QUEUE_OUTBOX_BACKOFF_BASE: float = 1
+    QUEUE_OUTBOX_BACKOFF_MAX: float = 300
+    QUEUE_OUTBOX_MAX_ATTEMPTS: int = 10
 
     REDIS_HOST: str
     REDIS_PORT: int
     REDIS_DB: int
     REDIS_PASSWORD: str
+    # COUNT hint of SCAN commands replacing KEYS and the maximum number of keys fetched by one MGET
+    REDIS_SCAN_COUNT: int = 1000
+    REDIS_MGET_BATCH_SIZE: int = 500
+
+    # Seconds task changes are gathered for before being streamed, progress updates of one task within it are merged.
+    # A heartbeat event keeps idle task streams open
+    TASK_STREAM_COALESCE_INTERVAL: float = 0.5
+    TASK_STREAM_HEARTBEAT_INTERVAL: float = 15
+
+    # Seconds session jobs are kept in Redis after their last update, by default and for succeed and terminated jobs
+    SESSION_JOB_TTL: int = 86400
+    SESSION_JOB_SUCCEED_TTL: int = 3600
+    SESSION_JOB_TERMINATED_TTL: int = 259200
+    # Remove session jobs from Redis once their retention ends, checking for them every interval seconds, and export
+    # them into the database when enabled
+    SESSION_JOB_EXPORT_ENABLED: bool = False
+    SESSION_JOB_EXPORT_INTERVAL: int = 60
+    SESSION_JOB_EXPORT_BATCH_SIZE: int = 500
 
     RDS_HOST: str
     RDS_PORT: str
@@ -76,6 +138,23 @@ class Settings(BaseSettings):
     RDS_TABLE_NAME: str = 'archive_preview'
     RDS_ECHO_SQL_QUERIES: bool = False
 
+    # Lease duration in seconds applied to resource locks requested without ttl, 0 means no expiration
+    RESOURCE_LOCK_DEFAULT_TTL: int = 0
+    # Treat resource keys as paths where keys ending with "/" lock the whole folder tree below them
+    RESOURCE_LOCK_HIERARCHICAL: bool = False
+    # Upper limit in seconds for the wait_timeout of lock requests waiting in the queue for a busy key
+    RESOURCE_LOCK_MAX_WAIT_TIMEOUT: int = 60
+    # Prefix of all Redis keys used by the resource locks, eg. "resource-lock:"
+    RESOURCE_LOCK_NAMESPACE: str = ''
+    # Reject unlock and renew requests without the fencing token returned by the lock request. Off by default for the
+    # clients which don't pass the token yet, then holders without lease and owner are not recorded and an unlock
+    # without token or lease releases a holder without lease of the given owner, so any client naming the same owner,
+    # or none, can release it
+    RESOURCE_LOCK_REQUIRE_FENCING_TOKEN: bool = False
+    # Storage of the lock entries, "string" keeps one Redis key per lock and "hash" packs them into hashes per bucket.
+    # Switch all instances to "hash" at once, then move the existing entries with the migrate_layout module
+    RESOURCE_LOCK_LAYOUT: str = 'string'
+
     MINIO_HOST: str
     MINIO_PORT: str
 
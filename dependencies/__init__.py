@@ -12,8 +12,16 @@
 
 from dependencies.cache import Cache
 from dependencies.cache import get_redis
+from dependencies.executor import ExecutorManager
+from dependencies.executor import get_executor_manager
+from dependencies.http_client import HTTPClientManager
+from dependencies.http_client import get_http_client_manager
 
 __all__ = [
     'Cache',
+    'ExecutorManager',
+    'HTTPClientManager',
+    'get_executor_manager',
+    'get_http_client_manager',
     'get_redis',
 ]
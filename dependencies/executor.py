@@ -0,0 +1,65 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program. If not, see
+# http://www.gnu.org/licenses/.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any
+from typing import Callable
+from typing import Optional
+from typing import TypeVar
+
+from config import get_settings
+
+T = TypeVar('T')
+
+
+class ExecutorManager:
+    """Hold the thread pool running blocking work, like file or CPU bound calls, outside of the event loop.
+
+    The pool is shut down at the application shutdown event.
+    """
+
+    def __init__(self) -> None:
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    async def __call__(self) -> 'ExecutorManager':
+        """Return the manager as a FastAPI callable dependency."""
+
+        return self
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        """Return the thread pool, created on the first call."""
+
+        if self.executor is None:
+            settings = get_settings()
+            self.executor = ThreadPoolExecutor(
+                max_workers=settings.EXECUTOR_MAX_WORKERS, thread_name_prefix='dataops-worker'
+            )
+        return self.executor
+
+    async def run_sync(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Call the function in the thread pool and return its result without blocking the event loop."""
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.get_executor(), partial(func, *args, **kwargs))
+
+    def close(self) -> None:
+        """Shut the thread pool down, work not started yet is cancelled."""
+
+        executor = self.executor
+        self.executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+get_executor_manager = ExecutorManager()
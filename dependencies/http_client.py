@@ -0,0 +1,65 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see http://www.gnu.org/licenses/.
+
+
+from importlib.util import find_spec
+from typing import Dict
+
+import httpx
+
+from config import get_settings
+
+HTTP2_AVAILABLE = find_spec('h2') is not None
+
+
+class HTTPClientManager:
+    """Hold the pooled HTTP clients shared by all outbound calls, one client per service.
+
+    Clients keep connections to their service alive between calls and are closed at the application shutdown event.
+    """
+
+    def __init__(self) -> None:
+        self.clients: Dict[str, httpx.AsyncClient] = {}
+
+    async def __call__(self) -> 'HTTPClientManager':
+        """Return the manager as a FastAPI callable dependency."""
+
+        return self
+
+    def get_client(self, service: str) -> httpx.AsyncClient:
+        """Return the client of the service, created on the first call."""
+
+        client = self.clients.get(service)
+        if client is None or client.is_closed:
+            settings = get_settings()
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.HTTP_CLIENT_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=settings.HTTP_CLIENT_KEEPALIVE_EXPIRY,
+                ),
+                timeout=settings.HTTP_CLIENT_TIMEOUT,
+                http2=settings.HTTP_CLIENT_HTTP2 and HTTP2_AVAILABLE,
+            )
+            self.clients[service] = client
+        return client
+
+    async def close(self) -> None:
+        """Close the clients and their connections."""
+
+        clients = list(self.clients.values())
+        self.clients = {}
+        for client in clients:
+            await client.aclose()
+
+
+get_http_client_manager = HTTPClientManager()
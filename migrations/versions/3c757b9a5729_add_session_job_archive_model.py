@@ -0,0 +1,44 @@
+"""add_session_job_archive_model.
+
+Revision ID: 3c757b9a5729
+Revises: ebd1730ac381
+Create Date: 2026-10-18 20:40:51.128364
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '3c757b9a5729'
+down_revision = 'ebd1730ac381'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'session_job_archive',
+        sa.Column('id', sa.BigInteger),
+        sa.Column('session_id', sa.VARCHAR),
+        sa.Column('job_id', sa.VARCHAR),
+        sa.Column('label', sa.VARCHAR),
+        sa.Column('code', sa.VARCHAR),
+        sa.Column('action', sa.VARCHAR),
+        sa.Column('operator', sa.VARCHAR),
+        sa.Column('status', sa.VARCHAR),
+        sa.Column('job', postgresql.JSONB),
+        sa.Column('update_timestamp', sa.BigInteger),
+        sa.Column('archived_at', sa.DateTime, server_default=sa.func.now()),
+        sa.PrimaryKeyConstraint('id'),
+        schema='public',
+    )
+    op.create_index(
+        'ix_session_job_archive_session_id', 'session_job_archive', ['session_id'], unique=False, schema='public'
+    )
+    op.create_index('ix_session_job_archive_job_id', 'session_job_archive', ['job_id'], unique=False, schema='public')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_session_job_archive_job_id', table_name='session_job_archive', schema='public')
+    op.drop_index('ix_session_job_archive_session_id', table_name='session_job_archive', schema='public')
+    op.drop_table('session_job_archive', schema='public')
@@ -0,0 +1,64 @@
+"""add_archive_preview_file_id_index.
+
+Archive previews are inserted with ON CONFLICT (file_id), which needs this unique index, so the migration has to run
+before the service version relying on it is deployed.
+
+Existing previews with the same file_id are not removed, the migration fails listing the duplicated file ids instead,
+so they can be reviewed and cleaned up before running it again.
+
+The index is built concurrently outside a transaction. A build failing on a duplicate inserted meanwhile leaves an
+invalid index behind, so the migration drops it and checks for duplicates again right before each build and can be
+run again.
+
+Revision ID: 527245fb639e
+Revises: 3c757b9a5729
+Create Date: 2026-10-18 23:12:07.482913
+"""
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '527245fb639e'
+down_revision = '3c757b9a5729'
+branch_labels = None
+depends_on = None
+
+DUPLICATES_LIMIT = 20
+
+
+def check_duplicates() -> None:
+    """Raise an error listing the file ids with more than one archive preview."""
+
+    query = sa.text(
+        'SELECT file_id, count(*) FROM public.archive_preview GROUP BY file_id HAVING count(*) > 1 '
+        'ORDER BY file_id LIMIT :limit'
+    )
+    duplicates = op.get_bind().execute(query, {'limit': DUPLICATES_LIMIT}).fetchall()
+    if duplicates:
+        listed = ', '.join(f'{file_id} ({count} rows)' for file_id, count in duplicates)
+        if len(duplicates) == DUPLICATES_LIMIT:
+            listed += ', ...'
+        raise RuntimeError(
+            f'Archive previews with duplicated file_id must be removed before the unique index is created: {listed}'
+        )
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS public.ix_archive_preview_file_id')
+        check_duplicates()
+        op.create_index(
+            'ix_archive_preview_file_id',
+            'archive_preview',
+            ['file_id'],
+            unique=True,
+            schema='public',
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_archive_preview_file_id', table_name='archive_preview', schema='public', postgresql_concurrently=True
+        )
@@ -13,6 +13,9 @@
 from sqlalchemy import VARCHAR
 from sqlalchemy import BigInteger
 from sqlalchemy import Column
+from sqlalchemy import DateTime
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -25,7 +28,7 @@ class ArchivePreviewModel(Base):
     __tablename__ = ConfigClass.RDS_TABLE_NAME
     __table_args__ = {'schema': ConfigClass.RDS_SCHEMA}
     id = Column(BigInteger, primary_key=True)
-    file_id = Column(UUID(as_uuid=True))
+    file_id = Column(UUID(as_uuid=True), unique=True, index=True)
     archive_preview = Column(VARCHAR())
 
     def __init__(self, file_id, archive_preview):
@@ -37,3 +40,36 @@ class ArchivePreviewModel(Base):
         for field in ['id', 'file_id', 'archive_preview']:
             result[field] = str(getattr(self, field))
         return result
+
+
+class SessionJobArchiveModel(Base):
+    __tablename__ = 'session_job_archive'
+    __table_args__ = {'schema': ConfigClass.RDS_SCHEMA}
+    id = Column(BigInteger, primary_key=True)
+    session_id = Column(VARCHAR(), index=True)
+    job_id = Column(VARCHAR(), index=True)
+    label = Column(VARCHAR())
+    code = Column(VARCHAR())
+    action = Column(VARCHAR())
+    operator = Column(VARCHAR())
+    status = Column(VARCHAR())
+    job = Column(JSONB())
+    update_timestamp = Column(BigInteger)
+    archived_at = Column(DateTime(), server_default=func.now())
+
+    def __init__(self, job):
+        self.session_id = job['session_id']
+        self.job_id = job['job_id']
+        self.label = job['label']
+        self.code = job['code']
+        self.action = job['action']
+        self.operator = job['operator']
+        self.status = job['status']
+        self.job = job
+        self.update_timestamp = int(job['update_timestamp'])
+
+    def to_dict(self):
+        result = {'job': self.job}
+        for field in ['id', 'session_id', 'job_id', 'status', 'update_timestamp', 'archived_at']:
+            result[field] = str(getattr(self, field))
+        return result
@@ -81,6 +81,54 @@ class FileOperationsPOSTResponse(APIResponse):
     )
 
 
+class FileOperationsBatchPOST(BaseModel):
+    items: List[FileOperationsPOST]
+
+
+class FileOperationsBatchResult(BaseModel):
+    code: int
+    error_msg: str = ''
+    result: list = []
+
+
+class FileOperationsBatchResponse(APIResponse):
+    result: List[FileOperationsBatchResult] = Field(
+        [],
+        example=[
+            {
+                'code': 202,
+                'error_msg': '',
+                'result': [
+                    {
+                        'session_id': 'unique_session_2021',
+                        'job_id': '1bfe8fd8-8b41-11eb-a8bd-eaff9e667817-1616439732',
+                        'source': 'file1.png',
+                        'action': 'data_transfer',
+                        'status': 'RUNNING',
+                        'project_code': 'testproject',
+                        'operator': 'admin',
+                        'progress': 0,
+                        'payload': {},
+                        'update_timestamp': '1616439731',
+                    },
+                ],
+            },
+            {
+                'code': 400,
+                'error_msg': 'Invalid source: 776dc0a8b',
+                'result': [],
+            },
+        ],
+    )
+
+
+class MetadataCacheGETResponse(APIResponse):
+    result: dict = Field(
+        {},
+        example={'size': 120, 'hits': 950, 'negative_hits': 3, 'misses': 135, 'evictions': 0},
+    )
+
+
 class EActionState(Enum):
     """Action state."""
 
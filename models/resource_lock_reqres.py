@@ -41,6 +41,15 @@ class ResourceLockOperation(str, Enum):
 class ResourceLockRequestBody(BaseModel):
     resource_key: str = Field(description='An identity key to mark the locked resource, can be path, geid, guid')
     operation: ResourceLockOperation
+    ttl: Optional[int] = Field(description='Lease duration in seconds, the lock expires unless it is renewed', gt=0)
+    lease_id: Optional[str] = Field(description='An identity of the lease, generated when not provided for lock')
+    owner: Optional[str] = Field(description='A label of the lock holder used to find the lock, eg. username')
+    fencing_token: Optional[int] = Field(description='A token of the holder returned by lock to release that holder')
+    wait_timeout: Optional[float] = Field(
+        description='Seconds to wait in the queue when the resource is locked, the conflict is returned right away '
+        'when not provided',
+        gt=0,
+    )
 
 
 class ResourceLockBulkRequestBody(BaseModel):
@@ -48,11 +57,48 @@ class ResourceLockBulkRequestBody(BaseModel):
         description='A list of identity keys to mark the locked resource, can be path, geid, guid'
     )
     operation: ResourceLockOperation
+    ttl: Optional[int] = Field(description='Lease duration in seconds, the locks expire unless they are renewed', gt=0)
+    lease_id: Optional[str] = Field(description='An identity of the lease, generated when not provided for lock')
+    owner: Optional[str] = Field(description='A label of the lock holder used to find the lock, eg. username')
+    fencing_token: Optional[int] = Field(description='A token of the holder returned by lock to release that holder')
+
+
+class ResourceLockRenewRequestBody(BaseModel):
+    resource_key: str
+    lease_id: str
+    ttl: int = Field(description='New lease duration in seconds counted from now', gt=0)
+    fencing_token: Optional[int] = Field(description='A token of the holder returned by lock')
+
+
+class ResourceLockBulkRenewRequestBody(BaseModel):
+    resource_keys: List[str]
+    lease_id: str
+    ttl: int = Field(description='New lease duration in seconds counted from now', gt=0)
+    fencing_token: Optional[int] = Field(description='A token of the holder returned by lock')
 
 
 class ResourceLockResponseResult(BaseModel):
     key: str
     status: Optional[str]
+    lease_id: Optional[str]
+    owner: Optional[str]
+    fencing_token: Optional[int]
+
+
+class ResourceLockState(BaseModel):
+    key: str
+    status: Optional[str]
+    acquired_at: Optional[int] = Field(description='Acquisition time of the lock in milliseconds since epoch')
+    owners: Dict[str, int] = Field(default_factory=dict, description='Number of holders per owner')
+    fencing_tokens: List[int] = Field(default_factory=list, description='Fencing tokens of the current holders')
+
+
+class ResourceLockListResponse(APIResponse):
+    result: List[ResourceLockState]
+
+
+class ResourceLockBulkCheckRequestBody(BaseModel):
+    resource_keys: List[str]
 
 
 class ResourceLockResponse(APIResponse):
@@ -61,6 +107,9 @@ class ResourceLockResponse(APIResponse):
 
 class ResourceLockBulkResponse(APIResponse):
     result: List[Tuple[str, bool]]
+    lease_id: Optional[str]
+    owner: Optional[str]
+    fencing_token: Optional[int]
 
 
 class RLockPOST(BaseModel):
@@ -10,6 +10,10 @@
 # You should have received a copy of the GNU Affero General Public License along with this program. If not,
 # see http://www.gnu.org/licenses/.
 
+from typing import Any
+from typing import List
+from typing import Optional
+
 from pydantic import BaseModel
 from pydantic import Field
 
@@ -77,6 +81,10 @@ class TaskDispatchPOSTResponse(APIResponse):
     )
 
 
+class TaskDispatchGETResponse(APIResponse):
+    next_cursor: Optional[str] = Field(None, example='1616439731:2')
+
+
 class TaskDispatchDELETE(BaseModel):
     session_id: str
     label: str = 'Container'
@@ -93,3 +101,42 @@ class TaskDispatchPUT(BaseModel):
     status: str
     add_payload: dict = {}
     progress: int = 0
+
+
+class TaskDispatchBulkPOST(BaseModel):
+    items: List[TaskDispatchPOST]
+
+
+class TaskDispatchBulkPUT(BaseModel):
+    items: List[TaskDispatchPUT]
+
+
+class TaskDispatchBulkDELETE(BaseModel):
+    items: List[TaskDispatchDELETE]
+
+
+class TaskDispatchBulkResult(BaseModel):
+    job_id: str
+    status: str
+    error_msg: str = ''
+    result: Any = None
+
+
+class TaskDispatchBulkResponse(APIResponse):
+    result: List[TaskDispatchBulkResult] = Field(
+        [],
+        example=[
+            {
+                'job_id': '1bfe8fd8-8b41-11eb-a8bd-eaff9e667817-1616439732',
+                'status': 'SUCCEED',
+                'error_msg': '',
+                'result': None,
+            },
+            {
+                'job_id': '2c0a9e4e-8b41-11eb-a8bd-eaff9e667817-1616439733',
+                'status': 'FAILED',
+                'error_msg': 'job id already exists',
+                'result': None,
+            },
+        ],
+    )
@@ -10,9 +10,8 @@
 # You should have received a copy of the GNU Affero General Public License along with this program.
 # If not, see http://www.gnu.org/licenses/.
 
-import httpx
-
 from config import ConfigClass
+from dependencies import get_http_client_manager
 from models import filemeta_models as models
 
 
@@ -35,8 +34,8 @@ class CataLoguingManager:
             'processed_pipeline': '',
         }
 
-        async with httpx.AsyncClient() as client:
-            res = await client.post(json=req_postform, url=self.base_url + filedata_endpoint, timeout=None)
+        client = get_http_client_manager.get_client('lineage')
+        res = await client.post(json=req_postform, url=self.base_url + filedata_endpoint, timeout=None)
         if res.status_code == 200:
             json_payload = res.json()
             created_entity = None
@@ -10,30 +10,48 @@
 # You should have received a copy of the GNU Affero General Public License along with this program.
 # If not, see http://www.gnu.org/licenses/.
 
+import asyncio
+import inspect
 import re
+from typing import Awaitable
+from typing import Iterable
+from typing import List
 from typing import Optional
+from typing import TypeVar
 
-import httpx
 from common import GEIDClient
 
 from config import ConfigClass
+from dependencies import get_http_client_manager
 
+T = TypeVar('T')
 
-def fetch_geid():
+
+def fetch_geid() -> str:
+    """Return a new GEID, generated locally when it is needed so its timestamp is the allocation time.
+
+    GEIDClient builds the id from a random UUID and the current time without any I/O, so it doesn't block the event
+    loop and ids are not pooled or shared between requests.
+    """
     client = GEIDClient()
     geid = client.get_GEID()
     return geid
 
 
+async def fetch_resource_by_id(item_id: str) -> Optional[dict]:
+    """Get the item from metadata service by id, return None if the id does not exist."""
+    url = f'{ConfigClass.METADATA_SERVICE}item/{item_id}/'
+    client = get_http_client_manager.get_client('metadata')
+    request = await client.get(url)
+    return request.json()['result'] or None
+
+
 async def get_resource_by_id(item_id: str) -> Optional[dict]:
     """Get the item from metadata service by id.
 
     raise exception if the id does not exist.
     """
-    url = f'{ConfigClass.METADATA_SERVICE}item/{item_id}/'
-    async with httpx.AsyncClient() as client:
-        request = await client.get(url)
-    resource = request.json()['result']
+    resource = await fetch_resource_by_id(item_id)
 
     if not resource:
         raise Exception('Not found resource: ' + item_id)
@@ -41,6 +59,31 @@ async def get_resource_by_id(item_id: str) -> Optional[dict]:
     return resource
 
 
+async def gather_bounded(aws: Iterable[Awaitable[T]], limit: int) -> List[T]:
+    """Run the awaitables concurrently, at most limit at a time, and return their results in order.
+
+    The first exception cancels the awaitables still running or waiting for their turn and is raised. Coroutines which
+    never got their turn are closed, so they are not reported as never awaited.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw: Awaitable[T]) -> T:
+        async with semaphore:
+            return await aw
+
+    aws = list(aws)
+    tasks = [asyncio.ensure_future(run(aw)) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for aw in aws:
+            if inspect.iscoroutine(aw) and inspect.getcoroutinestate(aw) == inspect.CORO_CREATED:
+                aw.close()
+
+
 def get_resource_type(labels: list):
     """Get resource type."""
     resources = ['file', 'name_folder', 'folder', 'container']
@@ -0,0 +1,90 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see http://www.gnu.org/licenses/.
+
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+from common import LoggerFactory
+
+logger = LoggerFactory('loop_monitor').get_logger()
+
+
+class LoopBlockMonitor:
+    """Report the code blocking the event loop for longer than the threshold and for how long.
+
+    The loop records a heartbeat every interval seconds. A watchdog thread logs the stack of the loop thread once the
+    heartbeat is late by more than the threshold, then the total blocking time when the loop resumes. Both threads
+    read and write the heartbeat and the blocking start under one lock.
+    """
+
+    def __init__(self, threshold: float, interval: float) -> None:
+        self.threshold = threshold
+        self.interval = interval
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: Optional[int] = None
+        self.heartbeat = time.monotonic()
+        self.blocked_since: Optional[float] = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def start(self) -> None:
+        """Start monitoring the running event loop."""
+
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.stopped.clear()
+        self.heartbeat = time.monotonic()
+        self.loop.call_later(self.interval, self.beat)
+        threading.Thread(target=self.watch, name='loop-monitor', daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop the heartbeat and the watchdog thread."""
+
+        self.stopped.set()
+
+    def beat(self) -> None:
+        now = time.monotonic()
+        with self.lock:
+            blocked_since = self.blocked_since
+            self.heartbeat = now
+            self.blocked_since = None
+        if blocked_since is not None:
+            logger.warning(f'Event loop was blocked for {now - blocked_since:.3f} seconds')
+        if not self.stopped.is_set():
+            self.loop.call_later(self.interval, self.beat)
+
+    def watch(self) -> None:
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def check(self) -> None:
+        """Report the event loop as blocked once the heartbeat is late by more than the threshold."""
+
+        with self.lock:
+            heartbeat = self.heartbeat
+            lag = time.monotonic() - heartbeat - self.interval
+            blocked = lag > self.threshold and self.blocked_since is None
+            if blocked:
+                self.blocked_since = heartbeat + self.interval
+        if blocked:
+            self.report(lag)
+
+    def report(self, lag: float) -> None:
+        """Log the stack of the code running in the event loop thread."""
+
+        frame = sys._current_frames().get(self.loop_thread_id)
+        stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+        logger.warning(f'Event loop blocked for more than {lag:.3f} seconds in:\n{stack}')
@@ -0,0 +1,149 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see http://www.gnu.org/licenses/.
+
+
+import json
+import time
+from collections import OrderedDict
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from config import ConfigClass
+from resources.redis import SrvAioRedisSingleton
+
+
+def get_cache_key(item_id: str) -> str:
+    """Return the redis key of the cached metadata item."""
+
+    return 'metadata-item:{}'.format(item_id)
+
+
+def get_ttl(item: Optional[Dict[str, Any]]) -> int:
+    """Return the seconds the item is cached for, ids not found are cached as None for a shorter time."""
+
+    return ConfigClass.METADATA_CACHE_TTL if item is not None else ConfigClass.METADATA_CACHE_NEGATIVE_TTL
+
+
+class MetadataCache:
+    """LRU cache of metadata items by id, expiring entries after a short TTL.
+
+    With METADATA_CACHE_REDIS_ENABLED, items missing in process are looked up in redis and written there too, so the
+    service instances share the cache.
+    """
+
+    def __init__(self) -> None:
+        self.entries: 'OrderedDict[str, Tuple[float, Optional[Dict[str, Any]]]]' = OrderedDict()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self) -> None:
+        """Remove all entries from the process and reset the counters."""
+
+        self.entries.clear()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'size': len(self.entries),
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def get_entry(self, item_id: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """Return whether the id is cached in process and its item."""
+
+        entry = self.entries.get(item_id)
+        if entry is None:
+            return False, None
+        expires_at, item = entry
+        if expires_at <= time.monotonic():
+            del self.entries[item_id]
+            return False, None
+        self.entries.move_to_end(item_id)
+        return True, item
+
+    def set_entry(self, item_id: str, item: Optional[Dict[str, Any]]) -> None:
+        """Cache the item in process, evicting the least recently used entries above the size limit."""
+
+        self.entries[item_id] = (time.monotonic() + get_ttl(item), item)
+        self.entries.move_to_end(item_id)
+        while len(self.entries) > ConfigClass.METADATA_CACHE_SIZE:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_many(self, item_ids: List[str]) -> Tuple[Dict[str, Optional[Dict[str, Any]]], List[str]]:
+        """Return the cached items by id, with None for ids cached as not found, and the ids which are not cached."""
+
+        if not ConfigClass.METADATA_CACHE_ENABLED:
+            return {}, list(item_ids)
+
+        cached = {}
+        missing = []
+        for item_id in item_ids:
+            found, item = self.get_entry(item_id)
+            if found:
+                cached[item_id] = item
+            else:
+                missing.append(item_id)
+
+        if missing and ConfigClass.METADATA_CACHE_REDIS_ENABLED:
+            values = await SrvAioRedisSingleton().mget_by_keys([get_cache_key(item_id) for item_id in missing])
+            missing_in_redis = []
+            for item_id, value in zip(missing, values):
+                if value is None:
+                    missing_in_redis.append(item_id)
+                    continue
+                cached[item_id] = json.loads(value)
+                self.set_entry(item_id, cached[item_id])
+            missing = missing_in_redis
+
+        negative_hits = sum(item is None for item in cached.values())
+        self.negative_hits += negative_hits
+        self.hits += len(cached) - negative_hits
+        self.misses += len(missing)
+        return cached, missing
+
+    async def set_many(self, items: Dict[str, Optional[Dict[str, Any]]]) -> None:
+        """Cache the items by id, None marks ids not found."""
+
+        if not ConfigClass.METADATA_CACHE_ENABLED or not items:
+            return
+
+        for item_id, item in items.items():
+            self.set_entry(item_id, item)
+        if ConfigClass.METADATA_CACHE_REDIS_ENABLED:
+            await SrvAioRedisSingleton().set_many_by_keys(
+                [(get_cache_key(item_id), json.dumps(item), get_ttl(item)) for item_id, item in items.items()]
+            )
+
+    async def invalidate(self, item_ids: Iterable[str]) -> None:
+        """Remove the items from the cache."""
+
+        item_ids = [item_id for item_id in item_ids if item_id]
+        for item_id in item_ids:
+            self.entries.pop(item_id, None)
+        if item_ids and ConfigClass.METADATA_CACHE_ENABLED and ConfigClass.METADATA_CACHE_REDIS_ENABLED:
+            await SrvAioRedisSingleton().unlink_by_key(*[get_cache_key(item_id) for item_id in item_ids])
+
+
+metadata_cache = MetadataCache()
@@ -0,0 +1,122 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see http://www.gnu.org/licenses/.
+
+import time
+from typing import Any
+from typing import Dict
+from typing import List
+
+from common import LoggerFactory
+
+from config import ConfigClass
+from dependencies import get_http_client_manager
+from resources.helpers import fetch_resource_by_id
+from resources.helpers import gather_bounded
+from resources.metadata_cache import metadata_cache
+
+logger = LoggerFactory('metadata_client').get_logger()
+
+
+class BatchEndpointUnavailable(Exception):
+    """The metadata service does not provide the batch item endpoint."""
+
+
+class MetadataClient:
+    """Fetch items from the metadata service with one request per batch of ids.
+
+    Single ids are served with one request per id, as are all ids when a batch request fails. A metadata service
+    without the batch endpoint is asked again after METADATA_BATCH_RETRY_AFTER seconds. Items and ids not found are
+    kept in the metadata cache, so repeated lookups skip the metadata service.
+    """
+
+    batch_endpoint_unavailable_until = 0.0
+
+    def __init__(self) -> None:
+        self.batch_size = ConfigClass.METADATA_BATCH_SIZE
+        self.concurrency = ConfigClass.METADATA_CONCURRENCY
+        self.cache = metadata_cache
+
+    async def get_by_id(self, item_id: str) -> Dict[str, Any]:
+        """Get the item by id, raise exception if the id does not exist."""
+
+        items = await self.get_by_ids([item_id])
+        return items[0]
+
+    async def get_by_ids(self, item_ids: List[str]) -> List[Dict[str, Any]]:
+        """Get the items in the order of the ids, raise exception if any of the ids does not exist.
+
+        Batches are fetched concurrently and the first failure cancels the pending ones.
+        """
+
+        unique_ids = list(dict.fromkeys(item_ids))
+        fetched, missing = await self.cache.get_many(unique_ids)
+        if len(missing) > 1 and ConfigClass.METADATA_BATCH_ENABLED and self.is_batch_endpoint_available():
+            batches = []
+            for start in range(0, len(missing), self.batch_size):
+                end = start + self.batch_size
+                batches.append(self.get_batch(missing[start:end]))
+            try:
+                for items in await gather_bounded(batches, self.concurrency):
+                    fetched.update(items)
+                missing = []
+            except BatchEndpointUnavailable:
+                logger.warning('Metadata service batch endpoint is unavailable, fetching items one by one')
+                retry_at = time.monotonic() + ConfigClass.METADATA_BATCH_RETRY_AFTER
+                MetadataClient.batch_endpoint_unavailable_until = retry_at
+            except Exception as error:
+                logger.warning(f'Failed to fetch items from metadata service batch endpoint: {error}')
+
+        if missing:
+            items = await gather_bounded([self.get_one(item_id) for item_id in missing], self.concurrency)
+            fetched.update(zip(missing, items))
+
+        for item_id in unique_ids:
+            if fetched[item_id] is None:
+                raise Exception('Not found resource: ' + item_id)
+
+        return [fetched[item_id] for item_id in item_ids]
+
+    def is_batch_endpoint_available(self) -> bool:
+        return time.monotonic() >= self.batch_endpoint_unavailable_until
+
+    async def get_one(self, item_id: str) -> Dict[str, Any]:
+        """Get the item by id with one request to the item endpoint."""
+
+        item = await fetch_resource_by_id(item_id)
+        await self.cache.set_many({item_id: item})
+        if item is None:
+            raise Exception('Not found resource: ' + item_id)
+
+        return item
+
+    async def get_batch(self, item_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Get the items by ids with one request to the batch endpoint and return them by id, None for ids not found.
+
+        Raise BatchEndpointUnavailable if the metadata service does not provide the batch endpoint.
+        """
+
+        url = f'{ConfigClass.METADATA_SERVICE}items/batch/'
+        client = get_http_client_manager.get_client('metadata')
+        response = await client.get(url, params={'ids': item_ids})
+        if response.status_code in (404, 405):
+            raise BatchEndpointUnavailable()
+        response.raise_for_status()
+
+        found = {item['id']: item for item in response.json()['result']}
+        items = {item_id: found.get(item_id) for item_id in item_ids}
+        await self.cache.set_many(items)
+        return items
+
+    async def invalidate(self, item_ids: List[str]) -> None:
+        """Drop the items from the metadata cache, so they are fetched again on the next lookup."""
+
+        await self.cache.invalidate(item_ids)
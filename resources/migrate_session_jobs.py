@@ -0,0 +1,45 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the License,
+# or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see http://www.gnu.org/licenses/.
+
+"""Move session jobs stored as JSON strings under "dataaction:" keys into the "dataaction-job:" hashes.
+
+The service reads session jobs from the hashes only, and the session job indexes may still point to the string keys
+of jobs written before the hashes were introduced. Run the migration once right after deploying the hash storage:
+
+    poetry run python -m resources.migrate_session_jobs
+
+The migration keeps jobs already stored in a hash, so it is safe to run again.
+"""
+
+import asyncio
+
+from common import LoggerFactory
+
+from resources.redis import SrvAioRedisSingleton
+from resources.redis_project_session_job import session_job_migrate_string_keys
+
+logger = LoggerFactory('migrate_session_jobs').get_logger()
+
+
+async def migrate() -> int:
+    """Migrate the session jobs and return the number of migrated jobs."""
+
+    try:
+        return await session_job_migrate_string_keys()
+    finally:
+        await SrvAioRedisSingleton.close()
+
+
+if __name__ == '__main__':
+    migrated = asyncio.run(migrate())
+    logger.info(f'Migrated {migrated} session jobs into hashes')
@@ -0,0 +1,131 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero
+# General Public License as published by the Free Software Foundation, either version 3 of the License,
+# or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see http://www.gnu.org/licenses/.
+
+import asyncio
+import time
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from common import LoggerFactory
+
+from config import ConfigClass
+from dependencies import get_http_client_manager
+from resources.helpers import gather_bounded
+from resources.metadata_cache import metadata_cache
+from resources.redis_project_session_job import session_job_ack_messages
+from resources.redis_project_session_job import session_job_claim_messages
+from resources.redis_project_session_job import session_job_retry_messages
+from resources.redis_project_session_job import session_job_update_many
+
+logger = LoggerFactory('queue_outbox').get_logger()
+
+_wakeup: Optional[asyncio.Event] = None
+
+
+def get_backoff(attempts: int) -> float:
+    """Return the seconds to wait before sending a message again after the failed attempts."""
+
+    return min(ConfigClass.QUEUE_OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), ConfigClass.QUEUE_OUTBOX_BACKOFF_MAX)
+
+
+def get_message_item_ids(message: Dict[str, Any]) -> List[str]:
+    """Return the ids of the items the file operation of the message changes."""
+
+    payload = message.get('payload') or {}
+    return [payload.get('source_geid'), payload.get('destination_geid'), *(payload.get('include_geids') or [])]
+
+
+async def send_message(message: Dict[str, Any]) -> Optional[str]:
+    """Send the message to the queue service, return the error or None once it is sent."""
+
+    client = get_http_client_manager.get_client('queue')
+    try:
+        response = await client.post(url=f'{ConfigClass.QUEUE_SERVICE}send_message', json=message)
+        response.raise_for_status()
+    except Exception as e:
+        return str(e) or e.__class__.__name__
+    logger.info(f'Message To Queue has been sent: {response.text}')
+    return None
+
+
+async def publish_outbox_messages() -> int:
+    """Send one batch of due outbox messages to the queue and return the number of messages claimed.
+
+    Sent messages are acknowledged and the items their file operations change are dropped from the metadata cache,
+    failed ones are retried after a backoff. Once a message failed the maximum attempts its job is terminated with the
+    last error.
+    """
+
+    messages = await session_job_claim_messages(ConfigClass.QUEUE_OUTBOX_BATCH_SIZE, ConfigClass.QUEUE_OUTBOX_LEASE)
+    if not messages:
+        return 0
+
+    errors = await gather_bounded(
+        [send_message(message.message) for message in messages], ConfigClass.FILE_OPERATION_CONCURRENCY
+    )
+    acknowledged = []
+    changed_item_ids = []
+    terminated = []
+    retry_at = {}
+    now = time.time()
+    for message, error in zip(messages, errors):
+        if error is None:
+            acknowledged.append(message.key)
+            changed_item_ids.extend(get_message_item_ids(message.message))
+        elif message.attempts >= ConfigClass.QUEUE_OUTBOX_MAX_ATTEMPTS:
+            logger.error(f'Giving up sending message of job {message.job_id} to queue: {error}')
+            acknowledged.append(message.key)
+            terminated.append(
+                (message.session_id, '*', message.job_id, {'status': 'TERMINATED', 'payload.error': error})
+            )
+        else:
+            logger.warning(f'Failed to send message of job {message.job_id} to queue: {error}')
+            retry_at[message.key] = now + get_backoff(message.attempts)
+
+    if terminated:
+        await session_job_update_many(terminated)
+    await session_job_ack_messages(acknowledged)
+    await session_job_retry_messages(retry_at)
+    await metadata_cache.invalidate(changed_item_ids)
+    return len(messages)
+
+
+def notify_queue_outbox() -> None:
+    """Wake the publisher up to send new outbox messages without waiting for the interval."""
+
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def run_queue_outbox_publisher(interval: float) -> None:
+    """Send the outbox messages to the queue until cancelled.
+
+    Due messages are drained batch by batch whenever notified and at least every interval seconds. Several service
+    instances can run the publisher, each message is claimed by one of them at a time.
+    """
+
+    global _wakeup
+    _wakeup = asyncio.Event()
+    while True:
+        _wakeup.clear()
+        try:
+            while await publish_outbox_messages() == ConfigClass.QUEUE_OUTBOX_BATCH_SIZE:
+                pass
+        except Exception:
+            logger.exception('Failed to publish queue outbox messages')
+        try:
+            await asyncio.wait_for(_wakeup.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
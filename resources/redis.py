@@ -10,29 +10,101 @@
 # You should have received a copy of the GNU Affero General Public License along with this program.
 # If not, see http://www.gnu.org/licenses/.
 
-import json
+import time
 from datetime import timedelta
+from typing import Any
+from typing import AsyncIterator
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+from uuid import uuid4
 
 from aioredis import StrictRedis
 
 from config import ConfigClass
 
+KEY_TTL = timedelta(hours=24)
+
+# Replaces the hash in KEYS[1] and adds it to the sorted set indexes in KEYS[2..]. ARGV holds the key TTL, the index
+# TTL, the score before which index members are expired, the nx flag, the field of the replaced hash listing the
+# indexes to remove the key from, the number of fields kept from the replaced hash followed by their names, the score
+# of each index and then the hash field/value pairs.
+HSET_WITH_INDEXES = """
+local key = KEYS[1]
+if ARGV[4] == '1' and redis.call('EXISTS', key) == 1 then
+    return 0
+end
+local kept_end = 6 + tonumber(ARGV[6])
+local kept = {}
+for i = 7, kept_end do
+    kept[ARGV[i]] = redis.call('HGET', key, ARGV[i])
+end
+if ARGV[5] ~= '' then
+    local previous = redis.call('HGET', key, ARGV[5]) or ''
+    for index in string.gmatch(previous, '[^\\n]+') do
+        redis.call('ZREM', index, key)
+    end
+end
+redis.call('DEL', key)
+for field, value in pairs(kept) do
+    if value then
+        redis.call('HSET', key, field, value)
+    end
+end
+for i = kept_end + #KEYS, #ARGV, 2 do
+    redis.call('HSET', key, ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', key, ARGV[1])
+for i = 2, #KEYS do
+    redis.call('ZADD', KEYS[i], ARGV[kept_end - 1 + i], key)
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', ARGV[3])
+    redis.call('EXPIRE', KEYS[i], ARGV[2])
+end
+return 1
+"""
+
+
+# Renews the TTL of KEYS[1] to ARGV[2] seconds only while it still holds the value ARGV[1].
+EXPIRE_IF_VALUE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
 
 class SrvAioRedisSingleton:
-    __instance = {}
+    """Access Redis through one client and connection pool shared by the whole process.
+
+    The client is created by the first instance, usually at the application startup, and released by close.
+    """
+
+    __instance: Optional[StrictRedis] = None
 
     def __init__(self):
         self.host = ConfigClass.REDIS_HOST
         self.port = ConfigClass.REDIS_PORT
         self.db = ConfigClass.REDIS_DB
         self.pwd = ConfigClass.REDIS_PASSWORD
+        self.scan_count = ConfigClass.REDIS_SCAN_COUNT
+        self.mget_batch_size = ConfigClass.REDIS_MGET_BATCH_SIZE
         self.connect()
 
     def connect(self):
-        if self.__instance:
-            pass
-        else:
-            self.__instance = StrictRedis(host=self.host, port=self.port, db=self.db, password=self.pwd)
+        if SrvAioRedisSingleton.__instance is None:
+            SrvAioRedisSingleton.__instance = StrictRedis(host=self.host, port=self.port, db=self.db, password=self.pwd)
+
+    @classmethod
+    async def close(cls) -> None:
+        """Disconnect the connection pool of the shared client, the next instance creates a new client."""
+
+        if cls.__instance is not None:
+            instance, cls.__instance = cls.__instance, None
+            await instance.connection_pool.disconnect()
 
     async def ping(self):
         return await self.__instance.ping()
@@ -41,18 +113,114 @@ class SrvAioRedisSingleton:
         return await self.__instance.get(key)
 
     async def set_by_key(self, key: str, content: str):
-        res = await self.__instance.set(key, content, ex=timedelta(hours=24))
+        res = await self.__instance.set(key, content, ex=KEY_TTL)
         return res
 
-    async def mget_by_prefix(self, prefix: str):
+    async def set_by_key_nx(self, key: str, content: str, ttl: int) -> bool:
+        """Set the key expiring after ttl seconds only if it does not exist yet, return whether it was set."""
+
+        return bool(await self.__instance.set(key, content, ex=ttl, nx=True))
+
+    async def expire_if_value(self, key: str, content: str, ttl: int) -> bool:
+        """Renew the key to expire after ttl seconds while it still holds the content, return whether it was renewed."""
+
+        return bool(await self.__instance.register_script(EXPIRE_IF_VALUE)(keys=[key], args=[content, ttl]))
+
+    async def hset_by_key_with_indexes(
+        self,
+        key: str,
+        mapping: Dict[str, str],
+        indexes: Dict[str, float],
+        ttl: int,
+        index_ttl: int,
+        nx: bool = False,
+        indexes_field: str = '',
+        kept_fields: Sequence[str] = (),
+    ) -> bool:
+        """Replace the hash at the key expiring after ttl seconds and add it to the sorted set indexes with the scores.
+
+        With nx the hash is only written if the key does not exist yet, return whether the hash was written. A replaced
+        hash is removed from the indexes listed in its indexes_field, and its kept_fields are kept unless the mapping
+        sets them.
+        """
+
+        written = await self.hset_many_with_indexes(
+            [(key, mapping, indexes, ttl)], index_ttl, nx, indexes_field, kept_fields
+        )
+        return written[0]
+
+    async def hset_many_with_indexes(
+        self,
+        entries: List[Tuple[str, Dict[str, str], Dict[str, float], int]],
+        index_ttl: int,
+        nx: bool = False,
+        indexes_field: str = '',
+        kept_fields: Sequence[str] = (),
+    ) -> List[bool]:
+        """Write (key, mapping, indexes, ttl) entries like hset_by_key_with_indexes in one MULTI pipeline.
+
+        Indexes expire index_ttl seconds after their last write, which should be the longest key TTL. Index members
+        scored before that time point to expired keys, so they are pruned on every write.
+        """
+
+        script = self.__instance.register_script(HSET_WITH_INDEXES)
+        expired_before = time.time() - index_ttl
+        async with self.__instance.pipeline(transaction=True) as pipe:
+            for key, mapping, indexes, ttl in entries:
+                args = [ttl, index_ttl, expired_before, int(nx), indexes_field, len(kept_fields), *kept_fields]
+                args.extend(indexes.values())
+                for field, value in mapping.items():
+                    args.extend([field, value])
+                await script(keys=[key, *indexes], args=args, client=pipe)
+            results = await pipe.execute()
+        return [bool(result) for result in results]
+
+    async def iter_keys(self, query: str) -> AsyncIterator[bytes]:
+        """Yield keys matching the query using incremental SCAN instead of blocking KEYS.
+
+        SCAN may return the same key more than once, so the already yielded keys are skipped.
+        """
+
+        seen = set()
+        async for key in self.__instance.scan_iter(match=query, count=self.scan_count):
+            if key not in seen:
+                seen.add(key)
+                yield key
+
+    async def iter_key_batches(self, query: str) -> AsyncIterator[List[bytes]]:
+        """Yield keys matching the query in batches of at most mget_batch_size keys."""
+
+        batch = []
+        async for key in self.iter_keys(query):
+            batch.append(key)
+            if len(batch) >= self.mget_batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    async def iter_mget(self, query: str) -> AsyncIterator[bytes]:
+        """Yield values of keys matching the query, fetched by bounded MGET batches.
+
+        Keys removed between the SCAN and the MGET are skipped.
+        """
+
+        async for keys in self.iter_key_batches(query):
+            for value in await self.__instance.mget(keys):
+                if value is not None:
+                    yield value
+
+    async def iter_mget_by_prefix(self, prefix: str) -> AsyncIterator[bytes]:
         query = '{}:*'.format(prefix)
-        keys = await self.__instance.keys(query)
-        return await self.__instance.mget(keys)
+        async for value in self.iter_mget(query):
+            yield value
+
+    async def mget_by_prefix(self, prefix: str):
+        return [value async for value in self.iter_mget_by_prefix(prefix)]
 
     async def get_by_prefix(self, prefix: str):
         query = '*:{}:*'.format(prefix)
-        keys = await self.__instance.keys(query)
-        return keys
+        return [key async for key in self.iter_keys(query)]
 
     async def check_by_key(self, key: str):
         return await self.__instance.exists(key)
@@ -60,50 +228,194 @@ class SrvAioRedisSingleton:
     async def delete_by_key(self, key: str):
         return await self.__instance.delete(key)
 
-    async def unlink_by_key(self, key: str):
-        return await self.__instance.unlink(key)
+    async def unlink_by_key(self, *keys: str):
+        return await self.__instance.unlink(*keys)
+
+    async def mget_by_keys(self, keys: List[str]) -> List[Optional[bytes]]:
+        return await self.__instance.mget(keys)
+
+    async def set_many_by_keys(self, entries: List[Tuple[str, str, int]]) -> List[bool]:
+        """Set (key, content, ttl) entries in one pipeline, each key expiring after its ttl seconds."""
+
+        async with self.__instance.pipeline(transaction=False) as pipe:
+            for key, content, ttl in entries:
+                pipe.set(key, content, ex=ttl)
+            return await pipe.execute()
+
+    async def iter_mdele_by_prefix(self, prefix: str) -> AsyncIterator[int]:
+        """Delete keys with the prefix batch by batch and yield the number of deleted keys for each batch.
+
+        Keys are collected by a complete SCAN before deleting, so removals do not interfere with the cursor. Keys are
+        removed with UNLINK, so the memory of large values is reclaimed in the background.
+        """
 
-    async def mdele_by_prefix(self, prefix: str):
         query = '{}:*'.format(prefix)
-        keys = await self.__instance.keys(query)
+        keys = [key async for key in self.iter_keys(query)]
+        for start in range(0, len(keys), self.mget_batch_size):
+            end = start + self.mget_batch_size
+            yield await self.__instance.unlink(*keys[start:end])
+
+    async def mdele_by_prefix(self, prefix: str):
+        return [deleted async for deleted in self.iter_mdele_by_prefix(prefix)]
+
+    async def iter_key_batches_by_indexes(
+        self, indexes: List[str], min_score: Union[float, str] = '-inf', max_score: Union[float, str] = '+inf'
+    ) -> AsyncIterator[List[bytes]]:
+        """Yield keys present in all the sorted set indexes, newest first, in batches of at most mget_batch_size keys.
+
+        Several indexes are intersected into a temporary sorted set which is read page by page. Only keys with scores
+        within the inclusive score range are yielded.
+        """
+
+        if len(indexes) == 1:
+            source = indexes[0]
+        else:
+            source = 'index-intersection:{}'.format(uuid4().hex)
+            async with self.__instance.pipeline(transaction=True) as pipe:
+                pipe.zinterstore(source, indexes, aggregate='MAX')
+                pipe.expire(source, timedelta(minutes=5))
+                await pipe.execute()
+
+        try:
+            start = 0
+            while True:
+                keys = await self.__instance.zrevrangebyscore(
+                    source, max_score, min_score, start=start, num=self.mget_batch_size
+                )
+                if keys:
+                    yield keys
+                if len(keys) < self.mget_batch_size:
+                    break
+                start += self.mget_batch_size
+        finally:
+            if source not in indexes:
+                await self.__instance.delete(source)
+
+    async def get_page_by_indexes(
+        self,
+        indexes: List[str],
+        min_score: Union[float, str],
+        max_score: Union[float, str],
+        page_max_score: Union[float, str],
+        offset: int,
+        count: int,
+    ) -> Tuple[int, int, List[Tuple[bytes, float]]]:
+        """Return one page of keys present in all the sorted set indexes, newest first, in one round trip.
+
+        The page holds at most count (key, score) pairs with scores from min_score to page_max_score, skipping the first
+        offset keys. Along with the page, the number of keys with scores from min_score to max_score and the number of
+        them scored higher than page_max_score are returned.
+        """
+
+        intersection = len(indexes) > 1
+        source = 'index-intersection:{}'.format(uuid4().hex) if intersection else indexes[0]
+        async with self.__instance.pipeline(transaction=True) as pipe:
+            if intersection:
+                pipe.zinterstore(source, indexes, aggregate='MAX')
+            pipe.zcount(source, min_score, max_score)
+            pipe.zcount(source, '({}'.format(page_max_score), max_score)
+            pipe.zrevrangebyscore(source, page_max_score, min_score, start=offset, num=count, withscores=True)
+            if intersection:
+                pipe.delete(source)
+            results = await pipe.execute()
+        if intersection:
+            results = results[1:-1]
+        total, newer, page = results
+        return total, newer, page
+
+    async def iter_hgetall_by_indexes(
+        self, indexes: List[str], min_score: Union[float, str] = '-inf', max_score: Union[float, str] = '+inf'
+    ) -> AsyncIterator[Dict[bytes, bytes]]:
+        """Yield hashes of keys present in all the sorted set indexes with scores within the range, newest first.
+
+        Keys expired since they were indexed are skipped.
+        """
+
+        async for keys in self.iter_key_batches_by_indexes(indexes, min_score, max_score):
+            for mapping in await self.hgetall_many(keys):
+                if mapping:
+                    yield mapping
+
+    async def iter_hgetall(self, query: str) -> AsyncIterator[Dict[bytes, bytes]]:
+        """Yield hashes of keys matching the query, fetched by pipelined HGETALL batches."""
+
+        async for keys in self.iter_key_batches(query):
+            for mapping in await self.hgetall_many(keys):
+                if mapping:
+                    yield mapping
+
+    async def hgetall_many(self, keys: List[bytes]) -> List[Dict[bytes, bytes]]:
+        """Return hashes of the keys fetched by pipelined HGETALL batches of at most mget_batch_size keys."""
+
+        mappings = []
+        for start in range(0, len(keys), self.mget_batch_size):
+            end = start + self.mget_batch_size
+            async with self.__instance.pipeline(transaction=False) as pipe:
+                for key in keys[start:end]:
+                    pipe.hgetall(key)
+                mappings.extend(await pipe.execute())
+        return mappings
+
+    async def run_script_many(self, script: str, calls: List[Tuple[List[str], List[Any]]]) -> List[Any]:
+        """Run the script once for each (keys, args) call in pipelined batches of at most mget_batch_size calls."""
+
+        registered_script = self.__instance.register_script(script)
         results = []
-        for key in keys:
-            res = await self.delete_by_key(key)
-            results.append(res)
+        for start in range(0, len(calls), self.mget_batch_size):
+            end = start + self.mget_batch_size
+            async with self.__instance.pipeline(transaction=False) as pipe:
+                for keys, args in calls[start:end]:
+                    await registered_script(keys=keys, args=args, client=pipe)
+                results.extend(await pipe.execute())
         return results
 
+    async def get_keys_by_score(self, index: str, max_score: Union[float, str], count: int) -> List[bytes]:
+        """Return at most count keys of the sorted set index scored up to max_score, lowest first."""
+
+        return await self.__instance.zrangebyscore(index, '-inf', max_score, start=0, num=count)
+
+    async def delete_with_indexes(self, keys: List[bytes], indexes: Iterable[str]) -> int:
+        """Unlink the keys and remove them from the sorted set indexes, return the number of deleted keys."""
+
+        async with self.__instance.pipeline(transaction=True) as pipe:
+            pipe.unlink(*keys)
+            for index in indexes:
+                pipe.zrem(index, *keys)
+            results = await pipe.execute()
+        return results[0]
+
+    async def hdel_with_indexes(self, keys: List[bytes], fields: List[str], indexes: Iterable[str]) -> None:
+        """Remove the fields from the hashes of the keys and the keys from the sorted set indexes in one transaction."""
+
+        async with self.__instance.pipeline(transaction=True) as pipe:
+            for key in keys:
+                pipe.hdel(key, *fields)
+            for index in indexes:
+                pipe.zrem(index, *keys)
+            await pipe.execute()
+
+    async def update_scores(self, index: str, scores: Dict[bytes, float]) -> None:
+        """Set the scores of the members already in the sorted set index, members no longer in it are not added."""
+
+        await self.__instance.zadd(index, scores, xx=True)
+
     async def get_by_pattern(self, key: str, pattern: str):
         query_string = '{}:*{}*'.format(key, pattern)
-        keys = await self.__instance.keys(query_string)
-        return await self.__instance.mget(keys)
+        return [value async for value in self.iter_mget(query_string)]
 
     async def publish(self, channel, data):
         res = await self.__instance.publish(channel, data)
         return res
 
-    async def subscriber(self, channel):
-        p = await self.__instance.pubsub()
-        p.subscribe(channel)
-        return p
-
-    async def file_get_status(self, file_path):
-        query = '*:{}'.format(file_path)
-        keys = await self.__instance.keys(query)
-        result = await self.__instance.mget(keys)
+    async def publish_many(self, messages: List[Tuple[str, str]]) -> List[int]:
+        """Publish (channel, data) messages in one pipeline and return the number of receivers of each message."""
 
-        current_action = None
+        async with self.__instance.pipeline(transaction=False) as pipe:
+            for channel, data in messages:
+                pipe.publish(channel, data)
+            return await pipe.execute()
 
-        decoded_result = []
-        for record in result:
-            record = record.decode('utf-8')
-            info = json.loads(record)
-            decoded_result.append(info)
-
-        if len(decoded_result) > 0:
-            latest_item = max(decoded_result, key=lambda x: x['update_timestamp'])
-            if latest_item['status'] == 'SUCCEED' or latest_item['status'] == 'TERMINATED':
-                return current_action
-            else:
-                return latest_item['action']
-
-        return current_action
+    async def subscriber(self, channel):
+        p = self.__instance.pubsub()
+        await p.subscribe(channel)
+        return p
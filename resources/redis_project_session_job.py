@@ -11,11 +11,251 @@
 # You should have received a copy of the GNU Affero General Public License along with this program.
 # If not, see http://www.gnu.org/licenses/.
 
+import asyncio
 import json
 import time
+from fnmatch import fnmatchcase
+from typing import Any
+from typing import AsyncIterator
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
 
+from config import ConfigClass
+from dependencies import get_executor_manager
 from resources.redis import SrvAioRedisSingleton
 
+FILTER_FIELDS = ('label', 'job_id', 'code', 'action', 'operator', 'status')
+# job ids are not indexed, exact job ids are read from the job key
+INDEXED_FIELDS = ('label', 'code', 'action', 'operator', 'status')
+GLOB_CHARACTERS = ('*', '?', '[')
+# session jobs were stored as JSON strings under dataaction:<session_id>:<label>:<job_id>:...:<source> before
+LEGACY_KEY_PATTERN = 'dataaction:*'
+PAYLOAD_PREFIX = 'payload.'
+INDEXES_FIELD = 'indexes'
+RETENTION_KEY = 'dataaction-retention'
+OUTBOX_KEY = 'dataaction-outbox'
+OUTBOX_MESSAGE_FIELD = 'outbox.message'
+OUTBOX_ATTEMPTS_FIELD = 'outbox.attempts'
+INTERNAL_FIELDS = (INDEXES_FIELD, OUTBOX_MESSAGE_FIELD, OUTBOX_ATTEMPTS_FIELD)
+
+# Writes the changed fields of an existing job hash and moves the job to the top of its indexes in one round trip.
+# When the status changes, ARGV[4] is the new status index replacing the indexes prefixed with ARGV[3]. The retention
+# of the final status, looked up in the (status, retention) pairs following the default retention in ARGV[7], ends
+# the job. Its retention end is tracked in the sorted set KEYS[2] and the hash is kept for the grace period in ARGV[6]
+# longer, until the job is removed from its indexes. Index members older than the index TTL in ARGV[5] are pruned.
+UPDATE_JOB = """
+local key = KEYS[1]
+local label = ARGV[1]
+local score = tonumber(ARGV[2])
+local tiers_end = 8 + 2 * tonumber(ARGV[8])
+if redis.call('EXISTS', key) == 0 then
+    return {}
+end
+if label ~= '*' and redis.call('HGET', key, 'label') ~= label then
+    return {}
+end
+for i = tiers_end + 1, #ARGV, 2 do
+    redis.call('HSET', key, ARGV[i], ARGV[i + 1])
+end
+local retention = tonumber(ARGV[7])
+local status = redis.call('HGET', key, 'status')
+for i = 9, tiers_end, 2 do
+    if ARGV[i] == status then
+        retention = tonumber(ARGV[i + 1])
+    end
+end
+redis.call('EXPIRE', key, retention + tonumber(ARGV[6]))
+redis.call('ZADD', KEYS[2], score + retention, key)
+local indexes = redis.call('HGET', key, 'indexes') or ''
+if ARGV[4] ~= '' then
+    local kept = {}
+    for index in string.gmatch(indexes, '[^\\n]+') do
+        if string.sub(index, 1, #ARGV[3]) == ARGV[3] then
+            redis.call('ZREM', index, key)
+        else
+            table.insert(kept, index)
+        end
+    end
+    table.insert(kept, ARGV[4])
+    indexes = table.concat(kept, '\\n')
+    redis.call('HSET', key, 'indexes', indexes)
+end
+for index in string.gmatch(indexes, '[^\\n]+') do
+    redis.call('ZADD', index, score, key)
+    redis.call('ZREMRANGEBYSCORE', index, '-inf', score - tonumber(ARGV[5]))
+    redis.call('EXPIRE', index, ARGV[5])
+end
+return redis.call('HGETALL', key)
+"""
+
+# Unlinks the jobs in KEYS[2..] whose retention end tracked in the sorted set KEYS[1] is not after ARGV[1] and removes
+# them from their indexes. Jobs updated since they were read for the export have a later retention end and are kept.
+REMOVE_EXPIRED_JOBS = """
+local removed = 0
+for i = 2, #KEYS do
+    local key = KEYS[i]
+    local retention_end = redis.call('ZSCORE', KEYS[1], key)
+    if retention_end and tonumber(retention_end) <= tonumber(ARGV[1]) then
+        local indexes = redis.call('HGET', key, 'indexes') or ''
+        for index in string.gmatch(indexes, '[^\\n]+') do
+            redis.call('ZREM', index, key)
+        end
+        removed = removed + redis.call('UNLINK', key)
+        redis.call('ZREM', KEYS[1], key)
+    end
+end
+return removed
+"""
+
+# Claims at most ARGV[2] jobs of the outbox sorted set KEYS[1] due by ARGV[1]. Claimed jobs are rescheduled at the
+# lease end in ARGV[3], so they are claimed again if the publisher stops before acknowledging them, and their attempts
+# are counted. Returns the key, session id, job id, message and attempts of each claimed job. Jobs which no longer
+# hold a message expired or were replaced, they are dropped from the outbox.
+CLAIM_OUTBOX = """
+local claimed = {}
+local keys = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, key in ipairs(keys) do
+    local message = redis.call('HGET', key, ARGV[4])
+    if message then
+        redis.call('ZADD', KEYS[1], ARGV[3], key)
+        local attempts = redis.call('HINCRBY', key, ARGV[5], 1)
+        local ids = redis.call('HMGET', key, 'session_id', 'job_id')
+        for _, value in ipairs({key, ids[1], ids[2], message, attempts}) do
+            table.insert(claimed, value)
+        end
+    else
+        redis.call('ZREM', KEYS[1], key)
+    end
+end
+return claimed
+"""
+
+
+def get_job_key(session_id: str, job_id: str) -> str:
+    """Return the key of the hash storing the session job."""
+
+    return 'dataaction-job:{}:{}'.format(session_id, job_id)
+
+
+def get_changes_channel(session_id: str) -> str:
+    """Return the channel the changes of the session jobs are published to."""
+
+    return 'dataaction-changes:{}'.format(session_id)
+
+
+def get_index_key(session_id: str, field: Optional[str] = None, value: Optional[str] = None) -> str:
+    """Return the key of the sorted set indexing session jobs by the field value, or of all session jobs."""
+
+    if field is None:
+        return 'dataaction-index:{}'.format(session_id)
+    return 'dataaction-index:{}:{}={}'.format(session_id, field, value)
+
+
+def get_record_index_keys(record: Dict[str, Any]) -> List[str]:
+    """Return keys of all indexes the session job record belongs to."""
+
+    session_id = record['session_id']
+    return [get_index_key(session_id)] + [get_index_key(session_id, field, record[field]) for field in INDEXED_FIELDS]
+
+
+def get_retention_tiers() -> Dict[str, int]:
+    """Return the seconds session jobs are kept after their last update for the statuses with their own retention."""
+
+    return {'SUCCEED': ConfigClass.SESSION_JOB_SUCCEED_TTL, 'TERMINATED': ConfigClass.SESSION_JOB_TERMINATED_TTL}
+
+
+def get_retention(status: str) -> int:
+    """Return the seconds a session job in the status is kept after its last update."""
+
+    return get_retention_tiers().get(status, ConfigClass.SESSION_JOB_TTL)
+
+
+def get_retention_grace() -> int:
+    """Return the seconds session job hashes are kept after their retention ends.
+
+    Jobs are removed from their indexes, and exported when enabled, by session_job_export_expired once their retention
+    ends. The grace period only matters when the removal falls behind, so the indexes never point to expired hashes.
+    """
+
+    return max(2 * ConfigClass.SESSION_JOB_EXPORT_INTERVAL, 3600)
+
+
+def get_index_ttl() -> int:
+    """Return the seconds session job indexes are kept after their last write, covering the longest retention."""
+
+    return max(ConfigClass.SESSION_JOB_TTL, *get_retention_tiers().values()) + get_retention_grace()
+
+
+def is_glob_pattern(value: str) -> bool:
+    return any(character in value for character in GLOB_CHARACTERS)
+
+
+def is_exact(value: str) -> bool:
+    return value != '*' and not is_glob_pattern(value)
+
+
+def split_filters(session_id: str, **filters) -> Tuple[List[str], Dict[str, str]]:
+    """Split the filters into keys of indexes to intersect for exact values and patterns to match records with.
+
+    Job ids are not indexed, so they are always matched against the records.
+    """
+
+    index_keys = [get_index_key(session_id)]
+    patterns = {}
+    for field in FILTER_FIELDS:
+        value = filters.get(field, '*')
+        if value == '*':
+            continue
+        if is_glob_pattern(value) or field not in INDEXED_FIELDS:
+            patterns[field] = value
+        else:
+            index_keys.append(get_index_key(session_id, field, value))
+
+    return index_keys, patterns
+
+
+def matches(record: Dict[str, Any], patterns: Dict[str, str]) -> bool:
+    """Check the record fields match the glob patterns."""
+
+    return all(fnmatchcase(str(record[field]), pattern) for field, pattern in patterns.items())
+
+
+def encode_record(record: Dict[str, Any]) -> Dict[str, str]:
+    """Return the hash mapping of the session job record with JSON encoded values and one field per payload key."""
+
+    mapping = {field: json.dumps(value) for field, value in record.items() if field != 'payload'}
+    for key, value in (record.get('payload') or {}).items():
+        mapping[PAYLOAD_PREFIX + key] = json.dumps(value)
+    return mapping
+
+
+def decode_record(mapping: Dict[bytes, bytes]) -> Dict[str, Any]:
+    """Return the session job record stored in the hash mapping."""
+
+    record = {}
+    payload = {}
+    for field, value in mapping.items():
+        field = field.decode('utf-8')
+        if field in INTERNAL_FIELDS:
+            continue
+        if field.startswith(PAYLOAD_PREFIX):
+            payload[field.replace(PAYLOAD_PREFIX, '', 1)] = json.loads(value)
+        else:
+            record[field] = json.loads(value)
+    record['payload'] = payload
+    return record
+
+
+def decode_records(mappings: List[Dict[bytes, bytes]]) -> List[Dict[str, Any]]:
+    """Return the session job records stored in the hash mappings, skipping empty mappings of missing jobs."""
+
+    return [decode_record(mapping) for mapping in mappings if mapping]
+
 
 class SessionJob:
     """Session Job ORM."""
@@ -37,6 +277,8 @@ class SessionJob:
         self.status = None
         self.progress = 0
         self.payload = {}
+        self.changes = {}
+        self.message = None
 
     @classmethod
     async def load(cls, session_id, code, action, operator, job_id=None, label='Container', task_id='default_task'):
@@ -59,34 +301,42 @@ class SessionJob:
             'payload': self.payload,
         }
 
-    async def set_job_id(self, job_id):
-        """Set job id."""
+    def set_job_id(self, job_id):
+        """Set job id, it is checked to be unused in the session when the job is created."""
 
         self.job_id = job_id
-        await self.check_job_id()
 
     def set_source(self, source: str):
         """Set job source."""
 
         self.source = source
+        self.changes['source'] = source
 
     def add_payload(self, key: str, value):
         """Will update if exists the same key."""
 
         self.payload[key] = value
+        self.changes[PAYLOAD_PREFIX + key] = value
 
     def set_status(self, status: str):
         """Set job status."""
 
         self.status = status
+        self.changes['status'] = status
 
     def set_progress(self, progress: int):
         """Set job progress."""
 
         self.progress = progress
+        self.changes['progress'] = progress
 
-    async def save(self):
-        """Save in redis."""
+    def set_message(self, message: Dict[str, Any]):
+        """Set the queue message published through the outbox once the job is created."""
+
+        self.message = message
+
+    def validate(self):
+        """Check the fields required to save the job are set."""
 
         if not self.job_id:
             raise Exception('[SessionJob] job_id not provided')
@@ -94,6 +344,27 @@ class SessionJob:
             raise Exception('[SessionJob] source not provided')
         if not self.status:
             raise Exception('[SessionJob] status not provided')
+
+    def get_record(self) -> Dict[str, Any]:
+        return make_record(
+            self.session_id,
+            self.label,
+            self.task_id,
+            self.job_id,
+            self.source,
+            self.action,
+            self.status,
+            self.code,
+            self.operator,
+            self.payload,
+            self.progress,
+        )
+
+    async def save(self):
+        """Save in redis."""
+
+        self.validate()
+        self.changes = {}
         return await session_job_set_status(
             self.session_id,
             self.label,
@@ -108,6 +379,30 @@ class SessionJob:
             self.progress,
         )
 
+    async def create(self):
+        """Save in redis as a new job, raise if the job id is already used in the session."""
+
+        created = await self.save_many([self])
+        if not created[0]:
+            raise Exception('[SessionJob] job id already exists: {}'.format(self.job_id))
+
+    @staticmethod
+    async def save_many(jobs: List['SessionJob']) -> List[bool]:
+        """Save new jobs in one redis transaction and return whether each job was created.
+
+        A job is not created when its job id is already used in the session. The queue messages set on the jobs are
+        added to the outbox with them.
+        """
+
+        for job in jobs:
+            job.validate()
+        created = await session_job_create_many([job.get_record() for job in jobs], [job.message for job in jobs])
+        for job, job_created in zip(jobs, created):
+            if job_created:
+                job.changes = {}
+                job.message = None
+        return created
+
     async def read(self):
         """Read from redis."""
         fetched = await session_job_get_status(
@@ -115,7 +410,32 @@ class SessionJob:
         )
         if not fetched:
             raise Exception('[SessionJob] Not found job: {}'.format(self.job_id))
-        job_read = fetched[0]
+        self.set_record(fetched[0])
+
+    async def update(self):
+        """Write only the fields changed since the job was saved or read, then refresh the job from redis."""
+
+        updated = await self.update_many([self])
+        if not updated[0]:
+            raise Exception('[SessionJob] Not found job: {}'.format(self.job_id))
+
+    @staticmethod
+    async def update_many(jobs: List['SessionJob']) -> List[bool]:
+        """Write the changed fields of the jobs in pipelined batches and return whether each job was found."""
+
+        for job in jobs:
+            if not job.job_id:
+                raise Exception('[SessionJob] job_id not provided')
+        updated = await session_job_update_many([(job.session_id, job.label, job.job_id, job.changes) for job in jobs])
+        for job, record in zip(jobs, updated):
+            if record:
+                job.set_record(record)
+        return [record is not None for record in updated]
+
+    def set_record(self, job_read: Dict[str, Any]):
+        """Set job fields from the record read from redis."""
+
+        self.label = job_read['label']
         self.source = job_read['source']
         self.status = job_read['status']
         self.progress = job_read['progress']
@@ -124,24 +444,13 @@ class SessionJob:
         self.action = job_read['action']
         self.operator = job_read['operator']
         self.code = job_read['code']
+        self.changes = {}
 
-    async def check_job_id(self):
-        """Check if job_id already been used."""
 
-        fetched = await session_job_get_status(
-            self.session_id, self.label, self.job_id, self.code, self.action, self.operator
-        )
-        if fetched:
-            raise Exception('[SessionJob] job id already exists: {}'.format(self.job_id))
-
-
-async def session_job_set_status(
+def make_record(
     session_id, label, task_id, job_id, source, action, target_status, code, operator, payload=None, progress=0
-):
-    """Set session job status."""
-    srv_redis = SrvAioRedisSingleton()
-    my_key = 'dataaction:{}:{}:{}:{}:{}:{}:{}'.format(session_id, label, job_id, action, code, operator, source)
-    record = {
+) -> Dict[str, Any]:
+    return {
         'session_id': session_id,
         'label': label,
         'task_id': task_id,
@@ -152,23 +461,459 @@ async def session_job_set_status(
         'code': code,
         'operator': operator,
         'progress': progress,
-        'payload': payload,
+        'payload': payload or {},
         'update_timestamp': str(round(time.time())),
     }
-    my_value = json.dumps(record)
-    await srv_redis.set_by_key(my_key, my_value)
+
+
+def get_job_entry(
+    record: Dict[str, Any], message: Optional[Dict[str, Any]] = None
+) -> Tuple[str, Dict[str, str], Dict[str, float], int]:
+    """Return the key, hash mapping, index scores and TTL to store the session job record with.
+
+    The retention end of the job is tracked in the retention index and the hash is kept for the retention grace period
+    longer. The queue message of the job is stored in the job hash and the job is added to the outbox, so both are
+    written in the same transaction.
+    """
+
+    index_keys = get_record_index_keys(record)
+    mapping = encode_record(record)
+    mapping[INDEXES_FIELD] = '\n'.join(index_keys)
+    score = float(record['update_timestamp'])
+    indexes = {index_key: score for index_key in index_keys}
+    retention = get_retention(record['status'])
+    indexes[RETENTION_KEY] = score + retention
+    ttl = retention + get_retention_grace()
+    if message is not None:
+        mapping[OUTBOX_MESSAGE_FIELD] = json.dumps(message)
+        indexes[OUTBOX_KEY] = score
+    return get_job_key(record['session_id'], record['job_id']), mapping, indexes, ttl
+
+
+async def session_job_set_status(
+    session_id, label, task_id, job_id, source, action, target_status, code, operator, payload=None, progress=0
+):
+    """Set session job status.
+
+    An existing job is replaced and removed from the indexes of its former values, its queue message is kept.
+    """
+    srv_redis = SrvAioRedisSingleton()
+    record = make_record(
+        session_id, label, task_id, job_id, source, action, target_status, code, operator, payload, progress
+    )
+    await srv_redis.hset_by_key_with_indexes(
+        *get_job_entry(record),
+        get_index_ttl(),
+        indexes_field=INDEXES_FIELD,
+        kept_fields=(OUTBOX_MESSAGE_FIELD, OUTBOX_ATTEMPTS_FIELD),
+    )
+    await publish_changes('update', [record])
     return record
 
 
-async def session_job_get_status(session_id, label='Container', job_id='*', code='*', action='*', operator='*'):
+async def session_job_create_many(
+    records: List[Dict[str, Any]], messages: Optional[List[Optional[Dict[str, Any]]]] = None
+) -> List[bool]:
+    """Create session jobs in MULTI pipelines of at most mget_batch_size jobs and return whether each job was created.
+
+    The job id uniqueness is checked atomically with the creation, so a job id already used in the session is skipped.
+    The queue message given for a job is added to the outbox with it, see session_job_claim_messages.
+    """
+
+    srv_redis = SrvAioRedisSingleton()
+    messages = messages or [None] * len(records)
+    created = []
+    for start in range(0, len(records), srv_redis.mget_batch_size):
+        end = start + srv_redis.mget_batch_size
+        entries = [get_job_entry(record, message) for record, message in zip(records[start:end], messages[start:end])]
+        created.extend(await srv_redis.hset_many_with_indexes(entries, get_index_ttl(), nx=True))
+    await publish_changes('update', [record for record, job_created in zip(records, created) if job_created])
+    return created
+
+
+async def session_job_migrate_string_keys() -> int:
+    """Move session jobs stored as JSON strings under the former "dataaction:" keys into hashes.
+
+    Jobs already stored in a hash are kept. The string keys are removed from the session job indexes and deleted, so
+    the index reads don't meet them any more. Return the number of migrated jobs.
+    """
+
+    srv_redis = SrvAioRedisSingleton()
+    migrated = 0
+    async for keys in srv_redis.iter_key_batches(LEGACY_KEY_PATTERN):
+        records = [json.loads(value) for value in await srv_redis.mget_by_keys(keys) if value is not None]
+        indexes = set()
+        for record in records:
+            record['payload'] = record.get('payload') or {}
+            session_id = record['session_id']
+            indexes.add(get_index_key(session_id))
+            indexes.update(get_index_key(session_id, field, record[field]) for field in FILTER_FIELDS)
+        if records:
+            entries = [get_job_entry(record) for record in records]
+            migrated += sum(await srv_redis.hset_many_with_indexes(entries, get_index_ttl(), nx=True))
+        await srv_redis.delete_with_indexes(keys, indexes)
+    return migrated
+
+
+async def session_job_update_status(session_id, label, job_id, changes: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Write only the changed fields of the session job and return the updated job, or None if it does not exist.
+
+    Payload keys are changed through fields prefixed with "payload.", so the payload can grow incrementally.
+    """
+
+    updated = await session_job_update_many([(session_id, label, job_id, changes)])
+    return updated[0]
+
+
+async def session_job_update_many(
+    updates: List[Tuple[str, str, str, Dict[str, Any]]]
+) -> List[Optional[Dict[str, Any]]]:
+    """Apply (session_id, label, job_id, changes) updates like session_job_update_status in pipelined batches."""
+
+    srv_redis = SrvAioRedisSingleton()
+    update_timestamp = str(round(time.time()))
+    tiers = get_retention_tiers()
+    retention_args = [get_index_ttl(), get_retention_grace(), ConfigClass.SESSION_JOB_TTL, len(tiers)]
+    for status, retention in tiers.items():
+        retention_args.extend([json.dumps(status), retention])
+    calls = []
+    for session_id, label, job_id, changes in updates:
+        args = [label if label == '*' else json.dumps(label), update_timestamp]
+        args.append(get_index_key(session_id, 'status', ''))
+        args.append(get_index_key(session_id, 'status', changes['status']) if 'status' in changes else '')
+        args.extend(retention_args)
+        for field, value in dict(changes, update_timestamp=update_timestamp).items():
+            args.extend([field, json.dumps(value)])
+        calls.append(([get_job_key(session_id, job_id), RETENTION_KEY], args))
+
+    updated = []
+    for fields in await srv_redis.run_script_many(UPDATE_JOB, calls):
+        updated.append(decode_record(dict(zip(fields[::2], fields[1::2]))) if fields else None)
+    await publish_changes('update', [record for record in updated if record])
+    return updated
+
+
+async def iter_job_mapping(session_id: str, job_id: str) -> AsyncIterator[Dict[bytes, bytes]]:
+    """Yield the hash of the session job if it exists."""
+
+    srv_redis = SrvAioRedisSingleton()
+    mappings = await srv_redis.hgetall_many([get_job_key(session_id, job_id)])
+    if mappings[0]:
+        yield mappings[0]
+
+
+async def session_job_iter_status(
+    session_id,
+    label='Container',
+    job_id='*',
+    code='*',
+    action='*',
+    operator='*',
+    status='*',
+    updated_after: Optional[int] = None,
+    updated_before: Optional[int] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Yield session jobs matching the filters and updated within the inclusive time range, newest first.
+
+    An exact job id is read from its job key. Otherwise exact filters are answered by intersecting the session job
+    indexes, glob patterns are matched against the records read from the remaining indexes. A glob session id falls
+    back to scanning the job keys.
+    """
+
+    srv_redis = SrvAioRedisSingleton()
+    filters = {'label': label, 'job_id': job_id, 'code': code, 'action': action, 'operator': operator, 'status': status}
+    min_score = '-inf' if updated_after is None else updated_after
+    max_score = '+inf' if updated_before is None else updated_before
+    index_keys, patterns = split_filters(session_id, **filters)
+    if is_glob_pattern(session_id):
+        patterns = filters
+        mappings = srv_redis.iter_hgetall(get_job_key(session_id, job_id))
+    elif is_exact(job_id):
+        patterns = filters
+        mappings = iter_job_mapping(session_id, job_id)
+    else:
+        mappings = srv_redis.iter_hgetall_by_indexes(index_keys, min_score, max_score)
+
+    async for mapping in mappings:
+        record = decode_record(mapping)
+        if matches(record, patterns) and float(min_score) <= int(record['update_timestamp']) <= float(max_score):
+            yield record
+
+
+async def session_job_get_status(
+    session_id,
+    label='Container',
+    job_id='*',
+    code='*',
+    action='*',
+    operator='*',
+    status='*',
+    updated_after: Optional[int] = None,
+    updated_before: Optional[int] = None,
+):
+    jobs = session_job_iter_status(
+        session_id, label, job_id, code, action, operator, status, updated_after, updated_before
+    )
+    return [job async for job in jobs]
+
+
+class SessionJobPage(NamedTuple):
+    jobs: List[Dict[str, Any]]
+    total: int
+    page: int
+    next_cursor: Optional[str]
+
+
+async def session_job_get_page(
+    session_id,
+    label='Container',
+    job_id='*',
+    code='*',
+    action='*',
+    operator='*',
+    status='*',
+    updated_after: Optional[int] = None,
+    updated_before: Optional[int] = None,
+    cursor: Optional[str] = None,
+    page_size: int = 25,
+) -> SessionJobPage:
+    """Return one page of session jobs matching the exact filters and updated within the time range, newest first.
+
+    The cursor "<update_timestamp>:<offset>" points after the last job of the previous page, the offset counting the
+    jobs of that timestamp already returned. Jobs updated in the meantime move to the top of the session and are not
+    returned again by the following pages. An exact job id returns the only page with the job if it matches. Raise
+    ValueError for glob filters or an invalid cursor.
+    """
+
+    filters = {'label': label, 'job_id': job_id, 'code': code, 'action': action, 'operator': operator, 'status': status}
+    index_keys, patterns = split_filters(session_id, **filters)
+    if is_glob_pattern(session_id) or any(is_glob_pattern(value) for value in patterns.values()):
+        raise ValueError('Pagination supports exact filters only')
+    if is_exact(job_id):
+        jobs = [
+            job
+            async for job in session_job_iter_status(
+                session_id, **filters, updated_after=updated_after, updated_before=updated_before
+            )
+        ]
+        return SessionJobPage(jobs=jobs, total=len(jobs), page=0, next_cursor=None)
+
+    min_score = '-inf' if updated_after is None else updated_after
+    max_score = '+inf' if updated_before is None else updated_before
+    page_max_score = max_score
+    offset = 0
+    if cursor:
+        try:
+            page_max_score, offset = (int(part) for part in cursor.split(':'))
+        except ValueError:
+            raise ValueError('Invalid cursor: {}'.format(cursor))
+        if updated_before is not None and page_max_score > updated_before:
+            page_max_score, offset = updated_before, 0
+
     srv_redis = SrvAioRedisSingleton()
-    my_key = 'dataaction:{}:{}:{}:{}:{}:{}'.format(session_id, label, job_id, action, code, operator)
-    res_binary = await srv_redis.mget_by_prefix(my_key)
-    return [json.loads(record.decode('utf-8')) for record in res_binary] if res_binary else []
+    total, newer, keys = await srv_redis.get_page_by_indexes(
+        index_keys, min_score, max_score, page_max_score, offset, page_size
+    )
+
+    next_cursor = None
+    if keys and newer + offset + len(keys) < total:
+        last_score = keys[-1][1]
+        same_score = sum(1 for _, score in keys if score == last_score)
+        if last_score == page_max_score:
+            same_score += offset
+        next_cursor = '{}:{}'.format(int(last_score), same_score)
+
+    mappings = await srv_redis.hgetall_many([key for key, _ in keys])
+    jobs = [decode_record(mapping) for mapping in mappings if mapping]
+    return SessionJobPage(jobs=jobs, total=total, page=(newer + offset) // page_size, next_cursor=next_cursor)
 
 
 async def session_job_delete_status(session_id, label='Container', job_id='*', code='*', action='*', operator='*'):
+    """Delete session jobs matching the filters batch by batch and return the number of deleted jobs."""
+
+    filters = {'label': label, 'job_id': job_id, 'code': code, 'action': action, 'operator': operator}
+    deleted = await session_job_delete_many([dict(filters, session_id=session_id)])
+    return deleted[0]
+
+
+async def session_job_delete_many(filters: List[Dict[str, str]]) -> List[int]:
+    """Delete session jobs matching each of the filters and return the number of jobs deleted for each of them.
+
+    Filters with an exact session id and job id read the job hashes directly in pipelined batches, other filters are
+    answered like session_job_iter_status. A job matching several filters is counted for the first of them only.
+    """
+
+    srv_redis = SrvAioRedisSingleton()
+    exact = [
+        position
+        for position, item in enumerate(filters)
+        if not is_glob_pattern(item['session_id']) and not is_glob_pattern(item['job_id'])
+    ]
+    mappings = await srv_redis.hgetall_many(
+        [get_job_key(filters[position]['session_id'], filters[position]['job_id']) for position in exact]
+    )
+    exact_mappings = dict(zip(exact, mappings))
+
+    records = {}
+    counts = []
+    for position, item in enumerate(filters):
+        if position in exact_mappings:
+            matched = []
+            if exact_mappings[position]:
+                record = decode_record(exact_mappings[position])
+                if matches(record, {field: item.get(field, '*') for field in FILTER_FIELDS}):
+                    matched.append(record)
+        else:
+            matched = [record async for record in session_job_iter_status(**item)]
+        new_records = {get_job_key(record['session_id'], record['job_id']): record for record in matched}
+        new_records = {key: record for key, record in new_records.items() if key not in records}
+        records.update(new_records)
+        counts.append(len(new_records))
+
+    keys = list(records)
+    for start in range(0, len(keys), srv_redis.mget_batch_size):
+        end = start + srv_redis.mget_batch_size
+        batch = keys[start:end]
+        index_keys = {index_key for key in batch for index_key in get_record_index_keys(records[key])}
+        index_keys.update([RETENTION_KEY, OUTBOX_KEY])
+        await srv_redis.delete_with_indexes(batch, index_keys)
+    await publish_changes('delete', list(records.values()))
+    return counts
+
+
+async def session_job_export_expired(
+    export: Optional[Callable[[List[Dict[str, Any]]], Awaitable[None]]], count: int
+) -> int:
+    """Pass at most count session jobs whose retention ended to export, then remove them from redis and their indexes.
+
+    Without export the jobs are only removed. Jobs are only removed once export returns, so a failed export is retried
+    later. Return the number of expired jobs handled, including the ones which expired from redis before they could be
+    exported.
+    """
+
+    srv_redis = SrvAioRedisSingleton()
+    now = time.time()
+    keys = await srv_redis.get_keys_by_score(RETENTION_KEY, now, count)
+    if not keys:
+        return 0
+    if export is not None:
+        records = await get_executor_manager.run_sync(decode_records, await srv_redis.hgetall_many(keys))
+        if records:
+            await export(records)
+    await srv_redis.run_script_many(REMOVE_EXPIRED_JOBS, [([RETENTION_KEY, *keys], [now])])
+    return len(keys)
+
+
+class OutboxMessage(NamedTuple):
+    key: bytes
+    session_id: str
+    job_id: str
+    message: Dict[str, Any]
+    attempts: int
+
+
+async def session_job_claim_messages(count: int, lease: float) -> List[OutboxMessage]:
+    """Claim at most count queue messages due in the outbox for lease seconds.
+
+    A claimed message is claimed again once the lease ends, unless it is acknowledged or retried before.
+    """
+
+    srv_redis = SrvAioRedisSingleton()
+    now = time.time()
+    args = [now, count, now + lease, OUTBOX_MESSAGE_FIELD, OUTBOX_ATTEMPTS_FIELD]
+    claimed = (await srv_redis.run_script_many(CLAIM_OUTBOX, [([OUTBOX_KEY], args)]))[0]
+    messages = []
+    for start in range(0, len(claimed), 5):
+        end = start + 5
+        key, session_id, job_id, message, attempts = claimed[start:end]
+        messages.append(
+            OutboxMessage(key, json.loads(session_id), json.loads(job_id), json.loads(message), int(attempts))
+        )
+    return messages
+
+
+async def session_job_ack_messages(keys: List[bytes]) -> None:
+    """Remove the messages of the jobs from the outbox once they are sent or given up."""
+
+    if not keys:
+        return
+    srv_redis = SrvAioRedisSingleton()
+    await srv_redis.hdel_with_indexes(keys, [OUTBOX_MESSAGE_FIELD, OUTBOX_ATTEMPTS_FIELD], [OUTBOX_KEY])
+
+
+async def session_job_retry_messages(retry_at: Dict[bytes, float]) -> None:
+    """Reschedule the messages of the jobs to be claimed again at the given times."""
+
+    if not retry_at:
+        return
     srv_redis = SrvAioRedisSingleton()
-    my_key = 'dataaction:{}:{}:{}:{}:{}:{}'.format(session_id, label, job_id, action, code, operator)
-    res_binary_list = await srv_redis.mdele_by_prefix(my_key)
-    return res_binary_list
+    await srv_redis.update_scores(OUTBOX_KEY, retry_at)
+
+
+async def publish_changes(change: str, records: List[Dict[str, Any]]):
+    """Publish the change of the session jobs to the channels of their sessions in one pipeline."""
+
+    if not records:
+        return
+    srv_redis = SrvAioRedisSingleton()
+    await srv_redis.publish_many(
+        [
+            (get_changes_channel(record['session_id']), json.dumps({'change': change, 'job': record}))
+            for record in records
+        ]
+    )
+
+
+async def session_job_iter_changes(
+    session_id,
+    label='Container',
+    job_id='*',
+    code='*',
+    action='*',
+    operator='*',
+    coalesce_interval: float = 0.5,
+    heartbeat_interval: float = 15,
+) -> AsyncIterator[Tuple[str, List[Dict[str, Any]]]]:
+    """Yield a snapshot of the session jobs matching the filters, then the changes of these jobs as they happen.
+
+    Changes are read from the session channel by a background task and merged per job until the consumer asks for
+    them, so rapid progress updates are sent as the latest state of the job and a slow consumer does not hold up the
+    channel. Events are yielded as (name, data) pairs, a heartbeat is yielded when nothing changed for a while.
+    """
+
+    srv_redis = SrvAioRedisSingleton()
+    patterns = {'label': label, 'job_id': job_id, 'code': code, 'action': action, 'operator': operator}
+    pending = {}
+    changed = asyncio.Event()
+
+    async def read_changes(pubsub):
+        async for message in pubsub.listen():
+            if message['type'] != 'message':
+                continue
+            change = json.loads(message['data'])
+            job = change['job']
+            if matches(job, patterns):
+                pending[get_job_key(job['session_id'], job['job_id'])] = change
+                changed.set()
+
+    pubsub = await srv_redis.subscriber(get_changes_channel(session_id))
+    reader = asyncio.create_task(read_changes(pubsub))
+    try:
+        yield 'snapshot', await session_job_get_status(session_id, label, job_id, code, action, operator)
+        while True:
+            try:
+                await asyncio.wait_for(changed.wait(), heartbeat_interval)
+            except asyncio.TimeoutError:
+                if reader.done():
+                    reader.result()
+                yield 'heartbeat', []
+                continue
+            await asyncio.sleep(coalesce_interval)
+            changed.clear()
+            changes = list(pending.values())
+            pending.clear()
+            yield 'changes', changes
+    finally:
+        reader.cancel()
+        await asyncio.gather(reader, return_exceptions=True)
+        await pubsub.close()
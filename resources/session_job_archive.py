@@ -0,0 +1,116 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see http://www.gnu.org/licenses/.
+
+import asyncio
+from functools import partial
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from uuid import uuid4
+
+from common import LoggerFactory
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import ConfigClass
+from models.api_archive_sql import SessionJobArchiveModel
+from resources.db import get_db_engine
+from resources.redis import SrvAioRedisSingleton
+from resources.redis_project_session_job import session_job_export_expired
+
+ARCHIVE_LOCK_KEY = 'dataaction-retention-lock'
+
+logger = LoggerFactory('session_job_archive').get_logger()
+
+
+async def archive_session_jobs(db: AsyncSession, records: List[Dict[str, Any]]) -> None:
+    """Insert the session job records into the archive table."""
+
+    db.add_all([SessionJobArchiveModel(record) for record in records])
+    await db.commit()
+
+
+async def remove_expired_session_jobs(export: Optional[Callable[[List[Dict[str, Any]]], Awaitable[None]]]) -> int:
+    """Remove all session jobs whose retention ended from redis in batches, passing each batch to export if given.
+
+    Return the number of expired jobs handled.
+    """
+
+    batch_size = ConfigClass.SESSION_JOB_EXPORT_BATCH_SIZE
+    removed = 0
+    while True:
+        handled = await session_job_export_expired(export, batch_size)
+        removed += handled
+        if handled < batch_size:
+            return removed
+
+
+async def archive_expired_session_jobs(engine: AsyncEngine) -> int:
+    """Move all session jobs whose retention ended from redis into the archive table in batches.
+
+    Return the number of expired jobs handled.
+    """
+
+    async with AsyncSession(bind=engine, expire_on_commit=False) as db:
+        return await remove_expired_session_jobs(partial(archive_session_jobs, db))
+
+
+async def renew_archive_lock(token: str, interval: int) -> None:
+    """Keep the archive lock held with the token from expiring until cancelled or the lock is lost."""
+
+    srv_redis = SrvAioRedisSingleton()
+    while True:
+        await asyncio.sleep(interval / 3)
+        try:
+            renewed = await srv_redis.expire_if_value(ARCHIVE_LOCK_KEY, token, interval)
+        except Exception:
+            logger.exception('Failed to renew session job archive lock')
+            continue
+        if not renewed:
+            logger.warning('Lost session job archive lock before the run finished')
+            return
+
+
+async def handle_expired_session_jobs(export_enabled: bool) -> None:
+    """Remove expired session jobs, archiving them with the export enabled."""
+
+    if export_enabled:
+        archived = await archive_expired_session_jobs(await get_db_engine())
+        if archived:
+            logger.info(f'Archived {archived} expired session jobs')
+    else:
+        await remove_expired_session_jobs(None)
+
+
+async def run_session_job_archiver(interval: int, export_enabled: bool) -> None:
+    """Remove expired session jobs every interval seconds until cancelled, archiving them with the export enabled.
+
+    Only one service instance handles each interval, the others skip it while the lock key exists. The lock is renewed
+    while a run takes longer than the interval, so no other instance exports the same jobs at the same time.
+    """
+
+    srv_redis = SrvAioRedisSingleton()
+    while True:
+        try:
+            token = uuid4().hex
+            if await srv_redis.set_by_key_nx(ARCHIVE_LOCK_KEY, token, interval):
+                renewal = asyncio.create_task(renew_archive_lock(token, interval))
+                try:
+                    await handle_expired_session_jobs(export_enabled)
+                finally:
+                    renewal.cancel()
+        except Exception:
+            logger.exception('Failed to archive expired session jobs')
+        await asyncio.sleep(interval)
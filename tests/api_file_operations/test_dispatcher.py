@@ -10,6 +10,7 @@
 # You should have received a copy of the GNU Affero General Public License along with this program. If not, see
 # http://www.gnu.org/licenses/.
 
+import asyncio
 import random
 import time
 import uuid
@@ -18,9 +19,13 @@ from typing import Callable
 
 import pytest
 
+from api.api_file_operations.dispatcher import BaseDispatcher
 from api.api_file_operations.dispatcher import Item
 from api.api_file_operations.dispatcher import ItemList
 from api.api_file_operations.dispatcher import ResourceType
+from config import ConfigClass
+from models.file_ops_models import FileOperationTarget
+from resources import metadata_client
 
 
 def get_timestamp() -> int:
@@ -106,3 +111,56 @@ class TestItemList:
         sources = ItemList([create_item(resource_type=ResourceType.FOLDER), expected_item])
 
         assert sources.filter_files() == [expected_item]
+
+
+class TestBaseDispatcher:
+    async def test_validate_targets_fetches_targets_concurrently_within_limit(self, create_item, monkeypatch):
+        items = {str(i): create_item(id_=str(i), resource_type=ResourceType.FILE, archived=False) for i in range(10)}
+        running = []
+        max_running = []
+
+        async def fetch_resource_by_id(item_id):
+            running.append(item_id)
+            max_running.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(item_id)
+            return items[item_id]
+
+        monkeypatch.setattr(metadata_client, 'fetch_resource_by_id', fetch_resource_by_id)
+        monkeypatch.setattr(ConfigClass, 'METADATA_BATCH_ENABLED', False)
+        monkeypatch.setattr(ConfigClass, 'METADATA_CONCURRENCY', 3)
+
+        targets = await BaseDispatcher().validate_targets([FileOperationTarget(id=item_id) for item_id in items])
+
+        assert targets == list(items.values())
+        assert max(max_running) == 3
+
+    async def test_validate_targets_cancels_remaining_lookups_on_first_missing_target(self, create_item, monkeypatch):
+        fetched = []
+
+        async def fetch_resource_by_id(item_id):
+            if item_id == 'invalid':
+                return None
+            await asyncio.sleep(1)
+            fetched.append(item_id)
+            return create_item(id_=item_id, resource_type=ResourceType.FILE, archived=False)
+
+        monkeypatch.setattr(metadata_client, 'fetch_resource_by_id', fetch_resource_by_id)
+        monkeypatch.setattr(ConfigClass, 'METADATA_BATCH_ENABLED', False)
+        targets = [FileOperationTarget(id=item_id) for item_id in ['1', 'invalid', '2']]
+
+        with pytest.raises(Exception, match='Not found resource: invalid'):
+            await BaseDispatcher().validate_targets(targets)
+
+        assert fetched == []
+
+    async def test_validate_targets_raises_for_invalid_target_type(self, create_item, monkeypatch):
+        async def get_by_ids(self, item_ids):
+            return [
+                create_item(id_=item_id, resource_type=ResourceType.CONTAINER, archived=False) for item_id in item_ids
+            ]
+
+        monkeypatch.setattr(metadata_client.MetadataClient, 'get_by_ids', get_by_ids)
+
+        with pytest.raises(ValueError, match='Invalid target type'):
+            await BaseDispatcher().validate_targets([FileOperationTarget(id='1')])
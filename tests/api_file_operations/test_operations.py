@@ -14,6 +14,8 @@ import json
 
 import pytest
 
+from config import ConfigClass
+
 pytestmark = pytest.mark.asyncio
 
 
@@ -21,53 +23,45 @@ pytestmark = pytest.mark.asyncio
 async def create_fake_job_response(monkeypatch):
     from resources.redis import SrvAioRedisSingleton
 
-    async def fake_return(x, y):
-        return b''
+    async def fake_return(x, indexes, min_score, max_score):
+        for record in []:
+            yield record
 
-    monkeypatch.setattr(SrvAioRedisSingleton, 'mget_by_prefix', fake_return)
+    monkeypatch.setattr(SrvAioRedisSingleton, 'iter_hgetall_by_indexes', fake_return)
 
 
 @pytest.fixture
 async def fake_job_save_status(monkeypatch):
     from resources.redis import SrvAioRedisSingleton
 
-    record = {
-        'session_id': 'admin-e17e19b3-b6a5-4198-9458-1c1a67a98a33',
-        'job_id': '0cf78578-1bbf-4cd8-b256-3adcdaafd761-1649278991',
-        'source_id': '776dc0a8b',
-        'include_ids': ['112233'],
-        'project': 'testproject',
-        'request_id': '',
-        'generic': True,
-        'operator': 'admin',
-        'destination_id': '886dc0a8b',
-        'auth_token': {'at': None, 'rt': None},
-        'create_timestamp': '1649278991.118386',
-    }
+    written = []
 
-    async def fake_return(x, y, z):
-        return [bytes(json.dumps(record), 'utf-8')]
+    async def fake_return(x, entries, index_ttl, nx):
+        written.extend(entries)
+        return [True for _ in entries]
 
-    monkeypatch.setattr(SrvAioRedisSingleton, 'set_by_key', fake_return)
+    async def fake_publish(x, messages):
+        return [0 for _ in messages]
+
+    monkeypatch.setattr(SrvAioRedisSingleton, 'hset_many_with_indexes', fake_return)
+    monkeypatch.setattr(SrvAioRedisSingleton, 'publish_many', fake_publish)
+    return written
 
 
 async def test_v1_create_copy_file_operation_job_return_202(
     test_client, httpx_mock, create_fake_job_response, fake_job_save_status
 ):
-    # validate source
-    httpx_mock.add_response(
-        method='GET',
-        url='http://metadata_service/v1/item/776dc0a8b/',
-        status_code=200,
-        json={'result': {'name': 'amammoliti', 'type': 'name_folder', 'archived': 'false'}},
-    )
-
-    # validate destination
+    # validate source and destination
     httpx_mock.add_response(
         method='GET',
-        url='http://metadata_service/v1/item/886dc0a8b/',
+        url='http://metadata_service/v1/items/batch/?ids=776dc0a8b&ids=886dc0a8b',
         status_code=200,
-        json={'result': {'name': 'amammoliti', 'type': 'name_folder', 'archived': 'false'}},
+        json={
+            'result': [
+                {'id': '776dc0a8b', 'name': 'amammoliti', 'type': 'name_folder', 'archived': 'false'},
+                {'id': '886dc0a8b', 'name': 'amammoliti', 'type': 'name_folder', 'archived': 'false'},
+            ]
+        },
     )
 
     # validate target
@@ -78,14 +72,6 @@ async def test_v1_create_copy_file_operation_job_return_202(
         json={'result': {'id': '112233', 'name': 'file.py', 'type': 'file', 'archived': 'false'}},
     )
 
-    # send message to queue
-    httpx_mock.add_response(
-        method='POST',
-        url='http://queue_service/v1/send_message',
-        status_code=200,
-        json={},
-    )
-
     payload = {
         'session_id': 'admin-e17e19b3-b6a5-4198-9458-1c1a67a98a33',
         'task_id': 'default_task_id',
@@ -104,12 +90,16 @@ async def test_v1_create_copy_file_operation_job_return_202(
 
 
 async def test_v1_create_copy_file_operation_job_with_invalid_source_return_500(test_client, httpx_mock):
-    # validate source
+    # validate source and destination
     httpx_mock.add_response(
         method='GET',
-        url='http://metadata_service/v1/item/invalid/',
+        url='http://metadata_service/v1/items/batch/?ids=invalid&ids=886dc0a8b',
         status_code=200,
-        json={'result': {}},
+        json={
+            'result': [
+                {'id': '886dc0a8b', 'name': 'amammoliti', 'type': 'name_folder', 'archived': 'false'},
+            ]
+        },
     )
 
     payload = {
@@ -127,20 +117,16 @@ async def test_v1_create_copy_file_operation_job_with_invalid_source_return_500(
 
 
 async def test_v1_create_copy_file_operation_job_with_invalid_destination_return_500(test_client, httpx_mock):
-    # validate source
-    httpx_mock.add_response(
-        method='GET',
-        url='http://metadata_service/v1/item/776dc0a8b/',
-        status_code=200,
-        json={'result': {'name': 'amammoliti', 'type': 'name_folder', 'archived': 'false'}},
-    )
-
-    # validate destination
+    # validate source and destination
     httpx_mock.add_response(
         method='GET',
-        url='http://metadata_service/v1/item/invalid/',
+        url='http://metadata_service/v1/items/batch/?ids=776dc0a8b&ids=invalid',
         status_code=200,
-        json={'result': {}},
+        json={
+            'result': [
+                {'id': '776dc0a8b', 'name': 'amammoliti', 'type': 'name_folder', 'archived': 'false'},
+            ]
+        },
     )
 
     payload = {
@@ -158,20 +144,17 @@ async def test_v1_create_copy_file_operation_job_with_invalid_destination_return
 
 
 async def test_v1_create_copy_file_operation_job_with_invalid_target_resource_return_500(test_client, httpx_mock):
-    # validate source
-    httpx_mock.add_response(
-        method='GET',
-        url='http://metadata_service/v1/item/776dc0a8b/',
-        status_code=200,
-        json={'result': {'name': 'amammoliti', 'type': 'name_folder', 'archived': 'false'}},
-    )
-
-    # validate destination
+    # validate source and destination
     httpx_mock.add_response(
         method='GET',
-        url='http://metadata_service/v1/item/886dc0a8b/',
+        url='http://metadata_service/v1/items/batch/?ids=776dc0a8b&ids=886dc0a8b',
         status_code=200,
-        json={'result': {'name': 'amammoliti', 'type': 'name_folder', 'archived': 'false'}},
+        json={
+            'result': [
+                {'id': '776dc0a8b', 'name': 'amammoliti', 'type': 'name_folder', 'archived': 'false'},
+                {'id': '886dc0a8b', 'name': 'amammoliti', 'type': 'name_folder', 'archived': 'false'},
+            ]
+        },
     )
 
     # validate target
@@ -197,20 +180,17 @@ async def test_v1_create_copy_file_operation_job_with_invalid_target_resource_re
 
 
 async def test_v1_create_copy_file_operation_job_with_target_resource_is_archived_return_400(test_client, httpx_mock):
-    # validate source
-    httpx_mock.add_response(
-        method='GET',
-        url='http://metadata_service/v1/item/776dc0a8b/',
-        status_code=200,
-        json={'result': {'name': 'amammoliti', 'type': 'name_folder', 'archived': 'false'}},
-    )
-
-    # validate destination
+    # validate source and destination
     httpx_mock.add_response(
         method='GET',
-        url='http://metadata_service/v1/item/886dc0a8b/',
+        url='http://metadata_service/v1/items/batch/?ids=776dc0a8b&ids=886dc0a8b',
         status_code=200,
-        json={'result': {'name': 'amammoliti', 'type': 'name_folder', 'archived': 'false'}},
+        json={
+            'result': [
+                {'id': '776dc0a8b', 'name': 'amammoliti', 'type': 'name_folder', 'archived': 'false'},
+                {'id': '886dc0a8b', 'name': 'amammoliti', 'type': 'name_folder', 'archived': 'false'},
+            ]
+        },
     )
 
     # validate target
@@ -238,20 +218,17 @@ async def test_v1_create_copy_file_operation_job_with_target_resource_is_archive
 async def test_v1_create_copy_file_operation_job_with_target_resource_invalid_resource_return_400(
     test_client, httpx_mock
 ):
-    # validate source
-    httpx_mock.add_response(
-        method='GET',
-        url='http://metadata_service/v1/item/776dc0a8b/',
-        status_code=200,
-        json={'result': {'name': 'amammoliti', 'type': 'name_folder', 'archived': False}},
-    )
-
-    # validate destination
+    # validate source and destination
     httpx_mock.add_response(
         method='GET',
-        url='http://metadata_service/v1/item/886dc0a8b/',
+        url='http://metadata_service/v1/items/batch/?ids=776dc0a8b&ids=886dc0a8b',
         status_code=200,
-        json={'result': {'name': 'amammoliti', 'type': 'name_folder', 'archived': False}},
+        json={
+            'result': [
+                {'id': '776dc0a8b', 'name': 'amammoliti', 'type': 'name_folder', 'archived': False},
+                {'id': '886dc0a8b', 'name': 'amammoliti', 'type': 'name_folder', 'archived': False},
+            ]
+        },
     )
 
     # validate target
@@ -296,14 +273,6 @@ async def test_v1_create_delete_file_operation_job_return_202(
         json={'result': {'id': '112233', 'name': 'file.py', 'type': 'file', 'archived': 'false', 'zone': 0}},
     )
 
-    # send message to queue
-    httpx_mock.add_response(
-        method='POST',
-        url='http://queue_service/v1/send_message',
-        status_code=200,
-        json={},
-    )
-
     payload = {
         'session_id': 'admin-e17e19b3-b6a5-4198-9458-1c1a67a98a33',
         'task_id': 'default_task_id',
@@ -374,3 +343,95 @@ async def test_v1_create_delete_file_operation_job_with_invalid_source_return_40
     res = response.json()['error_msg']
     assert response.status_code == 500
     assert 'Not found resource: 121212' in res
+
+
+async def test_v1_create_delete_file_operation_splits_targets_into_jobs_return_202(
+    test_client, httpx_mock, create_fake_job_response, fake_job_save_status, monkeypatch
+):
+    monkeypatch.setattr(ConfigClass, 'FILE_OPERATION_MAX_TARGETS_PER_JOB', 2)
+    httpx_mock.add_response(
+        method='GET',
+        url='http://metadata_service/v1/item/776dc0a8b/',
+        status_code=200,
+        json={'result': {'name': 'amammoliti', 'type': 'name_folder', 'archived': 'false', 'zone': 0}},
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url='http://metadata_service/v1/items/batch/?ids=1&ids=2&ids=3',
+        status_code=200,
+        json={
+            'result': [
+                {'id': item_id, 'name': f'file{item_id}.py', 'type': 'file', 'archived': False, 'zone': 0}
+                for item_id in ['1', '2', '3']
+            ]
+        },
+    )
+
+    payload = {
+        'session_id': 'admin-e17e19b3-b6a5-4198-9458-1c1a67a98a33',
+        'payload': {'targets': [{'id': '1'}, {'id': '2'}, {'id': '3'}], 'source': '776dc0a8b'},
+        'operator': 'admin',
+        'operation': 'delete',
+        'project_code': 'testproject',
+    }
+    response = await test_client.post('/v1/files/actions/', json=payload)
+
+    assert response.status_code == 202
+    assert [sorted(job['payload']['targets']) for job in response.json()['result']] == [['1', '2'], ['3']]
+    messages = [json.loads(mapping['outbox.message']) for _, mapping, _, _ in fake_job_save_status]
+    assert [sorted(message['payload']['include_geids']) for message in messages] == [['1', '2'], ['3']]
+    assert all('dataaction-outbox' in indexes for _, _, indexes, _ in fake_job_save_status)
+    assert not httpx_mock.get_requests(method='POST')
+
+
+async def test_v1_create_batch_file_operations_return_result_of_each_operation(
+    test_client, httpx_mock, create_fake_job_response, fake_job_save_status
+):
+    httpx_mock.add_response(
+        method='GET',
+        url='http://metadata_service/v1/item/776dc0a8b/',
+        status_code=200,
+        json={'result': {'name': 'amammoliti', 'type': 'name_folder', 'archived': 'false', 'zone': 0}},
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url='http://metadata_service/v1/item/112233/',
+        status_code=200,
+        json={'result': {'id': '112233', 'name': 'file.py', 'type': 'file', 'archived': 'false', 'zone': 0}},
+    )
+    httpx_mock.add_response(
+        method='GET',
+        url='http://metadata_service/v1/item/invalid/',
+        status_code=200,
+        json={'result': {}},
+    )
+    item = {
+        'session_id': 'admin-e17e19b3-b6a5-4198-9458-1c1a67a98a33',
+        'payload': {'targets': [{'id': '112233'}], 'source': '776dc0a8b'},
+        'operator': 'admin',
+        'operation': 'delete',
+        'project_code': 'testproject',
+    }
+    payload = {
+        'items': [
+            item,
+            dict(item, operation='move'),
+            dict(item, payload={'targets': [{'id': '112233'}], 'source': 'invalid'}),
+        ]
+    }
+
+    response = await test_client.post('/v1/files/actions/batch', json=payload)
+
+    assert response.status_code == 200
+    results = response.json()['result']
+    assert [result['code'] for result in results] == [202, 400, 500]
+    assert results[0]['result'][0]['payload']['targets'] == ['112233']
+    assert results[1]['error_msg'] == 'Invalid operation'
+    assert results[2]['error_msg'] == 'Not found resource: invalid'
+
+
+async def test_v1_get_metadata_cache_stats_return_200(test_client):
+    response = await test_client.get('/v1/files/actions/metadata-cache')
+
+    assert response.status_code == 200
+    assert response.json()['result'] == {'size': 0, 'hits': 0, 'negative_hits': 0, 'misses': 0, 'evictions': 0}
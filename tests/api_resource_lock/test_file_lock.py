@@ -10,8 +10,12 @@
 # You should have received a copy of the GNU Affero General Public License along with this program. If not, see
 # http://www.gnu.org/licenses/.
 
+import asyncio
+
 import pytest
 
+from config import get_settings
+
 
 @pytest.mark.parametrize('operation', ['read', 'write'])
 async def test_lock(test_client, fake, operation):
@@ -74,13 +78,33 @@ async def test_bulk_lock_stops_locking_when_lock_attempt_fails(test_client, fake
     assert expected_result == result
 
 
+@pytest.mark.parametrize('operation', ['read', 'write'])
+async def test_bulk_lock_releases_acquired_locks_when_lock_attempt_fails(test_client, fake, operation):
+    key1 = f'a_{fake.pystr()}'
+    key2 = f'b_{fake.pystr()}'
+
+    await test_client.post('/v2/resource/lock/', json={'resource_key': key2, 'operation': 'write'})
+
+    payload = {
+        'resource_keys': [key1, key2],
+        'operation': operation,
+    }
+
+    response = await test_client.post('/v2/resource/lock/bulk', json=payload)
+    assert response.status_code == 409
+
+    response = await test_client.get('/v2/resource/lock/', query_string={'resource_key': key1})
+    status = response.json()['result']['status']
+    assert status is None
+
+
 @pytest.mark.parametrize('operation', ['read', 'write'])
 async def test_bulk_unlock_performs_unlock_for_multiple_keys(test_client, fake, operation):
     key1 = f'a_{fake.pystr()}'
     key2 = f'b_{fake.pystr()}'
 
     for key in [key1, key2]:
-        await test_client.post('/v2/resource/lock/', json={'resource_key': key, 'operation': 'write'})
+        await test_client.post('/v2/resource/lock/', json={'resource_key': key, 'operation': operation})
 
     payload = {
         'resource_keys': [key1, key2],
@@ -104,7 +128,7 @@ async def test_bulk_unlock_continues_unlocking_when_unlock_attempt_fails(test_cl
     key1 = f'a_{fake.pystr()}'
     key2 = f'b_{fake.pystr()}'
 
-    await test_client.post('/v2/resource/lock/', json={'resource_key': key2, 'operation': 'write'})
+    await test_client.post('/v2/resource/lock/', json={'resource_key': key2, 'operation': operation})
 
     payload = {
         'resource_keys': [key1, key2],
@@ -165,3 +189,151 @@ async def test_second_write_lock_is_not_allowed_and_returns_409(test_client, fak
 
     response = await test_client.post('/v2/resource/lock/', json=payload)
     assert response.status_code == 409
+
+
+async def test_lock_with_wait_timeout_acquires_lock_once_it_is_released(test_client, fake):
+    payload = {
+        'resource_key': fake.pystr(),
+        'operation': 'write',
+    }
+    await test_client.post('/v2/resource/lock/', json=payload)
+
+    waiting_lock = asyncio.create_task(test_client.post('/v2/resource/lock/', json={**payload, 'wait_timeout': 5}))
+    await asyncio.sleep(0.1)
+    await test_client.delete('/v2/resource/lock/', json=payload)
+
+    response = await waiting_lock
+    assert response.status_code == 200
+
+
+async def test_lock_with_wait_timeout_returns_409_when_timeout_expires(test_client, fake):
+    payload = {
+        'resource_key': fake.pystr(),
+        'operation': 'write',
+    }
+    await test_client.post('/v2/resource/lock/', json=payload)
+
+    response = await test_client.post('/v2/resource/lock/', json={**payload, 'wait_timeout': 0.1})
+    assert response.status_code == 409
+
+
+async def test_lock_with_ttl_returns_lease_id_which_can_be_renewed(test_client, fake):
+    payload = {
+        'resource_key': fake.pystr(),
+        'operation': 'write',
+        'ttl': 60,
+    }
+
+    response = await test_client.post('/v2/resource/lock/', json=payload)
+    assert response.status_code == 200
+    lease_id = response.json()['result']['lease_id']
+    assert lease_id
+
+    payload = {'resource_key': payload['resource_key'], 'lease_id': lease_id, 'ttl': 120}
+    response = await test_client.post('/v2/resource/lock/renew', json=payload)
+    assert response.status_code == 200
+
+
+async def test_renew_returns_404_for_not_existing_lease(test_client, fake):
+    payload = {
+        'resource_key': fake.pystr(),
+        'lease_id': fake.pystr(),
+        'ttl': 60,
+    }
+
+    response = await test_client.post('/v2/resource/lock/renew', json=payload)
+    assert response.status_code == 404
+
+
+async def test_bulk_renew_renews_lease_for_multiple_keys(test_client, fake):
+    key1 = f'a_{fake.pystr()}'
+    key2 = f'b_{fake.pystr()}'
+    payload = {
+        'resource_keys': [key1, key2],
+        'operation': 'read',
+        'ttl': 60,
+    }
+
+    response = await test_client.post('/v2/resource/lock/bulk', json=payload)
+    lease_id = response.json()['lease_id']
+
+    payload = {'resource_keys': [key1, key2], 'lease_id': lease_id, 'ttl': 120}
+    response = await test_client.post('/v2/resource/lock/bulk/renew', json=payload)
+    assert response.status_code == 200
+
+    expected_result = [
+        [key1, True],
+        [key2, True],
+    ]
+    result = response.json()['result']
+
+    assert expected_result == result
+
+
+async def test_bulk_check_returns_status_for_multiple_keys(test_client, fake):
+    key1 = fake.pystr()
+    key2 = fake.pystr()
+    await test_client.post('/v2/resource/lock/', json={'resource_key': key1, 'operation': 'write'})
+
+    response = await test_client.post('/v2/resource/lock/bulk/check', json={'resource_keys': [key1, key2]})
+    assert response.status_code == 200
+
+    result = response.json()['result']
+    assert [(state['key'], state['status']) for state in result] == [(key1, '0,1'), (key2, None)]
+
+
+async def test_list_locks_returns_page_of_locks_held_by_owner(test_client, fake):
+    owner = fake.user_name()
+    keys = sorted(fake.pystr() for _ in range(3))
+    for key in keys:
+        await test_client.post('/v2/resource/lock/', json={'resource_key': key, 'operation': 'read', 'owner': owner})
+
+    response = await test_client.get('/v2/resource/lock/list', query_string={'owner': owner, 'page_size': 2})
+    assert response.status_code == 200
+
+    body = response.json()
+    assert body['total'] == 3
+    assert body['num_of_pages'] == 2
+    assert [state['key'] for state in body['result']] == keys[:2]
+
+
+async def test_list_locks_returns_400_for_multiple_filters(test_client, fake):
+    response = await test_client.get('/v2/resource/lock/list', query_string={'owner': fake.user_name(), 'prefix': 'a'})
+    assert response.status_code == 400
+
+
+async def test_lock_returns_fencing_token_which_releases_the_lock(test_client, fake):
+    payload = {
+        'resource_key': fake.pystr(),
+        'operation': 'write',
+        'owner': fake.user_name(),
+    }
+
+    response = await test_client.post('/v2/resource/lock/', json=payload)
+    result = response.json()['result']
+    assert result['owner'] == payload['owner']
+    assert result['fencing_token']
+
+    response = await test_client.delete(
+        '/v2/resource/lock/', json={**payload, 'fencing_token': result['fencing_token'] + 1}
+    )
+    assert response.status_code == 400
+
+    response = await test_client.delete(
+        '/v2/resource/lock/', json={**payload, 'fencing_token': result['fencing_token']}
+    )
+    assert response.status_code == 200
+
+
+async def test_unlock_returns_400_when_fencing_token_is_required_but_missing(test_client, fake):
+    settings = get_settings().copy(update={'RESOURCE_LOCK_REQUIRE_FENCING_TOKEN': True})
+    test_client.application.dependency_overrides[get_settings] = lambda: settings
+    payload = {
+        'resource_key': fake.pystr(),
+        'operation': 'write',
+    }
+    await test_client.post('/v2/resource/lock/', json=payload)
+
+    response = await test_client.delete('/v2/resource/lock/', json=payload)
+    assert response.status_code == 400
+    assert response.json()['error_msg'] == 'Fencing token is required'
@@ -0,0 +1,524 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program. If not, see
+# http://www.gnu.org/licenses/.
+
+import asyncio
+
+import pytest
+
+from api.api_resource_lock.lock_engine import LockEngine
+
+
+@pytest.fixture
+def lock_engine(redis):
+    yield LockEngine(redis)
+
+
+class TestLockEngine:
+    async def test_lock_stores_read_count_for_multiple_read_locks(self, fake, redis, lock_engine):
+        key = fake.pystr()
+
+        for _ in range(3):
+            assert await lock_engine.lock(key, 'read') is True
+
+        assert await redis.get(key) == b'3,0'
+
+    async def test_lock_returns_false_for_write_lock_when_read_lock_exists(self, fake, redis, lock_engine):
+        key = fake.pystr()
+        await lock_engine.lock(key, 'read')
+
+        assert await lock_engine.lock(key, 'write') is False
+        assert await redis.get(key) == b'1,0'
+
+    @pytest.mark.parametrize('operation', ['read', 'write'])
+    async def test_lock_returns_false_when_write_lock_exists(self, fake, redis, lock_engine, operation):
+        key = fake.pystr()
+        await lock_engine.lock(key, 'write')
+
+        assert await lock_engine.lock(key, operation) is False
+        assert await redis.get(key) == b'0,1'
+
+    async def test_unlock_decreases_read_count_and_removes_entry_after_last_read(self, fake, redis, lock_engine):
+        key = fake.pystr()
+        await lock_engine.lock(key, 'read')
+        await lock_engine.lock(key, 'read')
+
+        assert await lock_engine.unlock(key, 'read') is True
+        assert await redis.get(key) == b'1,0'
+
+        assert await lock_engine.unlock(key, 'read') is True
+        assert await redis.exists(key) == 0
+
+    async def test_unlock_returns_false_for_write_unlock_when_read_lock_exists(self, fake, redis, lock_engine):
+        key = fake.pystr()
+        await lock_engine.lock(key, 'read')
+
+        assert await lock_engine.unlock(key, 'write') is False
+        assert await redis.get(key) == b'1,0'
+
+    async def test_unlock_returns_false_for_read_unlock_when_write_lock_exists(self, fake, redis, lock_engine):
+        key = fake.pystr()
+        await lock_engine.lock(key, 'write')
+
+        assert await lock_engine.unlock(key, 'read') is False
+        assert await redis.get(key) == b'0,1'
+
+    async def test_concurrent_write_locks_are_acquired_only_once(self, fake, lock_engine):
+        key = fake.pystr()
+
+        results = await asyncio.gather(*[lock_engine.lock(key, 'write') for _ in range(10)])
+
+        assert results.count(True) == 1
+
+    async def test_bulk_lock_acquires_locks_for_all_keys(self, fake, redis, lock_engine):
+        keys = [fake.pystr() for _ in range(3)]
+
+        assert await lock_engine.bulk_lock(keys, 'write') == [True, True, True]
+        assert await redis.mget(keys) == [b'0,1', b'0,1', b'0,1']
+
+    async def test_bulk_lock_rolls_back_acquired_locks_on_failure(self, fake, redis, lock_engine):
+        key1, key2, key3 = (fake.pystr() for _ in range(3))
+        await lock_engine.lock(key1, 'read')
+        await lock_engine.lock(key3, 'write')
+
+        result = await lock_engine.bulk_lock([key1, key2, key3], 'read')
+
+        assert result == [True, True, False]
+        assert await redis.mget([key1, key2, key3]) == [b'1,0', None, b'0,1']
+
+    async def test_bulk_lock_fails_for_duplicated_write_key(self, fake, redis, lock_engine):
+        key = fake.pystr()
+
+        assert await lock_engine.bulk_lock([key, key], 'write') == [True, False]
+        assert await redis.exists(key) == 0
+
+    async def test_bulk_unlock_continues_when_unlock_attempt_fails(self, fake, redis, lock_engine):
+        key1, key2 = fake.pystr(), fake.pystr()
+        await lock_engine.lock(key2, 'write')
+
+        assert await lock_engine.bulk_unlock([key1, key2], 'write') == [False, True]
+        assert await redis.exists(key2) == 0
+
+    async def test_lock_with_lease_sets_expiration_for_lock_entry(self, fake, redis, lock_engine):
+        key = fake.pystr()
+
+        assert await lock_engine.lock(key, 'write', lease_id='lease', ttl=60) is True
+
+        assert 0 < await redis.pttl(key) <= 60000
+        assert 0 < await redis.pttl(f'{key}:holders') <= 60000
+
+    async def test_lock_without_lease_does_not_set_expiration_when_leased_lock_exists(self, fake, redis, lock_engine):
+        key = fake.pystr()
+        await lock_engine.lock(key, 'read', lease_id='lease', ttl=60)
+
+        await lock_engine.lock(key, 'read')
+
+        assert await redis.pttl(key) == -1
+
+    async def test_expired_read_lease_decreases_read_count(self, fake, redis, lock_engine):
+        key = fake.pystr()
+        await lock_engine.lock(key, 'read')
+        await lock_engine.lock(key, 'read', lease_id='lease', ttl=0.01)
+        await asyncio.sleep(0.02)
+
+        assert await lock_engine.get_status(key) == '1,0'
+
+    async def test_expired_write_lease_allows_new_write_lock(self, fake, lock_engine, redis):
+        key = fake.pystr()
+        await lock_engine.lock(key, 'write', lease_id='lease', ttl=0.01)
+        await asyncio.sleep(0.02)
+
+        assert await lock_engine.lock(key, 'write') is True
+
+    async def test_unlock_with_lease_id_returns_false_for_unknown_lease(self, fake, lock_engine):
+        key = fake.pystr()
+        await lock_engine.lock(key, 'read', lease_id='lease', ttl=60)
+
+        assert await lock_engine.unlock(key, 'read', lease_id='unknown') is False
+        assert await lock_engine.get_status(key) == '1,0'
+
+    async def test_unlock_without_lease_id_releases_holder_without_lease_first(self, fake, redis, lock_engine):
+        key = fake.pystr()
+        await lock_engine.lock(key, 'read', lease_id='lease', ttl=60)
+        await lock_engine.lock(key, 'read')
+
+        assert await lock_engine.unlock(key, 'read') is True
+
+        assert await lock_engine.get_status(key) == '1,0'
+        assert await lock_engine.unlock(key, 'read', lease_id='lease') is True
+
+    async def test_unlock_without_lease_id_keeps_leased_holder(self, fake, lock_engine):
+        key = fake.pystr()
+        await lock_engine.lock(key, 'write', lease_id='lease', ttl=60)
+
+        assert await lock_engine.unlock(key, 'write') is False
+        assert await lock_engine.get_status(key) == '0,1'
+
+    async def test_unlock_with_owner_keeps_lock_of_another_owner(self, fake, lock_engine):
+        key = fake.pystr()
+        await lock_engine.lock(key, 'write', owner='alice')
+
+        assert await lock_engine.unlock(key, 'write', owner='bob') is False
+        assert await lock_engine.unlock(key, 'write') is False
+        assert await lock_engine.get_status(key) == '0,1'
+
+    async def test_unlock_releases_holder_acquired_without_holder_record(self, fake, redis, lock_engine):
+        key = fake.pystr()
+        await redis.set(key, '2,0')
+
+        assert await lock_engine.unlock(key, 'read') is True
+        assert await lock_engine.get_status(key) == '1,0'
+
+    async def test_bulk_renew_extends_existing_leases_only(self, fake, redis, lock_engine):
+        key1, key2 = fake.pystr(), fake.pystr()
+        await lock_engine.lock(key1, 'read', lease_id='lease', ttl=1)
+
+        assert await lock_engine.bulk_renew([key1, key2], 'lease', 60) == [True, False]
+        assert await redis.pttl(key1) > 1000
+
+    async def test_lock_with_wait_timeout_is_woken_up_when_lock_is_released(self, fake, redis):
+        lock_engine = LockEngine(redis, poll_interval=60)
+        key = fake.pystr()
+        await lock_engine.lock(key, 'write')
+
+        waiting_lock = asyncio.create_task(lock_engine.lock(key, 'write', wait_timeout=5))
+        await asyncio.sleep(0.05)
+        await lock_engine.unlock(key, 'write')
+
+        assert await asyncio.wait_for(waiting_lock, 1) is True
+        assert await redis.exists(f'{key}:waiters') == 0
+
+    async def test_waiters_share_one_pubsub_connection(self, fake, redis, monkeypatch):
+        connections = []
+        create_pubsub = redis.pubsub
+
+        def pubsub():
+            connections.append(create_pubsub())
+            return connections[-1]
+
+        monkeypatch.setattr(redis, 'pubsub', pubsub)
+        lock_engine = LockEngine(redis, poll_interval=60)
+        keys = [fake.pystr() for _ in range(3)]
+        for key in keys:
+            await lock_engine.lock(key, 'write')
+
+        waiting_locks = [asyncio.create_task(lock_engine.lock(key, 'read', wait_timeout=5)) for key in [*keys, keys[0]]]
+        await asyncio.sleep(0.05)
+        for key in keys:
+            await lock_engine.unlock(key, 'write')
+
+        assert await asyncio.wait_for(asyncio.gather(*waiting_locks), 1) == [True, True, True, True]
+        assert len(connections) == 1
+
+    async def test_lock_with_wait_timeout_returns_false_and_leaves_queue_after_timeout(self, fake, redis, lock_engine):
+        key = fake.pystr()
+        await lock_engine.lock(key, 'write')
+
+        assert await lock_engine.lock(key, 'read', wait_timeout=0.1) is False
+        assert await redis.exists(f'{key}:waiters') == 0
+
+    async def test_read_lock_does_not_skip_waiting_write_lock(self, fake, lock_engine):
+        key = fake.pystr()
+        await lock_engine.lock(key, 'read')
+
+        waiting_lock = asyncio.create_task(lock_engine.lock(key, 'write', wait_timeout=5))
+        await asyncio.sleep(0.05)
+
+        assert await lock_engine.lock(key, 'read') is False
+
+        await lock_engine.unlock(key, 'read')
+        assert await waiting_lock is True
+
+    async def test_waiters_acquire_lock_in_queue_order(self, fake, lock_engine):
+        key = fake.pystr()
+        await lock_engine.lock(key, 'write')
+        acquired = []
+
+        async def lock_and_release(name: str) -> None:
+            await lock_engine.lock(key, 'write', wait_timeout=5)
+            acquired.append(name)
+            await lock_engine.unlock(key, 'write')
+
+        waiters = []
+        for name in ['first', 'second', 'third']:
+            waiters.append(asyncio.create_task(lock_and_release(name)))
+            await asyncio.sleep(0.05)
+        await lock_engine.unlock(key, 'write')
+        await asyncio.gather(*waiters)
+
+        assert acquired == ['first', 'second', 'third']
+
+    async def test_lock_stores_entry_under_namespace(self, fake, redis):
+        lock_engine = LockEngine(redis, namespace='resource-lock:')
+        key = fake.pystr()
+
+        assert await lock_engine.lock(key, 'write') is True
+
+        assert await redis.exists(key) == 0
+        assert await redis.get(f'resource-lock:{key}') == b'0,1'
+        assert await lock_engine.get_status(key) == '0,1'
+
+    async def test_inspect_returns_state_with_owners_for_each_key(self, fake, lock_engine):
+        key1, key2 = fake.pystr(), fake.pystr()
+        await lock_engine.lock(key1, 'read', owner='alice')
+        await lock_engine.lock(key1, 'read', lease_id='lease', ttl=60, owner='bob')
+
+        state1, state2 = await lock_engine.inspect([key1, key2])
+
+        assert state1.status == '2,0'
+        assert state1.acquired_at is not None
+        assert state1.owners == {'alice': 1, 'bob': 1}
+        assert state2.status is None
+
+    async def test_list_locks_returns_locks_with_prefix(self, fake, lock_engine):
+        prefix = f'{fake.pystr()}/'
+        keys = [f'{prefix}{index}' for index in range(3)]
+        for key in keys:
+            await lock_engine.lock(key, 'read')
+        await lock_engine.lock(fake.pystr(), 'read')
+
+        total, states = await lock_engine.list_locks(prefix=prefix, offset=1, limit=1)
+
+        assert total == 3
+        assert [state.key for state in states] == [keys[1]]
+
+    async def test_list_locks_returns_locks_of_owner_until_they_are_released(self, fake, lock_engine):
+        key = fake.pystr()
+        await lock_engine.lock(key, 'write', owner='alice')
+
+        total, states = await lock_engine.list_locks(owner='alice')
+        assert total == 1
+        assert states[0].key == key
+
+        await lock_engine.unlock(key, 'write', owner='alice')
+
+        assert await lock_engine.list_locks(owner='alice') == (0, [])
+        assert await lock_engine.list_locks(prefix=key) == (0, [])
+
+    async def test_list_locks_returns_locks_older_than_given_age(self, fake, redis, lock_engine):
+        key1, key2 = fake.pystr(), fake.pystr()
+        await lock_engine.lock(key1, 'write')
+        await lock_engine.lock(key2, 'write')
+        await redis.zadd('lock-registry:acquired', {key1: 0})
+
+        total, states = await lock_engine.list_locks(older_than=3600)
+
+        assert total == 1
+        assert states[0].key == key1
+
+    async def test_list_locks_removes_expired_locks_from_registry(self, fake, redis, lock_engine):
+        key = fake.pystr()
+        await lock_engine.lock(key, 'write', lease_id='lease', ttl=0.01, owner='alice')
+        await asyncio.sleep(0.02)
+
+        total, states = await lock_engine.list_locks(owner='alice')
+
+        assert (total, states) == (1, [])
+        assert await redis.zcard('lock-registry:owner:alice') == 0
+        assert await redis.zscore('lock-registry:keys', key) is None
+
+    async def test_acquire_returns_increasing_fencing_tokens(self, fake, lock_engine):
+        key = fake.pystr()
+
+        first_token = await lock_engine.acquire(key, 'write')
+        await lock_engine.unlock(key, 'write', fencing_token=first_token)
+        second_token = await lock_engine.acquire(key, 'write')
+
+        assert second_token > first_token
+        assert await lock_engine.acquire(key, 'write') is None
+
+    async def test_unlock_with_stale_fencing_token_keeps_lock_of_new_holder(self, fake, lock_engine):
+        key = fake.pystr()
+        stale_token = await lock_engine.acquire(key, 'write')
+        await lock_engine.unlock(key, 'write', fencing_token=stale_token)
+        await lock_engine.acquire(key, 'write')
+
+        assert await lock_engine.unlock(key, 'write', fencing_token=stale_token) is False
+        assert await lock_engine.get_status(key) == '0,1'
+
+    async def test_unlock_with_fencing_token_releases_holder_of_the_token(self, fake, redis, lock_engine):
+        key = fake.pystr()
+        await lock_engine.acquire(key, 'read', lease_id='lease', ttl=60)
+        fencing_token = await lock_engine.acquire(key, 'read', owner='alice')
+
+        assert await lock_engine.unlock(key, 'read', fencing_token=fencing_token) is True
+
+        [state] = await lock_engine.inspect([key])
+        assert state.status == '1,0'
+        assert state.owners == {}
+        assert await lock_engine.unlock(key, 'read', lease_id='lease') is True
+
+    async def test_bulk_renew_returns_false_for_fencing_token_of_another_holder(self, fake, lock_engine):
+        key = fake.pystr()
+        await lock_engine.acquire(key, 'read', lease_id='lease', ttl=60)
+        other_token = await lock_engine.acquire(key, 'read', lease_id='other', ttl=60)
+
+        assert await lock_engine.bulk_renew([key], 'lease', 60, fencing_token=other_token) == [False]
+        assert await lock_engine.bulk_renew([key], 'other', 60, fencing_token=other_token) == [True]
+
+    async def test_lock_without_fencing_keeps_one_key_for_lock_without_lease_and_owner(self, fake, redis):
+        lock_engine = LockEngine(redis, fencing=False)
+        key = fake.pystr()
+
+        fencing_token = await lock_engine.acquire(key, 'write')
+
+        assert await redis.exists(f'{key}:holders') == 0
+        assert await lock_engine.unlock(key, 'write', fencing_token=fencing_token) is True
+        assert await redis.exists(key) == 0
+
+    async def test_bulk_acquire_returns_one_fencing_token_for_all_keys(self, fake, lock_engine):
+        keys = [fake.pystr() for _ in range(2)]
+
+        fencing_token, status = await lock_engine.bulk_acquire(keys, 'write')
+
+        assert status == [True, True]
+        assert [state.fencing_tokens for state in await lock_engine.inspect(keys)] == [[fencing_token]] * 2
+        assert await lock_engine.bulk_unlock(keys, 'write', fencing_token=fencing_token) == [True, True]
+
+
+@pytest.fixture
+def hash_lock_engine(redis):
+    yield LockEngine(redis, layout='hash')
+
+
+class TestHashLayoutLockEngine:
+    async def test_lock_stores_counters_in_bucket_hash(self, fake, redis, hash_lock_engine):
+        bucket = fake.pystr()
+        key1, key2 = f'{bucket}/a.txt', f'{bucket}/b.txt'
+
+        await hash_lock_engine.lock(key1, 'read')
+        await hash_lock_engine.lock(key1, 'read')
+        await hash_lock_engine.lock(key2, 'write')
+
+        assert await redis.exists(key1, key2, f'{key1}:holders', f'{key2}:holders') == 0
+        assert await redis.hmget(f'lock-shard:{bucket}', [key1, key2]) == [b'2', b'-1']
+        assert await hash_lock_engine.get_status(key1) == '2,0'
+        assert await hash_lock_engine.get_status(key2) == '0,1'
+        assert await hash_lock_engine.lock(key2, 'read') is False
+
+    async def test_unlock_removes_counter_from_hash(self, fake, redis, hash_lock_engine):
+        key = fake.pystr()
+        await hash_lock_engine.lock(key, 'write')
+
+        assert await hash_lock_engine.unlock(key, 'write') is True
+
+        assert await redis.hexists(f'lock-shard:{key[:2]}', key) == 0
+        assert await hash_lock_engine.get_status(key) is None
+
+    async def test_expired_leases_are_reaped_by_other_lock_requests(self, fake, redis, hash_lock_engine):
+        key = fake.pystr()
+        await hash_lock_engine.lock(key, 'write', lease_id='lease', ttl=0.01)
+        await asyncio.sleep(0.02)
+
+        await hash_lock_engine.lock(fake.pystr(), 'write')
+
+        assert await redis.hexists(f'lock-shard:{key[:2]}', key) == 0
+        assert await redis.zcard('lock-registry:expiring') == 0
+
+    async def test_migrate_to_hash_layout_moves_string_entries(self, fake, redis, hash_lock_engine):
+        bucket = fake.pystr()
+        key = f'{bucket}/file.txt'
+        await LockEngine(redis).lock(key, 'read', lease_id='lease', ttl=60)
+        await redis.set(f'{bucket}/other.txt', 'not a lock')
+
+        assert await hash_lock_engine.migrate_to_hash_layout(bucket) == 1
+
+        assert await redis.exists(key) == 0
+        assert await hash_lock_engine.get_status(key) == '1,0'
+        assert await redis.exists(f'{key}:holders') == 0
+        assert await redis.zscore('lock-registry:expiring', key) is not None
+        assert await hash_lock_engine.unlock(key, 'read', lease_id='lease') is True
+
+    async def test_migrate_to_hash_layout_requires_key_prefix(self, hash_lock_engine):
+        with pytest.raises(ValueError):
+            await hash_lock_engine.migrate_to_hash_layout('')
+
+    async def test_hash_layout_respects_string_entries_before_migration(self, fake, redis, hash_lock_engine):
+        key = f'{fake.pystr()}/file.txt'
+        await LockEngine(redis).lock(key, 'write')
+
+        assert await hash_lock_engine.lock(key, 'read') is False
+        assert await hash_lock_engine.get_status(key) == '0,1'
+        assert await redis.exists(key) == 0
+        assert await hash_lock_engine.unlock(key, 'write') is True
+        assert await hash_lock_engine.get_status(key) is None
+
+
+@pytest.fixture
+def hierarchical_lock_engine(redis):
+    yield LockEngine(redis, hierarchical=True)
+
+
+class TestHierarchicalLockEngine:
+    @pytest.mark.parametrize('operation', ['read', 'write'])
+    async def test_lock_returns_false_for_key_below_write_locked_folder(
+        self, fake, hierarchical_lock_engine, operation
+    ):
+        folder = f'{fake.pystr()}/a/'
+        await hierarchical_lock_engine.lock(folder, 'write')
+
+        assert await hierarchical_lock_engine.lock(f'{folder}b/file.txt', operation) is False
+
+    async def test_lock_allows_read_lock_below_read_locked_folder(self, fake, hierarchical_lock_engine):
+        folder = f'{fake.pystr()}/a/'
+        await hierarchical_lock_engine.lock(folder, 'read')
+
+        assert await hierarchical_lock_engine.lock(f'{folder}file.txt', 'read') is True
+        assert await hierarchical_lock_engine.lock(f'{folder}other.txt', 'write') is False
+
+    @pytest.mark.parametrize('operation', ['read', 'write'])
+    async def test_write_lock_on_folder_returns_false_when_key_below_is_locked(
+        self, fake, hierarchical_lock_engine, operation
+    ):
+        bucket = fake.pystr()
+        await hierarchical_lock_engine.lock(f'{bucket}/a/b/file.txt', operation)
+
+        assert await hierarchical_lock_engine.lock(f'{bucket}/a/', 'write') is False
+        assert await hierarchical_lock_engine.lock(f'{bucket}/a/b/', 'write') is False
+        assert await hierarchical_lock_engine.lock(f'{bucket}/c/', 'write') is True
+
+    async def test_unlock_removes_intents_from_ancestor_folders(self, fake, hierarchical_lock_engine):
+        bucket = fake.pystr()
+        key = f'{bucket}/a/file.txt'
+        await hierarchical_lock_engine.lock(key, 'write')
+        await hierarchical_lock_engine.unlock(key, 'write')
+
+        assert await hierarchical_lock_engine.lock(f'{bucket}/', 'write') is True
+
+    async def test_expired_leased_intent_does_not_block_folder_lock(self, fake, redis, hierarchical_lock_engine):
+        bucket = fake.pystr()
+        key = f'{bucket}/a/file.txt'
+        await hierarchical_lock_engine.lock(key, 'read', lease_id='lease', ttl=60)
+        await redis.zadd(f'{bucket}/a/:intents:read', {f'{key}\nlease': 0})
+
+        assert await hierarchical_lock_engine.lock(f'{bucket}/a/', 'write') is True
+
+    async def test_bulk_lock_rolls_back_intents_on_failure(self, fake, hierarchical_lock_engine):
+        bucket = fake.pystr()
+        await hierarchical_lock_engine.lock(f'{bucket}/b/file.txt', 'write')
+
+        result = await hierarchical_lock_engine.bulk_lock([f'{bucket}/a/file.txt', f'{bucket}/b/file.txt'], 'write')
+
+        assert result == [True, False]
+        assert await hierarchical_lock_engine.lock(f'{bucket}/a/', 'write') is True
+
+    async def test_lock_on_folder_waits_for_release_of_key_below(self, fake, redis):
+        lock_engine = LockEngine(redis, hierarchical=True, poll_interval=60)
+        bucket = fake.pystr()
+        await lock_engine.lock(f'{bucket}/a/file.txt', 'read')
+
+        waiting_lock = asyncio.create_task(lock_engine.lock(f'{bucket}/a/', 'write', wait_timeout=5))
+        await asyncio.sleep(0.05)
+
+        assert await lock_engine.lock(f'{bucket}/a/other.txt', 'read') is False
+
+        await lock_engine.unlock(f'{bucket}/a/file.txt', 'read')
+        assert await asyncio.wait_for(waiting_lock, 1) is True
@@ -23,6 +23,7 @@ from alembic.config import Config
 from async_asgi_testclient import TestClient
 from faker import Faker
 from fakeredis.aioredis import FakeRedis
+from sqlalchemy import delete
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.asyncio import create_async_engine
 from testcontainers.postgres import PostgresContainer
@@ -31,6 +32,8 @@ from dependencies.cache import Cache
 from dependencies.cache import CacheInstance
 from models.api_archive_sql import ArchivePreviewModel
 from resources.db import get_db_session
+from resources.metadata_cache import metadata_cache
+from resources.redis import SrvAioRedisSingleton
 
 
 @contextmanager
@@ -92,6 +95,8 @@ async def setup_archive_table(db_session):
     db_session.add(archive_row)
     await db_session.commit()
     yield
+    await db_session.execute(delete(ArchivePreviewModel).filter_by(file_id=archive_row.file_id))
+    await db_session.commit()
 
 
 @pytest.fixture(scope='session')
@@ -103,6 +108,12 @@ def event_loop(request):
     asyncio.set_event_loop_policy(None)
 
 
+@pytest.fixture(autouse=True)
+def clear_metadata_cache():
+    yield
+    metadata_cache.clear()
+
+
 @pytest.fixture
 def fake():
     fake = Faker()
@@ -114,6 +125,16 @@ def redis():
     yield FakeRedis()
 
 
+@pytest.fixture
+def srv_redis(redis, monkeypatch):
+    monkeypatch.setattr(SrvAioRedisSingleton, 'connect', lambda self: None)
+    monkeypatch.setattr(SrvAioRedisSingleton, '_SrvAioRedisSingleton__instance', redis)
+    srv_redis = SrvAioRedisSingleton()
+    srv_redis.scan_count = 2
+    srv_redis.mget_batch_size = 2
+    yield srv_redis
+
+
 @pytest.fixture
 def cache(redis):
     from dependencies import Cache
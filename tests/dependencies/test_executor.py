@@ -0,0 +1,46 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program. If not,
+# see http://www.gnu.org/licenses/.
+
+import threading
+
+import pytest
+
+from dependencies.executor import ExecutorManager
+
+
+@pytest.fixture
+def executor_manager():
+    manager = ExecutorManager()
+    yield manager
+    manager.close()
+
+
+class TestExecutorManager:
+    async def test_call_returns_the_manager(self, executor_manager):
+        assert await executor_manager() is executor_manager
+
+    async def test_run_sync_calls_function_in_worker_thread(self, executor_manager):
+        def get_thread(value, suffix=''):
+            return threading.current_thread().name, value + suffix
+
+        thread_name, value = await executor_manager.run_sync(get_thread, 'value', suffix='!')
+
+        assert thread_name.startswith('dataops-worker')
+        assert value == 'value!'
+
+    async def test_close_shuts_executor_down_and_next_call_creates_new_executor(self, executor_manager):
+        executor = executor_manager.get_executor()
+
+        executor_manager.close()
+
+        assert executor._shutdown
+        assert executor_manager.get_executor() is not executor
@@ -0,0 +1,42 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program. If not,
+# see http://www.gnu.org/licenses/.
+
+
+import pytest
+
+from dependencies.http_client import HTTPClientManager
+
+
+@pytest.fixture
+async def http_client_manager():
+    manager = HTTPClientManager()
+    yield manager
+    await manager.close()
+
+
+class TestHTTPClientManager:
+    async def test_call_returns_the_manager(self, http_client_manager):
+        assert await http_client_manager() is http_client_manager
+
+    async def test_get_client_returns_the_same_client_for_service(self, http_client_manager):
+        client = http_client_manager.get_client('metadata')
+
+        assert http_client_manager.get_client('metadata') is client
+        assert http_client_manager.get_client('queue') is not client
+
+    async def test_close_closes_clients_and_next_call_creates_new_client(self, http_client_manager):
+        client = http_client_manager.get_client('metadata')
+
+        await http_client_manager.close()
+
+        assert client.is_closed
+        assert http_client_manager.get_client('metadata') is not client
@@ -0,0 +1,42 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program. If not,
+# see http://www.gnu.org/licenses/.
+
+import asyncio
+import inspect
+
+import pytest
+
+from resources.helpers import gather_bounded
+
+
+async def return_after(value: int, seconds: float) -> int:
+    await asyncio.sleep(seconds)
+    return value
+
+
+async def fail() -> None:
+    raise ValueError()
+
+
+class TestGatherBounded:
+    async def test_returns_results_in_order(self):
+        result = await gather_bounded([return_after(1, 0.02), return_after(2, 0), return_after(3, 0.01)], 2)
+
+        assert result == [1, 2, 3]
+
+    async def test_closes_coroutines_which_never_started_after_failure(self):
+        waiting = [return_after(index, 0) for index in range(3)]
+
+        with pytest.raises(ValueError):
+            await gather_bounded([fail(), *waiting], 1)
+
+        assert [inspect.getcoroutinestate(coroutine) for coroutine in waiting] == [inspect.CORO_CLOSED] * 3
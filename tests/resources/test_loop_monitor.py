@@ -0,0 +1,72 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program. If not,
+# see http://www.gnu.org/licenses/.
+
+import asyncio
+import time
+
+import pytest
+
+from resources import loop_monitor
+from resources.loop_monitor import LoopBlockMonitor
+
+
+def block_event_loop(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+class TestLoopBlockMonitor:
+    @pytest.fixture
+    def warnings(self, monkeypatch):
+        messages = []
+        monkeypatch.setattr(loop_monitor.logger, 'warning', messages.append)
+        yield messages
+
+    async def test_reports_stack_of_blocking_code_and_blocked_time(self, warnings):
+        monitor = LoopBlockMonitor(threshold=0.05, interval=0.01)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.02)
+            block_event_loop(0.2)
+            await asyncio.sleep(0.02)
+        finally:
+            monitor.stop()
+
+        assert len(warnings) == 2
+        assert 'Event loop blocked for more than' in warnings[0]
+        assert 'block_event_loop' in warnings[0]
+        assert 'Event loop was blocked for' in warnings[1]
+
+    async def test_does_not_report_when_event_loop_is_not_blocked(self, warnings):
+        monitor = LoopBlockMonitor(threshold=0.05, interval=0.01)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.1)
+        finally:
+            monitor.stop()
+
+        assert warnings == []
+
+    async def test_check_does_not_mark_loop_blocked_after_heartbeat(self, warnings):
+        monitor = LoopBlockMonitor(threshold=0.05, interval=0.01)
+        monitor.heartbeat = time.monotonic() - 1
+        monitor.check()
+        monitor.check()
+
+        assert monitor.blocked_since == pytest.approx(monitor.heartbeat + monitor.interval)
+        assert len(warnings) == 1
+
+        monitor.stop()
+        monitor.beat()
+        monitor.check()
+
+        assert monitor.blocked_since is None
+        assert len(warnings) == 2
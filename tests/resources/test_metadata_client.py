@@ -0,0 +1,172 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see http://www.gnu.org/licenses/.
+
+import pytest
+
+from config import ConfigClass
+from resources.metadata_cache import metadata_cache
+from resources.metadata_client import MetadataClient
+
+
+class TestMetadataClient:
+    @pytest.fixture
+    def client(self, monkeypatch):
+        monkeypatch.setattr(MetadataClient, 'batch_endpoint_unavailable_until', 0.0)
+        client = MetadataClient()
+        client.batch_size = 2
+        yield client
+
+    async def test_get_by_ids_fetches_items_in_batches_in_order_of_ids(self, client, httpx_mock):
+        httpx_mock.add_response(
+            method='GET',
+            url='http://metadata_service/v1/items/batch/?ids=1&ids=2',
+            json={'result': [{'id': '2'}, {'id': '1'}]},
+        )
+        httpx_mock.add_response(
+            method='GET',
+            url='http://metadata_service/v1/items/batch/?ids=3',
+            json={'result': [{'id': '3'}]},
+        )
+
+        items = await client.get_by_ids(['1', '2', '3', '1'])
+
+        assert [item['id'] for item in items] == ['1', '2', '3', '1']
+
+    async def test_get_by_ids_raises_for_missing_item(self, client, httpx_mock):
+        httpx_mock.add_response(
+            method='GET',
+            url='http://metadata_service/v1/items/batch/?ids=1&ids=2',
+            json={'result': [{'id': '1'}]},
+        )
+
+        with pytest.raises(Exception, match='Not found resource: 2'):
+            await client.get_by_ids(['1', '2'])
+
+    async def test_get_by_ids_falls_back_to_one_request_per_id_without_batch_endpoint(self, client, httpx_mock):
+        httpx_mock.add_response(
+            method='GET', url='http://metadata_service/v1/items/batch/?ids=1&ids=2', status_code=404
+        )
+        for item_id in ['1', '2']:
+            httpx_mock.add_response(
+                method='GET', url=f'http://metadata_service/v1/item/{item_id}/', json={'result': {'id': item_id}}
+            )
+
+        items = await client.get_by_ids(['1', '2'])
+
+        assert [item['id'] for item in items] == ['1', '2']
+        assert client.is_batch_endpoint_available() is False
+
+    async def test_get_by_ids_asks_for_batch_endpoint_again_after_retry_period(self, client, httpx_mock, monkeypatch):
+        monkeypatch.setattr(ConfigClass, 'METADATA_BATCH_RETRY_AFTER', 0)
+        httpx_mock.add_response(
+            method='GET', url='http://metadata_service/v1/items/batch/?ids=1&ids=2', status_code=404
+        )
+        for item_id in ['1', '2']:
+            httpx_mock.add_response(
+                method='GET', url=f'http://metadata_service/v1/item/{item_id}/', json={'result': {'id': item_id}}
+            )
+        await client.get_by_ids(['1', '2'])
+        httpx_mock.add_response(
+            method='GET',
+            url='http://metadata_service/v1/items/batch/?ids=3&ids=4',
+            json={'result': [{'id': '3'}, {'id': '4'}]},
+        )
+
+        items = await client.get_by_ids(['3', '4'])
+
+        assert [item['id'] for item in items] == ['3', '4']
+
+    @pytest.mark.parametrize(
+        'response',
+        [{'status_code': 500}, {'text': 'not json'}, {'json': {'error_msg': 'unexpected'}}],
+    )
+    async def test_get_by_ids_falls_back_to_one_request_per_id_on_batch_error(self, client, httpx_mock, response):
+        httpx_mock.add_response(method='GET', url='http://metadata_service/v1/items/batch/?ids=1&ids=2', **response)
+        for item_id in ['1', '2']:
+            httpx_mock.add_response(
+                method='GET', url=f'http://metadata_service/v1/item/{item_id}/', json={'result': {'id': item_id}}
+            )
+
+        items = await client.get_by_ids(['1', '2'])
+
+        assert [item['id'] for item in items] == ['1', '2']
+        assert client.is_batch_endpoint_available() is True
+
+    async def test_get_by_id_requests_single_item(self, client, httpx_mock):
+        httpx_mock.add_response(method='GET', url='http://metadata_service/v1/item/1/', json={'result': {'id': '1'}})
+
+        assert await client.get_by_id('1') == {'id': '1'}
+
+
+class TestMetadataCache:
+    @pytest.fixture
+    def client(self, monkeypatch):
+        monkeypatch.setattr(MetadataClient, 'batch_endpoint_unavailable_until', 0.0)
+        yield MetadataClient()
+
+    async def test_get_by_ids_serves_repeated_lookups_from_cache(self, client, httpx_mock):
+        httpx_mock.add_response(
+            method='GET',
+            url='http://metadata_service/v1/items/batch/?ids=1&ids=2',
+            json={'result': [{'id': '1'}, {'id': '2'}]},
+        )
+
+        await client.get_by_ids(['1', '2'])
+        items = await client.get_by_ids(['2', '1'])
+
+        assert [item['id'] for item in items] == ['2', '1']
+        assert len(httpx_mock.get_requests()) == 1
+        assert metadata_cache.get_stats()['hits'] == 2
+
+    async def test_get_by_id_caches_ids_not_found(self, client, httpx_mock):
+        httpx_mock.add_response(method='GET', url='http://metadata_service/v1/item/1/', json={'result': {}})
+
+        for _ in range(2):
+            with pytest.raises(Exception, match='Not found resource: 1'):
+                await client.get_by_id('1')
+
+        assert len(httpx_mock.get_requests()) == 1
+        assert metadata_cache.get_stats()['negative_hits'] == 1
+
+    async def test_invalidate_drops_cached_items(self, client, httpx_mock):
+        httpx_mock.add_response(method='GET', url='http://metadata_service/v1/item/1/', json={'result': {'id': '1'}})
+
+        await client.get_by_id('1')
+        await client.invalidate(['1'])
+        await client.get_by_id('1')
+
+        assert len(httpx_mock.get_requests()) == 2
+
+    async def test_cache_evicts_least_recently_used_items(self, monkeypatch):
+        monkeypatch.setattr(ConfigClass, 'METADATA_CACHE_SIZE', 2)
+        await metadata_cache.set_many({'1': {'id': '1'}, '2': {'id': '2'}})
+        await metadata_cache.get_many(['1'])
+
+        await metadata_cache.set_many({'3': {'id': '3'}})
+
+        cached, missing = await metadata_cache.get_many(['1', '2', '3'])
+        assert sorted(cached) == ['1', '3']
+        assert missing == ['2']
+        assert metadata_cache.get_stats()['evictions'] == 1
+
+    async def test_cache_expires_items_after_ttl(self, monkeypatch):
+        monkeypatch.setattr(ConfigClass, 'METADATA_CACHE_TTL', 0)
+        await metadata_cache.set_many({'1': {'id': '1'}})
+
+        assert await metadata_cache.get_many(['1']) == ({}, ['1'])
+
+    async def test_cache_is_shared_through_redis(self, srv_redis, monkeypatch):
+        monkeypatch.setattr(ConfigClass, 'METADATA_CACHE_REDIS_ENABLED', True)
+        await metadata_cache.set_many({'1': {'id': '1'}, '2': None})
+        metadata_cache.clear()
+
+        assert await metadata_cache.get_many(['1', '2', '3']) == ({'1': {'id': '1'}, '2': None}, ['3'])
@@ -0,0 +1,109 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program. If not, see
+# http://www.gnu.org/licenses/.
+
+import json
+from functools import partial
+from typing import Any
+from typing import Dict
+from typing import Optional
+
+import pytest
+
+from config import ConfigClass
+from resources import queue_outbox
+from resources.metadata_cache import metadata_cache
+from resources.queue_outbox import publish_outbox_messages
+from resources.redis_project_session_job import OUTBOX_KEY
+from resources.redis_project_session_job import SessionJob
+from resources.redis_project_session_job import get_job_key
+from resources.redis_project_session_job import session_job_get_status
+
+NOW = 1643041442
+QUEUE_URL = 'http://queue_service/v1/send_message'
+
+
+class TestQueueOutbox:
+    @pytest.fixture(autouse=True)
+    def frozen_time(self, monkeypatch):
+        monkeypatch.setattr(queue_outbox.time, 'time', partial(float, NOW))
+
+    async def create_job(self, job_id: str, payload: Optional[Dict[str, Any]] = None) -> SessionJob:
+        session_job = SessionJob('session', 'code', 'data_delete', 'me', job_id=job_id)
+        session_job.set_source('source')
+        session_job.set_status('RUNNING')
+        session_job.set_message({'event_type': 'folder_delete', 'payload': {'job_id': job_id, **(payload or {})}})
+        await session_job.create()
+        return session_job
+
+    async def test_create_adds_job_message_to_outbox(self, redis, srv_redis):
+        await self.create_job('job1')
+
+        assert await redis.zscore(OUTBOX_KEY, get_job_key('session', 'job1')) == NOW
+        jobs = await session_job_get_status('session', job_id='job1')
+        assert 'outbox.message' not in jobs[0]
+
+    async def test_publish_sends_messages_and_acknowledges_them(self, redis, srv_redis, httpx_mock):
+        httpx_mock.add_response(method='POST', url=QUEUE_URL, status_code=200, json={})
+        await self.create_job('job1')
+
+        assert await publish_outbox_messages() == 1
+
+        request = httpx_mock.get_request(method='POST')
+        assert json.loads(request.content) == {'event_type': 'folder_delete', 'payload': {'job_id': 'job1'}}
+        assert await redis.zcard(OUTBOX_KEY) == 0
+        assert await redis.hget(get_job_key('session', 'job1'), 'outbox.message') is None
+        assert (await session_job_get_status('session', job_id='job1'))[0]['status'] == 'RUNNING'
+
+    async def test_publish_drops_items_of_sent_messages_from_metadata_cache(self, redis, srv_redis, httpx_mock):
+        httpx_mock.add_response(method='POST', url=QUEUE_URL, status_code=200, json={})
+        await metadata_cache.set_many({item_id: {'id': item_id} for item_id in ['source', 'target', 'other']})
+        await self.create_job('job1', {'source_geid': 'source', 'include_geids': ['target']})
+
+        cached, _ = await metadata_cache.get_many(['source', 'target', 'other'])
+        assert sorted(cached) == ['other', 'source', 'target']
+        await publish_outbox_messages()
+
+        cached, missing = await metadata_cache.get_many(['source', 'target', 'other'])
+        assert sorted(cached) == ['other']
+        assert sorted(missing) == ['source', 'target']
+
+    async def test_publish_retries_failed_messages_with_exponential_backoff(self, redis, srv_redis, httpx_mock):
+        httpx_mock.add_response(method='POST', url=QUEUE_URL, status_code=503)
+        await self.create_job('job1')
+        key = get_job_key('session', 'job1')
+
+        assert await publish_outbox_messages() == 1
+        assert await redis.zscore(OUTBOX_KEY, key) == NOW + ConfigClass.QUEUE_OUTBOX_BACKOFF_BASE
+        assert await publish_outbox_messages() == 0
+
+        await redis.zadd(OUTBOX_KEY, {key: NOW})
+        assert await publish_outbox_messages() == 1
+        assert await redis.zscore(OUTBOX_KEY, key) == NOW + 2 * ConfigClass.QUEUE_OUTBOX_BACKOFF_BASE
+        assert await redis.hget(key, 'outbox.attempts') == b'2'
+
+    async def test_publish_terminates_job_after_max_attempts(self, redis, srv_redis, httpx_mock, monkeypatch):
+        monkeypatch.setattr(ConfigClass, 'QUEUE_OUTBOX_MAX_ATTEMPTS', 1)
+        httpx_mock.add_response(method='POST', url=QUEUE_URL, status_code=503)
+        await self.create_job('job1')
+
+        assert await publish_outbox_messages() == 1
+
+        job = (await session_job_get_status('session', job_id='job1'))[0]
+        assert job['status'] == 'TERMINATED'
+        assert '503' in job['payload']['error']
+        assert await redis.zcard(OUTBOX_KEY) == 0
+
+    async def test_publish_drops_messages_of_jobs_which_no_longer_exist(self, redis, srv_redis):
+        await redis.zadd(OUTBOX_KEY, {get_job_key('session', 'gone'): NOW})
+
+        assert await publish_outbox_messages() == 0
+        assert await redis.zcard(OUTBOX_KEY) == 0
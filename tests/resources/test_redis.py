@@ -0,0 +1,456 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for
+# more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program. If not, see
+# http://www.gnu.org/licenses/.
+
+import json
+import time
+from functools import partial
+
+import pytest
+
+from config import ConfigClass
+from resources import redis_project_session_job
+from resources.redis import SrvAioRedisSingleton
+from resources.redis_project_session_job import RETENTION_KEY
+from resources.redis_project_session_job import SessionJob
+from resources.redis_project_session_job import get_index_key
+from resources.redis_project_session_job import get_job_key
+from resources.redis_project_session_job import get_retention_grace
+from resources.redis_project_session_job import session_job_delete_status
+from resources.redis_project_session_job import session_job_export_expired
+from resources.redis_project_session_job import session_job_get_page
+from resources.redis_project_session_job import session_job_get_status
+from resources.redis_project_session_job import session_job_iter_changes
+from resources.redis_project_session_job import session_job_migrate_string_keys
+from resources.redis_project_session_job import session_job_set_status
+from resources.redis_project_session_job import session_job_update_status
+
+
+class TestSrvAioRedisSingleton:
+    async def test_instances_share_one_client_until_closed(self, monkeypatch):
+        monkeypatch.setattr(SrvAioRedisSingleton, '_SrvAioRedisSingleton__instance', None)
+        first = SrvAioRedisSingleton()
+        client = SrvAioRedisSingleton._SrvAioRedisSingleton__instance
+
+        second = SrvAioRedisSingleton()
+
+        assert first._SrvAioRedisSingleton__instance is second._SrvAioRedisSingleton__instance is client
+        await SrvAioRedisSingleton.close()
+        assert SrvAioRedisSingleton._SrvAioRedisSingleton__instance is None
+        SrvAioRedisSingleton()
+        assert SrvAioRedisSingleton._SrvAioRedisSingleton__instance is not client
+
+    async def test_iter_key_batches_yields_bounded_batches_of_matching_keys(self, redis, srv_redis):
+        await redis.mset({f'prefix:{index}': index for index in range(5)})
+        await redis.set('other:0', 0)
+
+        batches = [batch async for batch in srv_redis.iter_key_batches('prefix:*')]
+
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+        assert sorted(key for batch in batches for key in batch) == [f'prefix:{index}'.encode() for index in range(5)]
+
+    async def test_mget_by_prefix_returns_values_of_keys_with_prefix(self, redis, srv_redis):
+        await redis.mset({f'prefix:{index}': index for index in range(5)})
+        await redis.set('other:0', 0)
+
+        result = await srv_redis.mget_by_prefix('prefix')
+
+        assert sorted(result) == [str(index).encode() for index in range(5)]
+
+    async def test_mdele_by_prefix_deletes_keys_with_prefix(self, redis, srv_redis):
+        await redis.mset({f'prefix:{index}': index for index in range(5)})
+        await redis.set('other:0', 0)
+
+        result = await srv_redis.mdele_by_prefix('prefix')
+
+        assert sum(result) == 5
+        assert await redis.keys('*') == [b'other:0']
+
+
+class TestSessionJobStatus:
+    async def test_session_job_get_status_returns_jobs_matching_filters_newest_first(self, srv_redis, monkeypatch):
+        jobs = [('job1', 'data_transfer', 'admin'), ('job2', 'data_delete', 'admin'), ('job3', 'data_delete', 'user')]
+        for timestamp, (job_id, action, operator) in enumerate(jobs, start=1643041442):
+            monkeypatch.setattr(redis_project_session_job.time, 'time', partial(float, timestamp))
+            await session_job_set_status(
+                'session', 'Container', 'task', job_id, 'source', action, 'INIT', 'code', operator
+            )
+
+        result = await session_job_get_status('session', action='data_delete')
+
+        assert [job['job_id'] for job in result] == ['job3', 'job2']
+
+    async def test_session_job_get_status_intersects_indexes_of_several_filters(self, redis, srv_redis):
+        jobs = [('job1', 'data_transfer', 'admin'), ('job2', 'data_delete', 'admin'), ('job3', 'data_delete', 'user')]
+        for job_id, action, operator in jobs:
+            await session_job_set_status(
+                'session', 'Container', 'task', job_id, 'source', action, 'INIT', 'code', operator
+            )
+
+        result = await session_job_get_status('session', action='data_delete', operator='admin')
+
+        assert [job['job_id'] for job in result] == ['job2']
+        assert await redis.keys('index-intersection:*') == []
+
+    async def test_session_job_get_status_falls_back_to_scan_for_glob_filters(self, srv_redis):
+        for job_id in ['job1', 'job2', 'other']:
+            await session_job_set_status(
+                'session', 'Container', 'task', job_id, 'source', 'data_copy', 'INIT', 'code', 'me'
+            )
+
+        result = await session_job_get_status('session', job_id='job*')
+
+        assert sorted(job['job_id'] for job in result) == ['job1', 'job2']
+
+    async def test_session_job_get_status_skips_expired_jobs(self, redis, srv_redis):
+        await session_job_set_status(
+            'session', 'Container', 'task', 'job1', 'source', 'data_copy', 'INIT', 'code', 'me'
+        )
+        await redis.delete(get_job_key('session', 'job1'))
+
+        assert await session_job_get_status('session') == []
+
+    async def test_session_job_delete_status_removes_jobs_from_indexes(self, redis, srv_redis):
+        for job_id in ['job1', 'job2', 'job3']:
+            await session_job_set_status(
+                'session', 'Container', 'task', job_id, 'source', 'data_copy', 'INIT', 'code', 'me'
+            )
+
+        assert await session_job_delete_status('session', job_id='job2') == 1
+
+        assert [job['job_id'] for job in await session_job_get_status('session', code='code')] == ['job3', 'job1']
+        assert await redis.zrange(get_index_key('session', 'code', 'code'), 0, -1) == [
+            get_job_key('session', 'job1').encode(),
+            get_job_key('session', 'job3').encode(),
+        ]
+
+    async def test_session_job_set_status_replaces_job_in_indexes_and_keeps_message(self, redis, srv_redis):
+        session_job = SessionJob('session', 'code', 'data_copy', 'me', job_id='job1')
+        session_job.set_source('source')
+        session_job.set_status('RUNNING')
+        session_job.set_message({'event_type': 'folder_copy'})
+        await session_job.create()
+
+        session_job.set_status('TERMINATED')
+        await session_job.save()
+
+        assert await session_job_get_status('session', status='RUNNING') == []
+        assert [job['status'] for job in await session_job_get_status('session', status='TERMINATED')] == ['TERMINATED']
+        assert await redis.hget(get_job_key('session', 'job1'), 'outbox.message') == b'{"event_type": "folder_copy"}'
+
+    async def test_session_job_get_status_reads_exact_job_id_from_job_key(self, redis, srv_redis):
+        for job_id in ['job1', 'job2']:
+            await session_job_set_status(
+                'session', 'Container', 'task', job_id, 'source', 'data_copy', 'INIT', 'code', 'me'
+            )
+
+        assert [job['job_id'] for job in await session_job_get_status('session', job_id='job2')] == ['job2']
+        assert await session_job_get_status('session', job_id='job2', code='other') == []
+        assert await session_job_get_status('session', job_id='job3') == []
+        assert await redis.keys(get_index_key('session', 'job_id', '*')) == []
+
+    async def test_session_job_delete_status_with_glob_filter_returns_number_of_deleted_jobs(self, redis, srv_redis):
+        for job_id in ['job1', 'job2', 'job3']:
+            await session_job_set_status(
+                'session', 'Container', 'task', job_id, 'source', 'data_copy', 'INIT', 'code', 'me'
+            )
+
+        assert await session_job_delete_status('session', job_id='job*') == 3
+        assert await redis.keys('dataaction*') == []
+
+    async def test_session_job_migrate_string_keys_moves_jobs_into_hashes(self, redis, srv_redis):
+        await session_job_set_status(
+            'session', 'Container', 'task', 'job1', 'source', 'data_copy', 'RUNNING', 'code', 'me'
+        )
+        update_timestamp = round(time.time()) - 10
+        for job_id, status in [('job1', 'INIT'), ('job2', 'SUCCEED'), ('job3', 'INIT')]:
+            key = f'dataaction:session:Container:{job_id}:data_copy:code:me:source'
+            record = {
+                'session_id': 'session',
+                'label': 'Container',
+                'task_id': 'task',
+                'job_id': job_id,
+                'source': 'source',
+                'action': 'data_copy',
+                'status': status,
+                'code': 'code',
+                'operator': 'me',
+                'progress': 0,
+                'payload': None,
+                'update_timestamp': str(update_timestamp),
+            }
+            await redis.set(key, json.dumps(record))
+            await redis.zadd(get_index_key('session'), {key: update_timestamp})
+
+        assert await session_job_migrate_string_keys() == 2
+
+        jobs = await session_job_get_status('session')
+        assert sorted((job['job_id'], job['status'], job['payload']) for job in jobs) == [
+            ('job1', 'RUNNING', {}),
+            ('job2', 'SUCCEED', {}),
+            ('job3', 'INIT', {}),
+        ]
+        assert await redis.keys('dataaction:*') == []
+        assert await session_job_migrate_string_keys() == 0
+
+
+class TestSessionJobUpdate:
+    async def test_update_writes_changed_fields_and_grows_payload(self, redis, srv_redis):
+        await session_job_set_status(
+            'session', 'Container', 'task', 'job1', 'source', 'data_copy', 'INIT', 'code', 'me', {'source': 'a'}
+        )
+        job = SessionJob('session', '*', '*', '*', job_id='job1')
+        job.set_progress(50)
+        job.add_payload('destination', 'b')
+
+        await job.update()
+
+        assert job.status == 'INIT'
+        assert job.progress == 50
+        assert job.payload == {'source': 'a', 'destination': 'b'}
+        assert await redis.hget(get_job_key('session', 'job1'), 'payload.destination') == b'"b"'
+
+    async def test_update_moves_job_to_top_of_indexes(self, redis, srv_redis, monkeypatch):
+        for timestamp, job_id in enumerate(['job1', 'job2'], start=1643041442):
+            monkeypatch.setattr(redis_project_session_job.time, 'time', partial(float, timestamp))
+            await session_job_set_status(
+                'session', 'Container', 'task', job_id, 'source', 'data_copy', 'INIT', 'c', 'me'
+            )
+        monkeypatch.setattr(redis_project_session_job.time, 'time', partial(float, 1643041450))
+
+        await session_job_update_status('session', 'Container', 'job1', {'status': 'SUCCEED'})
+
+        assert [job['job_id'] for job in await session_job_get_status('session')] == ['job1', 'job2']
+
+    async def test_update_returns_none_for_unknown_job_or_label(self, srv_redis):
+        await session_job_set_status('session', 'Container', 'task', 'job1', 'source', 'data_copy', 'INIT', 'c', 'me')
+
+        assert await session_job_update_status('session', 'Container', 'job2', {'status': 'SUCCEED'}) is None
+        assert await session_job_update_status('session', 'Dataset', 'job1', {'status': 'SUCCEED'}) is None
+
+
+class TestSessionJobCreate:
+    def make_job(self, job_id):
+        job = SessionJob('session', 'code', 'data_copy', 'me')
+        job.set_job_id(job_id)
+        job.set_source('source')
+        job.set_status('INIT')
+        return job
+
+    async def test_save_many_creates_jobs_with_unused_job_ids(self, redis, srv_redis):
+        await self.make_job('job1').create()
+
+        created = await SessionJob.save_many([self.make_job('job1'), self.make_job('job2')])
+
+        assert created == [False, True]
+        assert sorted(job['job_id'] for job in await session_job_get_status('session')) == ['job1', 'job2']
+        assert await redis.zcard(get_index_key('session')) == 2
+
+    async def test_create_raises_for_used_job_id(self, srv_redis):
+        await self.make_job('job1').create()
+
+        with pytest.raises(Exception, match='job id already exists: job1'):
+            await self.make_job('job1').create()
+
+
+class TestSessionJobRetention:
+    @pytest.fixture
+    def export_enabled(self, monkeypatch):
+        monkeypatch.setattr(ConfigClass, 'SESSION_JOB_EXPORT_ENABLED', True)
+        monkeypatch.setattr(ConfigClass, 'SESSION_JOB_EXPORT_INTERVAL', 60)
+        monkeypatch.setattr(ConfigClass, 'SESSION_JOB_SUCCEED_TTL', 100)
+        monkeypatch.setattr(redis_project_session_job.time, 'time', partial(float, 1643041442))
+
+    async def test_set_status_expires_jobs_after_retention_of_their_status(self, redis, srv_redis, monkeypatch):
+        monkeypatch.setattr(ConfigClass, 'SESSION_JOB_SUCCEED_TTL', 100)
+        monkeypatch.setattr(ConfigClass, 'SESSION_JOB_TERMINATED_TTL', 1000)
+        for job_id, status in [('job1', 'INIT'), ('job2', 'SUCCEED'), ('job3', 'TERMINATED')]:
+            await session_job_set_status(
+                'session', 'Container', 'task', job_id, 'source', 'data_copy', status, 'c', 'me'
+            )
+
+        grace = get_retention_grace()
+        assert await redis.ttl(get_job_key('session', 'job1')) == ConfigClass.SESSION_JOB_TTL + grace
+        assert await redis.ttl(get_job_key('session', 'job2')) == 100 + grace
+        assert await redis.ttl(get_job_key('session', 'job3')) == 1000 + grace
+        assert await redis.ttl(get_index_key('session')) == ConfigClass.SESSION_JOB_TTL + grace
+        assert await redis.zcard(RETENTION_KEY) == 3
+
+    async def test_update_applies_retention_of_new_status(self, redis, srv_redis, monkeypatch):
+        monkeypatch.setattr(ConfigClass, 'SESSION_JOB_TERMINATED_TTL', 1000)
+        await session_job_set_status('session', 'Container', 'task', 'job1', 'source', 'data_copy', 'INIT', 'c', 'me')
+
+        await session_job_update_status('session', 'Container', 'job1', {'status': 'TERMINATED'})
+
+        assert await redis.ttl(get_job_key('session', 'job1')) == 1000 + get_retention_grace()
+
+    async def test_export_keeps_jobs_for_grace_period_and_tracks_retention_end(self, redis, srv_redis, export_enabled):
+        await session_job_set_status('session', 'Container', 'task', 'job1', 'source', 'data_copy', 'INIT', 'c', 'me')
+
+        await session_job_update_status('session', 'Container', 'job1', {'status': 'SUCCEED'})
+
+        assert await redis.ttl(get_job_key('session', 'job1')) == 100 + 3600
+        assert await redis.zscore(RETENTION_KEY, get_job_key('session', 'job1')) == 1643041442 + 100
+
+    async def test_export_expired_passes_expired_jobs_to_export_and_removes_them(
+        self, redis, srv_redis, export_enabled, monkeypatch
+    ):
+        for job_id, status in [('job1', 'SUCCEED'), ('job2', 'INIT')]:
+            await session_job_set_status(
+                'session', 'Container', 'task', job_id, 'source', 'data_copy', status, 'c', 'me'
+            )
+        monkeypatch.setattr(redis_project_session_job.time, 'time', partial(float, 1643041442 + 100))
+        exported = []
+
+        async def export(records):
+            exported.extend(records)
+
+        assert await session_job_export_expired(export, 10) == 1
+
+        assert [job['job_id'] for job in exported] == ['job1']
+        assert [job['job_id'] for job in await session_job_get_status('session')] == ['job2']
+        assert await redis.zrange(get_index_key('session', 'job_id', 'job1'), 0, -1) == []
+        assert await redis.zrange(RETENTION_KEY, 0, -1) == [get_job_key('session', 'job2').encode()]
+
+    async def test_export_expired_keeps_jobs_updated_during_export(self, redis, srv_redis, export_enabled, monkeypatch):
+        await session_job_set_status(
+            'session', 'Container', 'task', 'job1', 'source', 'data_copy', 'SUCCEED', 'c', 'me'
+        )
+        monkeypatch.setattr(redis_project_session_job.time, 'time', partial(float, 1643041442 + 100))
+
+        async def export(records):
+            await session_job_update_status('session', 'Container', 'job1', {'progress': 100})
+
+        assert await session_job_export_expired(export, 10) == 1
+
+        assert [job['job_id'] for job in await session_job_get_status('session')] == ['job1']
+
+    async def test_export_expired_does_not_export_jobs_which_already_expired(
+        self, redis, srv_redis, export_enabled, monkeypatch
+    ):
+        await session_job_set_status(
+            'session', 'Container', 'task', 'job1', 'source', 'data_copy', 'SUCCEED', 'c', 'me'
+        )
+        await redis.delete(get_job_key('session', 'job1'))
+        monkeypatch.setattr(redis_project_session_job.time, 'time', partial(float, 1643041442 + 100))
+        exported = []
+
+        async def export(records):
+            exported.extend(records)
+
+        assert await session_job_export_expired(export, 10) == 1
+
+        assert exported == []
+        assert await redis.exists(RETENTION_KEY) == 0
+
+    async def test_export_expired_without_export_removes_jobs_from_pages(self, redis, srv_redis, monkeypatch):
+        monkeypatch.setattr(ConfigClass, 'SESSION_JOB_SUCCEED_TTL', 100)
+        monkeypatch.setattr(redis_project_session_job.time, 'time', partial(float, 1643041442))
+        for job_id, status in [('job1', 'SUCCEED'), ('job2', 'INIT'), ('job3', 'SUCCEED')]:
+            await session_job_set_status(
+                'session', 'Container', 'task', job_id, 'source', 'data_copy', status, 'c', 'me'
+            )
+        monkeypatch.setattr(redis_project_session_job.time, 'time', partial(float, 1643041442 + 100))
+
+        assert await session_job_export_expired(None, 10) == 2
+
+        page = await session_job_get_page('session', page_size=1)
+        assert [job['job_id'] for job in page.jobs] == ['job2']
+        assert (page.total, page.next_cursor) == (1, None)
+        assert await redis.exists(get_job_key('session', 'job1'), get_job_key('session', 'job3')) == 0
+
+
+class TestSessionJobChanges:
+    async def test_iter_changes_yields_snapshot_then_coalesced_changes(self, srv_redis):
+        await session_job_set_status('session', 'Container', 'task', 'job1', 'source', 'data_copy', 'INIT', 'c', 'me')
+        changes = session_job_iter_changes('session', coalesce_interval=0.05, heartbeat_interval=1)
+
+        event, snapshot = await changes.__anext__()
+        for progress in [10, 20, 30]:
+            await session_job_update_status('session', 'Container', 'job1', {'progress': progress})
+        await session_job_set_status('session', 'Dataset', 'task', 'job2', 'source', 'data_copy', 'INIT', 'c', 'me')
+        await session_job_delete_status('session', job_id='job1')
+        event_changes, data_changes = await changes.__anext__()
+        await changes.aclose()
+
+        assert (event, [job['job_id'] for job in snapshot]) == ('snapshot', ['job1'])
+        assert event_changes == 'changes'
+        assert [(change['change'], change['job']['job_id']) for change in data_changes] == [('delete', 'job1')]
+        assert data_changes[0]['job']['progress'] == 30
+
+    async def test_iter_changes_yields_heartbeat_when_nothing_changed(self, srv_redis):
+        changes = session_job_iter_changes('session', coalesce_interval=0.01, heartbeat_interval=0.01)
+
+        events = [await changes.__anext__(), await changes.__anext__()]
+        await changes.aclose()
+
+        assert events == [('snapshot', []), ('heartbeat', [])]
+
+
+class TestSessionJobPage:
+    async def create_jobs(self, monkeypatch, timestamps):
+        for number, timestamp in enumerate(timestamps, start=1):
+            monkeypatch.setattr(redis_project_session_job.time, 'time', partial(float, timestamp))
+            await session_job_set_status(
+                'session', 'Container', 'task', f'job{number}', 'source', 'data_copy', 'INIT', 'c', 'me'
+            )
+
+    async def get_all_pages(self, page_size, **filters):
+        pages = [await session_job_get_page('session', page_size=page_size, **filters)]
+        while pages[-1].next_cursor:
+            pages.append(
+                await session_job_get_page('session', cursor=pages[-1].next_cursor, page_size=page_size, **filters)
+            )
+        return pages
+
+    async def test_get_page_returns_pages_newest_first(self, srv_redis, monkeypatch):
+        await self.create_jobs(monkeypatch, [1643041441, 1643041442, 1643041443, 1643041444, 1643041445])
+
+        pages = await self.get_all_pages(2)
+
+        assert [[job['job_id'] for job in page.jobs] for page in pages] == [
+            ['job5', 'job4'],
+            ['job3', 'job2'],
+            ['job1'],
+        ]
+        assert [(page.total, page.page) for page in pages] == [(5, 0), (5, 1), (5, 2)]
+
+    async def test_get_page_continues_within_jobs_updated_at_same_time(self, srv_redis, monkeypatch):
+        await self.create_jobs(monkeypatch, [1643041441, 1643041442, 1643041442, 1643041442, 1643041442])
+
+        pages = await self.get_all_pages(3)
+
+        job_ids = [job['job_id'] for page in pages for job in page.jobs]
+        assert sorted(job_ids[:4]) == ['job2', 'job3', 'job4', 'job5']
+        assert job_ids[4:] == ['job1']
+
+    async def test_get_page_filters_by_status_and_time_range(self, srv_redis, monkeypatch):
+        await self.create_jobs(monkeypatch, [1643041441, 1643041442, 1643041443, 1643041444])
+        await session_job_update_status('session', 'Container', 'job1', {'status': 'SUCCEED'})
+        await session_job_update_status('session', 'Container', 'job3', {'status': 'SUCCEED'})
+
+        init_page = await session_job_get_page('session', status='INIT', updated_before=1643041443)
+        succeed_page = await session_job_get_page('session', status='SUCCEED')
+
+        assert [job['job_id'] for job in init_page.jobs] == ['job2']
+        assert [job['job_id'] for job in succeed_page.jobs] == ['job3', 'job1']
+
+    async def test_get_page_raises_for_glob_filters(self, srv_redis):
+        with pytest.raises(ValueError):
+            await session_job_get_page('session', job_id='job*')
+
+    async def test_get_page_returns_single_page_for_exact_job_id(self, srv_redis, monkeypatch):
+        await self.create_jobs(monkeypatch, [1643041441, 1643041442])
+
+        page = await session_job_get_page('session', job_id='job1')
+
+        assert [job['job_id'] for job in page.jobs] == ['job1']
+        assert (page.total, page.page, page.next_cursor) == (1, 0, None)
@@ -0,0 +1,36 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify it under the terms of the GNU Affero General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program. If not,
+# see http://www.gnu.org/licenses/.
+
+
+import asyncio
+
+from resources.session_job_archive import ARCHIVE_LOCK_KEY
+from resources.session_job_archive import renew_archive_lock
+
+
+class TestSessionJobArchiver:
+    async def test_renew_archive_lock_keeps_lock_past_interval(self, redis, srv_redis):
+        await redis.set(ARCHIVE_LOCK_KEY, 'token', ex=1)
+        renewal = asyncio.create_task(renew_archive_lock('token', 1))
+        try:
+            await asyncio.sleep(1.5)
+
+            assert await redis.get(ARCHIVE_LOCK_KEY) == b'token'
+        finally:
+            renewal.cancel()
+
+    async def test_renew_archive_lock_stops_once_lock_is_lost(self, redis, srv_redis):
+        await redis.set(ARCHIVE_LOCK_KEY, 'other', ex=10)
+
+        await asyncio.wait_for(renew_archive_lock('token', 0.3), 1)
+
+        assert await redis.ttl(ARCHIVE_LOCK_KEY) == 10
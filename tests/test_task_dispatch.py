@@ -14,9 +14,17 @@ import json
 
 import pytest
 
+from resources.redis_project_session_job import encode_record
+from resources.redis_project_session_job import session_job_get_status
+from resources.redis_project_session_job import session_job_set_status
+
 pytestmark = pytest.mark.asyncio
 
 
+def encode_hash(record):
+    return {field.encode(): value.encode() for field, value in encode_record(record).items()}
+
+
 @pytest.fixture
 async def create_fake_job(monkeypatch):
     from resources.redis import SrvAioRedisSingleton
@@ -40,59 +48,53 @@ async def create_fake_job(monkeypatch):
         'update_timestamp': '1643041442',
     }
 
-    async def fake_return(x, y):
-        return [bytes(json.dumps(record), 'utf-8')]
+    async def fake_return(x, indexes, min_score, max_score):
+        yield encode_hash(record)
 
-    monkeypatch.setattr(SrvAioRedisSingleton, 'mget_by_prefix', fake_return)
+    async def fake_get(x, keys):
+        return [encode_hash(record) for _ in keys]
+
+    async def fake_save(x, entries, index_ttl, nx):
+        return [False for _ in entries]
+
+    monkeypatch.setattr(SrvAioRedisSingleton, 'iter_hgetall_by_indexes', fake_return)
+    monkeypatch.setattr(SrvAioRedisSingleton, 'hgetall_many', fake_get)
+    monkeypatch.setattr(SrvAioRedisSingleton, 'hset_many_with_indexes', fake_save)
 
 
 @pytest.fixture
 async def create_fake_job_response(monkeypatch):
     from resources.redis import SrvAioRedisSingleton
 
-    async def fake_return(x, y):
-        return b''
+    async def fake_return(x, indexes, min_score, max_score):
+        for record in []:
+            yield record
 
-    monkeypatch.setattr(SrvAioRedisSingleton, 'mget_by_prefix', fake_return)
+    monkeypatch.setattr(SrvAioRedisSingleton, 'iter_hgetall_by_indexes', fake_return)
 
 
 @pytest.fixture
 async def create_fake_job_delete_response(monkeypatch):
     from resources.redis import SrvAioRedisSingleton
 
-    async def fake_return(x, y):
-        return b''
+    async def fake_return(x, keys):
+        return [{} for _ in keys]
 
-    monkeypatch.setattr(SrvAioRedisSingleton, 'mdele_by_prefix', fake_return)
+    monkeypatch.setattr(SrvAioRedisSingleton, 'hgetall_many', fake_return)
 
 
 @pytest.fixture
 async def fake_job_save_status(monkeypatch):
     from resources.redis import SrvAioRedisSingleton
 
-    record = {
-        'session_id': '12345',
-        'label': 'testlabel',
-        'source': 'any',
-        'task_id': '5678',
-        'job_id': 'fake_global_entity_id',
-        'action': 'data_transfer',
-        'status': 'TRANSFER',
-        'code': 'any',
-        'operator': 'me',
-        'progress': 'SUCCESS',
-        'payload': {
-            'task_id': 'fake_global_entity_id',
-            'resumable_identifier': 'fake_global_entity_id',
-            'parent_folder_geid': None,
-        },
-        'update_timestamp': '1643041442',
-    }
+    async def fake_return(x, entries, index_ttl, nx):
+        return [True for _ in entries]
 
-    async def fake_return(x, y, z):
-        return [bytes(json.dumps(record), 'utf-8')]
+    async def fake_publish(x, messages):
+        return [0 for _ in messages]
 
-    monkeypatch.setattr(SrvAioRedisSingleton, 'set_by_key', fake_return)
+    monkeypatch.setattr(SrvAioRedisSingleton, 'hset_many_with_indexes', fake_return)
+    monkeypatch.setattr(SrvAioRedisSingleton, 'publish_many', fake_publish)
 
 
 @pytest.fixture
@@ -118,39 +120,28 @@ async def create_fake_job_updated(monkeypatch):
         'update_timestamp': '1643041442',
     }
 
-    async def fake_return(x, y):
-        return [bytes(json.dumps(record), 'utf-8')]
+    async def fake_return(x, script, calls):
+        return [[item for field_value in encode_hash(record).items() for item in field_value] for _ in calls]
+
+    async def fake_publish(x, messages):
+        return [0 for _ in messages]
 
-    monkeypatch.setattr(SrvAioRedisSingleton, 'mget_by_prefix', fake_return)
+    monkeypatch.setattr(SrvAioRedisSingleton, 'run_script_many', fake_return)
+    monkeypatch.setattr(SrvAioRedisSingleton, 'publish_many', fake_publish)
 
 
 @pytest.fixture
 async def fake_job_save_status_updated_task(monkeypatch):
     from resources.redis import SrvAioRedisSingleton
 
-    record = {
-        'session_id': '12345',
-        'label': 'testlabel',
-        'source': 'any',
-        'task_id': '5678',
-        'job_id': 'fake_global_entity_id',
-        'action': 'data_transfer',
-        'status': 'TRANSFER',
-        'code': 'any',
-        'operator': 'me',
-        'progress': 'SUCCESS',
-        'payload': {
-            'task_id': 'fake_global_entity_id',
-            'resumable_identifier': 'fake_global_entity_id',
-            'parent_folder_geid': 'newgeid',
-        },
-        'update_timestamp': '1643041442',
-    }
+    async def fake_return(x, entries, index_ttl, nx):
+        return [True for _ in entries]
 
-    async def fake_return(x, y, z):
-        return [bytes(json.dumps(record), 'utf-8')]
+    async def fake_publish(x, messages):
+        return [0 for _ in messages]
 
-    monkeypatch.setattr(SrvAioRedisSingleton, 'set_by_key', fake_return)
+    monkeypatch.setattr(SrvAioRedisSingleton, 'hset_many_with_indexes', fake_return)
+    monkeypatch.setattr(SrvAioRedisSingleton, 'publish_many', fake_publish)
 
 
 async def test_v1_create_new_redis_task_return_200(test_client, create_fake_job_response, fake_job_save_status):
@@ -204,9 +195,9 @@ async def test_v1_create_new_redis_task_with_duplicate_job_id_return_500(test_cl
 async def test_v1_get_redis_task_return_200(test_client, create_fake_job):
     payload = {
         'session_id': '12345',
-        'label': 'Container',
+        'label': 'testlabel',
         'job_id': 'fake_global_entity_id',
-        'code': 'testcode',
+        'code': 'any',
         'action': 'data_transfer',
         'operator': 'me',
         'source': 'any',
@@ -248,3 +239,104 @@ async def test_v1_update_redis_task_return_200(test_client, create_fake_job_upda
     res = response.json()['result']
     assert response.status_code == 200
     assert res['payload']['parent_folder_geid'] == 'newgeid'
+
+
+async def test_v1_bulk_create_redis_tasks_returns_result_for_each_task(test_client, srv_redis):
+    item = {
+        'session_id': '12345',
+        'task_id': '5678',
+        'source': 'any',
+        'action': 'data_upload',
+        'target_status': 'INIT',
+        'operator': 'me',
+        'code': 'testcode',
+    }
+    items = [dict(item, job_id=job_id) for job_id in ['job1', 'job2', 'job1']]
+
+    response = await test_client.post('/v1/tasks/bulk', json={'items': items})
+
+    assert response.status_code == 200
+    assert [(res['job_id'], res['status']) for res in response.json()['result']] == [
+        ('job1', 'SUCCEED'),
+        ('job2', 'SUCCEED'),
+        ('job1', 'FAILED'),
+    ]
+
+
+async def test_v1_bulk_update_redis_tasks_returns_updated_tasks(test_client, srv_redis):
+    await session_job_set_status('12345', 'Container', '5678', 'job1', 'any', 'data_upload', 'INIT', 'code', 'me')
+    items = [
+        {'session_id': '12345', 'job_id': 'job1', 'status': 'SUCCEED', 'progress': 100, 'add_payload': {'a': 1}},
+        {'session_id': '12345', 'job_id': 'job2', 'status': 'SUCCEED'},
+    ]
+
+    response = await test_client.put('/v1/tasks/bulk', json={'items': items})
+
+    assert response.status_code == 200
+    result = response.json()['result']
+    assert result[0]['status'] == 'SUCCEED'
+    assert result[0]['result']['status'] == 'SUCCEED'
+    assert result[0]['result']['payload'] == {'a': 1}
+    assert result[1] == {'job_id': 'job2', 'status': 'FAILED', 'error_msg': 'job not found', 'result': None}
+
+
+async def test_v1_bulk_delete_redis_tasks_returns_number_of_deleted_tasks(test_client, srv_redis):
+    for job_id in ['job1', 'job2', 'job3']:
+        await session_job_set_status('12345', 'Container', '5678', job_id, 'any', 'data_upload', 'INIT', 'code', 'me')
+    items = [
+        {'session_id': '12345', 'job_id': 'job1'},
+        {'session_id': '12345', 'job_id': 'job1', 'code': 'other'},
+        {'session_id': '12345'},
+    ]
+
+    response = await test_client.delete('/v1/tasks/bulk', json={'items': items})
+
+    assert response.status_code == 200
+    assert [res['result'] for res in response.json()['result']] == [1, 0, 2]
+    assert await session_job_get_status('12345') == []
+
+
+async def test_v1_stream_redis_tasks_sends_snapshot_event(test_client, srv_redis):
+    await session_job_set_status('12345', 'Container', '5678', 'job1', 'any', 'data_upload', 'INIT', 'code', 'me')
+
+    response = await test_client.get('/v1/tasks/stream', query_string={'session_id': '12345'}, stream=True)
+    chunk = await response.iter_content(1024).__anext__()
+    response.send({'type': 'http.disconnect'})
+    await response.receive_or_fail()
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/event-stream')
+    event, data = chunk.decode().split('\n')[:2]
+    assert event == 'event: snapshot'
+    assert [job['job_id'] for job in json.loads(data.replace('data: ', '', 1))] == ['job1']
+
+
+async def test_v1_stream_redis_tasks_with_glob_session_id_return_400(test_client):
+    response = await test_client.get('/v1/tasks/stream', query_string={'session_id': '123*'})
+
+    assert response.status_code == 400
+
+
+async def test_v1_get_redis_tasks_with_page_size_returns_page_and_next_cursor(test_client, srv_redis):
+    for job_id in ['job1', 'job2', 'job3']:
+        await session_job_set_status('12345', 'Container', '5678', job_id, 'any', 'data_upload', 'INIT', 'code', 'me')
+
+    response = await test_client.get('/v1/tasks/', query_string={'session_id': '12345', 'page_size': 2})
+    next_response = await test_client.get(
+        '/v1/tasks/', query_string={'session_id': '12345', 'page_size': 2, 'cursor': response.json()['next_cursor']}
+    )
+
+    assert response.status_code == 200
+    assert (response.json()['total'], response.json()['num_of_pages'], response.json()['page']) == (3, 2, 0)
+    assert len(response.json()['result']) == 2
+    assert next_response.json()['page'] == 1
+    assert next_response.json()['next_cursor'] is None
+    job_ids = [job['job_id'] for job in response.json()['result'] + next_response.json()['result']]
+    assert sorted(job_ids) == ['job1', 'job2', 'job3']
+
+
+async def test_v1_get_redis_tasks_with_invalid_cursor_return_400(test_client, srv_redis):
+    response = await test_client.get('/v1/tasks/', query_string={'session_id': '12345', 'cursor': 'invalid'})
+
+    assert response.status_code == 400
+    assert response.json()['error_msg'] == 'Invalid cursor: invalid'